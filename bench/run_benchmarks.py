@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Benchmarks pyrad-feature-summary and pyrad-loci2fasta on synthetic data
+
+Each tool is timed end to end (wall time and peak RSS of the process) and the
+main stages are timed in-process.  Results are written as JSON and can be
+compared against the results of an earlier run to spot regressions.
+'''
+
+import os, sys, argparse, json, platform, shutil, subprocess, tempfile, time
+
+import synthetic_pyrad
+
+SRCDIR = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "rad-pipeline"))
+sys.path.insert(0, SRCDIR)
+
+import loci, loci_store, consensus
+
+
+def _runProcess(cmd, env=None):
+    '''Runs cmd (output discarded) returning (seconds, peak rss in KB)'''
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        p = subprocess.Popen(cmd, stdout=devnull, env=env)
+        _, status, usage = os.wait4(p.pid, 0)
+        elapsed = time.time() - start
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise RuntimeError("command failed: %s" % " ".join(cmd))
+    return (elapsed, usage.ru_maxrss)
+
+
+def _timeCall(func):
+    '''Times a single call of func'''
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def endToEndCases(locifilename, vcffilename, storefilename, jobs):
+    '''The end to end commands to benchmark, (name, command)'''
+    summary = [sys.executable, os.path.join(SRCDIR, "pyrad-feature-summary.py")]
+    fasta = [sys.executable, os.path.join(SRCDIR, "pyrad-loci2fasta.py")]
+    cases = [
+        ("feature-summary", summary + ["--no-cache", locifilename, vcffilename]),
+        ("feature-summary --index", summary + ["--no-cache", "--index", locifilename, vcffilename]),
+        ("feature-summary --stream", summary + ["--no-cache", "--stream", locifilename, vcffilename]),
+        ("feature-summary --jobs %s" % jobs, summary + ["--no-cache", "--jobs", str(jobs), locifilename, vcffilename]),
+        ("feature-summary --stats", summary + ["--no-cache", "--stats", os.devnull, locifilename, vcffilename]),
+        ("feature-summary (cached)", summary + [locifilename, vcffilename]),
+        ("feature-summary (store)", summary + ["--no-cache", storefilename, vcffilename]),
+        ("loci2fasta first", fasta + ["-m", "first", locifilename]),
+        ("loci2fasta all", fasta + ["-m", "all", locifilename]),
+        ("loci2fasta consensus", fasta + ["-m", "consensus", locifilename]),
+    ]
+    return cases
+
+
+def stageCases(locifilename, storefilename):
+    '''The in-process stages to benchmark, (name, function)'''
+    records = list(loci.iterLoci(locifilename))
+    return [
+        ("stage: parse loci", lambda: sum(1 for _ in loci.iterLoci(locifilename))),
+        ("stage: parse store", lambda: sum(1 for _ in loci.iterLoci(storefilename))),
+        ("stage: build index", lambda: loci.buildIndex(locifilename)),
+        ("stage: consensus", lambda: [consensus.makeConsensus(r[2]) for r in records]),
+        ("stage: consensus (pure python)", lambda: [consensus._makeConsensusPython(r[2]) for r in records if len(r[2]) > 0]),
+    ]
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints the change from baseline for each benchmark
+
+    @return: int, the number of regressions (slower by more than threshold)
+    '''
+    old = dict((r["name"], r) for r in baseline["results"])
+    regressions = 0
+    print ("")
+    print ("%-36s %10s %10s %8s" % ("Benchmark", "Baseline", "Current", "Ratio"))
+    for r in results["results"]:
+        if r["name"] not in old:
+            continue
+        ratio = r["best"] / max(old[r["name"]]["best"], 1e-9)
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print ("%-36s %9.3fs %9.3fs %7.2fx%s" % (r["name"], old[r["name"]]["best"], r["best"], ratio, flag))
+    return regressions
+
+
+def _main(argv):
+    '''Application main function'''
+
+    parser = argparse.ArgumentParser(prog="run_benchmarks", description='Benchmarks pyrad-feature-summary and pyrad-loci2fasta on synthetic data')
+
+    parser.add_argument("-o", "--output", nargs=1, metavar='file', default=["-"], help="The JSON results file. [Default: - (stdout)]")
+    parser.add_argument("--compare", nargs=1, metavar='file', help="Compare with the results in this (earlier) JSON file.")
+    parser.add_argument("--threshold", nargs=1, metavar='F', type=float, default=[1.10], help="Ratio above which a benchmark counts as a regression. [Default: 1.10]")
+    parser.add_argument("-n", "--repeat", nargs=1, metavar='N', type=int, default=[3], help="The number of times each benchmark is run. [Default: 3]")
+    parser.add_argument("-j", "--jobs", nargs=1, metavar='N', type=int, default=[4], help="The --jobs value used for feature-summary. [Default: 4]")
+    parser.add_argument("-s", "--samples", nargs=1, metavar='N', type=int, default=[50], help="The number of synthetic samples. [Default: 50]")
+    parser.add_argument("-l", "--loci", nargs=1, metavar='N', type=int, default=[5000], help="The number of synthetic loci. [Default: 5000]")
+    parser.add_argument("-r", "--read-length", nargs=1, metavar='N', type=int, default=[90], help="The synthetic read length. [Default: 90]")
+    parser.add_argument("-g", "--gap-rate", nargs=1, metavar='F', type=float, default=[0.02], help="The synthetic gap/N rate. [Default: 0.02]")
+    parser.add_argument("-p", "--snp-density", nargs=1, metavar='F', type=float, default=[0.02], help="The synthetic SNP density. [Default: 0.02]")
+    parser.add_argument("--seed", nargs=1, metavar='N', type=int, default=[1], help="The random seed. [Default: 1]")
+    parser.add_argument("--keep", nargs=1, metavar='dir', help="Generate the data in this directory and keep it.")
+
+    args = parser.parse_args(argv[1:])
+
+    if args.keep:
+        workdir = args.keep[0]
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+    else:
+        workdir = tempfile.mkdtemp(prefix="rad-pipeline-bench.")
+
+    dataset = {
+        "samples": args.samples[0], "loci": args.loci[0], "read_length": args.read_length[0],
+        "gap_rate": args.gap_rate[0], "snp_density": args.snp_density[0], "seed": args.seed[0],
+    }
+    results = {
+        "metadata": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "numpy": consensus._numpy() is not None,
+            "version": _version(),
+        },
+        "dataset": dataset,
+        "results": [],
+    }
+
+    try:
+        sys.stderr.write("Generating data in '%s'\n" % workdir)
+        locifilename, vcffilename = synthetic_pyrad.writeDataset(os.path.join(workdir, "synthetic"),
+            args.samples[0], args.loci[0], args.read_length[0], args.gap_rate[0], args.snp_density[0], seed=args.seed[0])
+        storefilename = "%s.lstore" % locifilename
+        loci_store.writeStore(loci.iterLoci(locifilename), storefilename)
+
+        env = dict(os.environ)
+        env["RAD_PIPELINE_CACHE_DIR"] = os.path.join(workdir, "cache")
+
+        for name, cmd in endToEndCases(locifilename, vcffilename, storefilename, args.jobs[0]):
+            sys.stderr.write("Running: %s\n" % name)
+            if name.endswith("(cached)"):
+                # fill the cache first
+                _runProcess(cmd, env)
+            runs = [_runProcess(cmd, env) for _ in xrange(args.repeat[0])]
+            results["results"].append({
+                "name": name, "kind": "end-to-end",
+                "seconds": [r[0] for r in runs], "best": min(r[0] for r in runs),
+                "maxrss_kb": max(r[1] for r in runs),
+            })
+
+        for name, func in stageCases(locifilename, storefilename):
+            sys.stderr.write("Running: %s\n" % name)
+            times = [_timeCall(func) for _ in xrange(args.repeat[0])]
+            results["results"].append({"name": name, "kind": "stage", "seconds": times, "best": min(times)})
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+    if args.output[0] == "-":
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output[0], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold[0]) > 0:
+            return 1
+
+    return 0
+# end _main()
+
+
+def _version():
+    '''The git version of the source tree (if available)'''
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=SRCDIR, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Generates synthetic pyRAD output (.loci and matching .vcf) for benchmarking
+
+The same seed and parameters always produce the same files.
+'''
+
+import sys, argparse, random
+
+_BASES = "ACGT"
+
+# IUPAC code for each heterozygous pair of bases
+_IUPAC = {"AG": "R", "CT": "Y", "CG": "S", "AT": "W", "GT": "K", "AC": "M"}
+
+
+def _het(a, b):
+    return _IUPAC["".join(sorted(a + b))]
+
+
+def writeDataset(prefix, samples=20, loci=1000, length=90, gaprate=0.02, snprate=0.02, coverage=0.75, seed=1):
+    '''
+    Writes PREFIX.loci and PREFIX.vcf
+
+    @param samples: int, the number of samples
+    @param loci: int, the number of loci
+    @param length: int, the (aligned) read length
+    @param gaprate: float, the chance a base in a read is a gap or N
+    @param snprate: float, the chance a column is a SNP
+    @param coverage: float, the chance each sample has a read at each locus
+    @param seed: int, the random seed
+    @return: tuple, (loci filename, vcf filename)
+    '''
+    rng = random.Random(seed)
+    names = ["sample%04d" % i for i in xrange(samples)]
+    width = max(len(n) for n in names) + 6
+    locifilename = "%s.loci" % prefix
+    vcffilename = "%s.vcf" % prefix
+
+    with open(locifilename, 'w') as lf, open(vcffilename, 'w') as vf:
+        vf.write("##fileformat=VCFv4.1\n")
+        vf.write("##source=synthetic_pyrad\n")
+        vf.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t%s\n" % "\t".join(names))
+
+        for locus in xrange(loci):
+            ref = [rng.choice(_BASES) for _ in xrange(length)]
+            snps = {}
+            for pos in xrange(length):
+                if rng.random() < snprate:
+                    snps[pos] = rng.choice([b for b in _BASES if b != ref[pos]])
+
+            members = [n for n in names if rng.random() < coverage]
+            if len(members) < 2:
+                members = rng.sample(names, 2)
+            genotypes = {}
+            for name in members:
+                read = list(ref)
+                gts = []
+                for pos in sorted(snps):
+                    gt = rng.choice(((0, 0), (0, 1), (1, 1)))
+                    gts.append(gt)
+                    if gt == (1, 1):
+                        read[pos] = snps[pos]
+                    elif gt == (0, 1):
+                        read[pos] = _het(ref[pos], snps[pos])
+                for pos in xrange(length):
+                    if rng.random() < gaprate:
+                        read[pos] = rng.choice("-N")
+                genotypes[name] = gts
+                lf.write(">%s%s\n" % (name.ljust(width), "".join(read)))
+
+            marks = [" "] * length
+            for pos in snps:
+                marks[pos] = "*"
+            lf.write("//%s%s|%s\n" % (" " * (width - 1), "".join(marks), locus))
+
+            for i, pos in enumerate(sorted(snps)):
+                calls = []
+                for name in names:
+                    if name in genotypes:
+                        calls.append("%s/%s" % genotypes[name][i])
+                    else:
+                        calls.append("./.")
+                vf.write("%s\t%s\t.\t%s\t%s\t13\tPASS\tNS=%s;DP=%s\tGT\t%s\n" % (
+                    locus, pos + 1, ref[pos], snps[pos], len(members), len(members) * 10, "\t".join(calls)))
+
+    return (locifilename, vcffilename)
+
+
+def _main(argv):
+    '''Application main function'''
+
+    parser = argparse.ArgumentParser(prog="synthetic_pyrad", description='Generates synthetic pyRAD output (.loci and matching .vcf) for benchmarking')
+
+    parser.add_argument("prefix", help="Output file prefix; PREFIX.loci and PREFIX.vcf are written.")
+    parser.add_argument("-s", "--samples", nargs=1, metavar='N', type=int, default=[20], help="The number of samples. [Default: 20]")
+    parser.add_argument("-l", "--loci", nargs=1, metavar='N', type=int, default=[1000], help="The number of loci. [Default: 1000]")
+    parser.add_argument("-r", "--read-length", nargs=1, metavar='N', type=int, default=[90], help="The aligned read length. [Default: 90]")
+    parser.add_argument("-g", "--gap-rate", nargs=1, metavar='F', type=float, default=[0.02], help="The chance a base is a gap or N. [Default: 0.02]")
+    parser.add_argument("-p", "--snp-density", nargs=1, metavar='F', type=float, default=[0.02], help="The chance a column is a SNP. [Default: 0.02]")
+    parser.add_argument("-c", "--coverage", nargs=1, metavar='F', type=float, default=[0.75], help="The chance a sample is present at a locus. [Default: 0.75]")
+    parser.add_argument("--seed", nargs=1, metavar='N', type=int, default=[1], help="The random seed. [Default: 1]")
+
+    args = parser.parse_args(argv[1:])
+
+    writeDataset(args.prefix, args.samples[0], args.loci[0], args.read_length[0],
+                 args.gap_rate[0], args.snp_density[0], args.coverage[0], args.seed[0])
+
+    return 0
+# end _main()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Collates the logs of the tasks of a rad-pipeline job array
+
+Task N writes PREFIX-N.log.  The MD5 hashes the tasks report (lines starting
+with 'MD5 ') are printed together, in task order, after a listing of the
+directory contents just as the single job scripts print them.  Tasks whose
+log is missing or incomplete are reported and make the exit code 1.
+'''
+
+import os, sys, argparse, subprocess
+
+# the last line written by each successful task
+COMPLETE = "Task %s complete"
+
+
+def taskLogFilename(prefix, task):
+    return "%s-%s.log" % (prefix, task)
+
+
+def collate(prefix, tasks, out=sys.stdout, logs=False):
+    '''
+    Collates the logs of tasks 1 to tasks
+    
+    @param prefix: string, the log filename prefix
+    @param tasks: int, the number of tasks
+    @param out: file, where the collated output is written
+    @param logs: bool, also write the full log of each task
+    @return: list, the tasks that are missing or incomplete
+    '''
+    failed = []
+    hashes = []
+    for task in xrange(1, tasks + 1):
+        logfilename = taskLogFilename(prefix, task)
+        try:
+            with open(logfilename) as f:
+                lines = f.readlines()
+        except IOError:
+            failed.append(task)
+            sys.stderr.write("Warning: task %s has no log ('%s')\n" % (task, logfilename))
+            continue
+        if len(lines) == 0 or lines[-1].strip() != COMPLETE % task:
+            failed.append(task)
+            sys.stderr.write("Warning: task %s did not complete (see '%s')\n" % (task, logfilename))
+        hashes.extend([line[4:] for line in lines if line.startswith("MD5 ")])
+        if logs:
+            out.write("## Task %s: %s\n" % (task, logfilename))
+            out.writelines(lines)
+            out.write("\n")
+    
+    # print details of output files (provenance)
+    out.write("\nDirectory Contents:\n")
+    out.flush()
+    subprocess.call(["ls", "-l"], stdout=out)
+    out.write("\nMD5 Hashes:\n")
+    out.writelines(hashes)
+    out.write("\n%s of %s tasks complete\n" % (tasks - len(failed), tasks))
+    return failed
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_collate_array", description='Collates the logs and MD5 hashes of the tasks of a job array')
+    
+    parser.add_argument("prefix", help="The task log prefix (task N logs to PREFIX-N.log).")
+    parser.add_argument("tasks", type=int, help="The number of tasks in the array.")
+    parser.add_argument("-l", "--logs", action='store_true', help="Also print the full log of each task.")
+    
+    args = parser.parse_args(argv[1:])
+    
+    failed = collate(args.prefix, args.tasks, logs=args.logs)
+    if len(failed) > 0:
+        sys.stderr.write("Error: task(s) %s failed or are still running\n" % ",".join(map(str, failed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
@@ -39,13 +39,20 @@ Created on 15/12/2014
 @author: Andrew Robinson
 '''
 
-import os, sys, subprocess, time
+import os, sys, fnmatch, time
+
+# environment variable holding the experiment directory (exported by job scripts)
+EXPERIMENT_ROOT_ENV = "RAD_PIPELINE_EXPERIMENT_ROOT"
+
 
 def makeExclusiveHeader(**kwargs):
-    '''Makes an exclusive slurm header'''
+    '''Makes an exclusive slurm header (see makeHeader for array jobs and the job history)'''
     allargs={"partition": "compute", "nodes": "1", "mem":"250000", "time": "8:00:00", "slurmconf": ""}
     allargs.update(kwargs)
     allargs["slurmconf"] = findSlurmConf()
+    allargs["experiment"] = _experimentExport()
+    allargs["array"] = _arrayDirectives(allargs)
+    allargs["jobinfo"] = _jobInfoExports(allargs)
     
     header="""#!/bin/bash
 #SBATCH --nodes={nodes}
@@ -53,42 +60,181 @@ def makeExclusiveHeader(**kwargs):
 #SBATCH --mem={mem}
 #SBATCH --time={time}
 #SBATCH --partition={partition}
-{slurmconf}
+{array}{slurmconf}{experiment}{jobinfo}
 """.format(**allargs)
     
     return header
 
 
 def makeHeader(**kwargs):
-    '''Makes a non-exclusive slurm header'''
+    '''
+    Makes a non-exclusive slurm header
+    
+    For array jobs give array (the task range, see makeArray) and output
+    (the log filename of each task).  Give stage, files and inputmb (see
+    resources.jobInfo) to record the job in the job history when it finishes.
+    '''
     allargs={"partition": "compute", "ntasks": "1", "mem":"1024", "time": "1:00:00", "slurmconf": ""}
     allargs.update(kwargs)
     allargs["slurmconf"] = findSlurmConf()
+    allargs["experiment"] = _experimentExport()
+    allargs["array"] = _arrayDirectives(allargs)
+    allargs["jobinfo"] = _jobInfoExports(allargs)
     
     header="""#!/bin/bash
 #SBATCH --ntasks={ntasks}
 #SBATCH --time={time}
 #SBATCH --mem-per-cpu={mem}
 #SBATCH --partition={partition}
-{slurmconf}
+{array}{slurmconf}{experiment}{jobinfo}
 """.format(**allargs)
     
     return header
 
+
+def _arrayDirectives(allargs):
+    '''Makes the #SBATCH lines for array jobs'''
+    lines = ""
+    if allargs.get("array"):
+        lines += "#SBATCH --array=%s\n" % allargs["array"]
+    if allargs.get("output"):
+        lines += "#SBATCH --output=%s\n" % allargs["output"]
+    return lines
+
+
+def addArrayArguments(parser, stage):
+    '''Adds the job array options (--array, --array-limit and --file-list) to parser'''
+    parser.add_argument("-a", "--array", action='store_true', help="Make a job array that processes one file per task.  Run the script with 'collate' after all tasks finish to collate their logs and MD5 hashes.")
+    parser.add_argument("--array-limit", nargs=1, metavar='N', type=int, default=[16], help="The maximum number of array tasks running at once, 0=no limit. [Default: 16]")
+    parser.add_argument("--file-list", nargs=1, metavar='file', default=["%s.files" % stage], help="The file listing the file of each array task. [Default: %s.files]" % stage)
+
+
+def addDeferredArgument(parser):
+    '''Adds the --deferred option (see expandFiles) to parser'''
+    parser.add_argument("--deferred", action='append', metavar='dir', default=[], help="An input directory written by an earlier job that hasn't run yet; its files are matched when this job runs instead of now.  May be repeated.")
+
+
+def addManifestArguments(parser, stage):
+    '''Adds the stage manifest options (--force and --manifest, see stage_manifest) to parser'''
+    parser.add_argument("--force", action='store_true', help="Reprocess every file, even those the stage manifest shows are already done.  Or export RAD_PIPELINE_FORCE=1 when running the script.")
+    parser.add_argument("--manifest", nargs=1, metavar='file', default=["%s.manifest" % stage], help="The stage manifest recording the files done, so reruns skip them. [Default: %s.manifest]" % stage)
+
+
+def manifestVars(args):
+    '''The template variables (manifest and force) for the stage manifest options'''
+    return {"manifest": args.manifest[0], "force": "1" if args.force else ""}
+
+
+def makeArray(files, filelistname, limit=0, deferred=()):
+    '''
+    Writes the file list of an array job (one file per task)
+    
+    @param files: array, the files to process
+    @param filelistname: string, the file list to write
+    @param limit: int, the maximum number of tasks running at once (0 = no limit)
+    @param deferred: array, the deferred directories given to expandFiles
+    @return: tuple, (the array task range, absolute path of the file list)
+    '''
+    for fn in files:
+        if isDeferred(fn, deferred):
+            raise ValueError("'%s' can't be split into array tasks until its files exist" % fn)
+    with open(filelistname, 'w') as f:
+        for fn in files:
+            f.write("%s\n" % fn)
+    array = "1-%s" % len(files)
+    if limit > 0:
+        array += "%%%s" % limit
+    return (array, os.path.abspath(filelistname))
+
+
+def _jobInfoExports(allargs):
+    '''Makes the lines that describe the job for the job history (see resources)'''
+    if not allargs.get("stage"):
+        return ""
+    return """export RAD_PIPELINE_JOB_STAGE={stage}
+export RAD_PIPELINE_JOB_FILES={files}
+export RAD_PIPELINE_JOB_INPUT_MB={inputmb}
+export RAD_PIPELINE_JOB_START=$(date +%s)
+""".format(**allargs)
+
+
+def _experimentExport():
+    '''Makes the line that passes the experiment directory on to job scripts'''
+    root = experimentContext().root
+    if root is None:
+        return ""
+    return "export %s=%s\n" % (EXPERIMENT_ROOT_ENV, quote(root))
+
+
+class ExperimentContext(object):
+    '''
+    The experiment a directory belongs to
+    
+    The experiment directory is the closest directory (the directory itself
+    or a parent) containing process.log.  When $RAD_PIPELINE_EXPERIMENT_ROOT
+    names a directory containing this one the search is skipped and
+    process.log is looked for there.  slurm.conf is the closest one in the
+    directory or a parent (whether in the experiment or above it).
+    '''
+    
+    def __init__(self, curdir="."):
+        self.curdir = os.path.realpath(curdir)
+        self.root = None
+        self.processlog = None
+        self.slurmconffilename = None
+        self._slurmconf = None
+        
+        envroot = os.environ.get(EXPERIMENT_ROOT_ENV)
+        if envroot and (self.curdir == envroot or self.curdir.startswith(envroot.rstrip("/") + "/")):
+            self.root = envroot
+            if os.path.isfile("%s/process.log" % envroot):
+                self.processlog = "%s/process.log" % envroot
+        
+        curdir = self.curdir
+        while curdir not in ('/', '/home'):
+            if self.slurmconffilename is None and os.path.isfile("%s/slurm.conf" % curdir):
+                self.slurmconffilename = "%s/slurm.conf" % curdir
+            if self.root is None and os.path.isfile("%s/process.log" % curdir):
+                self.processlog = "%s/process.log" % curdir
+                self.root = curdir
+            if self.slurmconffilename is not None and self.root is not None:
+                break
+            curdir = os.path.dirname(curdir)
+        
+        # the path of curdir within the experiment (with a trailing /)
+        self.relpath = ""
+        if self.root is not None and self.curdir != self.root:
+            self.relpath = "%s/" % os.path.relpath(self.curdir, self.root)
+    
+    def slurmConf(self):
+        '''The contents of slurm.conf (if it exists)'''
+        if self._slurmconf is None:
+            self._slurmconf = ""
+            if self.slurmconffilename is not None:
+                with open(self.slurmconffilename) as f:
+                    self._slurmconf = f.read()
+        return self._slurmconf
+    
+    def writelog(self, logentry):
+        '''writes logentry to the process.log file with current date/time'''
+        if self.processlog is not None:
+            with open(self.processlog, 'a') as f:
+                f.write("%s: [%s] %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), self.relpath, logentry));
+
+
+_contexts = {}
+
+def experimentContext():
+    '''The (cached) ExperimentContext of the current directory'''
+    curdir = os.path.realpath(".")
+    if curdir not in _contexts:
+        _contexts[curdir] = ExperimentContext(curdir)
+    return _contexts[curdir]
+
+
 def findSlurmConf():
     '''Searches for the slurm.conf file for the user (if it exists)'''
-    curdir = os.path.realpath(".")
-    slurmconffilename = None
-    while curdir not in ('/', '/home'):
-        if os.path.isfile("%s/slurm.conf"%curdir):
-            slurmconffilename = "%s/slurm.conf"%curdir
-            break
-        curdir = os.path.dirname(curdir)
-    if slurmconffilename is not None:
-        with open(slurmconffilename) as f:
-            tmp=f.read()
-        return tmp
-    return ""
+    return experimentContext().slurmConf()
 
 
 def quote(s):
@@ -106,45 +252,63 @@ def writecmd(argv):
 
 def writelog(logentry):
     '''writes logentry to the process.log file with current date/time'''
-    curdir = os.path.realpath(".")
-    procfilename = None
-    relpath = ""
-    while curdir not in ('/', '/home'):
-        if os.path.isfile("%s/process.log"%curdir):
-            procfilename = "%s/process.log"%curdir
-            break
-        relpath="%s/%s" % (os.path.basename(curdir), relpath)
-        curdir = os.path.dirname(curdir)
-    if procfilename is not None:
-        with open(procfilename, 'a') as f:
-            f.write("%s: [%s] %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), relpath, logentry));
+    experimentContext().writelog(logentry)
+
 
+_templates = {}
 
 def loadTemplate(name):
-    '''Loads a template file by name.'''
-    tmp=""
-    filename = os.path.realpath("%s/../share/rad-pipeline/templates/%s"%(os.path.dirname(os.path.abspath(__file__)),name))
-    with open(filename) as f:
-        tmp=f.read()
-    return tmp
+    '''Loads a template file by name (each template is only read once).'''
+    if name not in _templates:
+        tmp=""
+        srcdir = os.path.dirname(os.path.realpath(__file__))
+        for sharedir in ("%s/../../share" % srcdir, "%s/../share" % srcdir):
+            filename = os.path.realpath("%s/rad-pipeline/templates/%s" % (sharedir, name))
+            if os.path.isfile(filename):
+                with open(filename) as f:
+                    tmp=f.read()
+                break
+        _templates[name] = tmp
+    return _templates[name]
 
 
-def expandFiles(files, dirfilter="*", quiet=False):
+def expandFiles(files, dirfilter="*", quiet=False, canonical=True, deferred=()):
     '''
     Takes an array of filenames and expands any wildcards within
     
+    Wildcards (*, ? and [...]) are expanded like bash does; matches are
+    sorted and hidden files are only matched by patterns starting with '.'.
+    Each directory is listed at most once per call.
+    
+    Files within a deferred directory (the output of a job that hasn't run
+    yet) are not expanded; the patterns (dirfilter for the directory itself)
+    are returned for the job script to expand.
+    
     @param files: array, filenames to expand
     @param dirfilter: a wildcard filter to apply to directories
-    @return: array, the expanded list of files (must exist)
+    @param quiet: bool, don't warn about missing files and empty directories
+    @param canonical: bool, resolve symbolic links (otherwise paths are only made absolute)
+    @param deferred: array, directories whose files are expanded by the job script
+    @return: array, the expanded list of files (must exist unless deferred)
     '''
+    deferred = [os.path.abspath(d) for d in deferred]
+    listings = {}
     outfiles = []
     for fn in files:
-        if '*' in fn or '?' in fn:
-            fnexp = _expandFile(fn)
+        absfn = os.path.abspath(fn)
+        if absfn in deferred:
+            outfiles.append("%s/%s" % (fn.rstrip("/"), dirfilter))
+        elif len([d for d in deferred if absfn.startswith(d + "/")]) > 0:
+            outfiles.append(fn)
+        elif _isPattern(fn):
+            fnexp = _expandFile(fn, listings)
+            if fnexp is None:
+                # bash leaves unmatched patterns as they are
+                fnexp = [fn]
             for fne in fnexp:
                 if os.path.exists(fne):
                     if os.path.isdir(fne):
-                        direxp = _expandFile("%s/%s" % (fne, dirfilter))
+                        direxp = _expandFile("%s/%s" % (fne, dirfilter), listings)
                         if direxp is None:
                             if not quiet:
                                 sys.stderr.write("Warning: directory '%s' contains no matching files and will be ignored\n"%fne)
@@ -157,7 +321,7 @@ def expandFiles(files, dirfilter="*", quiet=False):
                         sys.stderr.write("Warning: file/directory '%s' does not exist and will be ignored\n"%fne)
         elif os.path.exists(fn):
             if os.path.isdir(fn):
-                direxp = _expandFile("%s/%s" % (fn, dirfilter))
+                direxp = _expandFile("%s/%s" % (fn, dirfilter), listings)
                 if direxp is None:
                     if not quiet:
                         sys.stderr.write("Warning: directory '%s' contains no matching files and will be ignored\n"%fn)
@@ -170,19 +334,78 @@ def expandFiles(files, dirfilter="*", quiet=False):
                 sys.stderr.write("Warning: file/directory '%s' does not exist and will be ignored\n"%fn)
     
     # make files canonical
-    outfiles = map(os.path.realpath, outfiles)
+    if canonical:
+        outfiles = map(os.path.realpath, outfiles)
+    else:
+        outfiles = map(os.path.abspath, outfiles)
     
     return outfiles
+
+
+def isDeferred(fn, deferred=()):
+    '''
+    Checks if fn was left for the job script to expand (see expandFiles)
+    
+    @param deferred: array, the deferred directories given to expandFiles
+    @return: bool, fn is a pattern in a deferred directory, or one that isn't an existing file (names may contain [)
+    '''
+    if not _isPattern(fn):
+        return False
+    absfn = os.path.abspath(fn)
+    for d in deferred:
+        if absfn.startswith(os.path.abspath(d) + "/"):
+            return True
+    return not os.path.exists(fn)
+
+
+def _isPattern(fn):
+    '''Checks if fn contains wildcards'''
+    return '*' in fn or '?' in fn or '[' in fn
+
+
+def _expandFile(fn, listings=None):
+    '''
+    Expands a single filename
     
+    @param listings: dict, directory listings to reuse (directory => names)
+    @return: array, the sorted matches or None if nothing matches
+    '''
+    if str(fn).strip() == "":
+        return None
+    if listings is None:
+        listings = {}
     
-def _expandFile(fn):
-    '''Expands a single filename'''
-    if str(fn).strip() != "":
-        cmd = ["bash", "-c", 'ls -1d %s' % fn]
-        try:
-            filelist = subprocess.check_output(cmd, stderr=subprocess.STDOUT).rstrip()
-            return filelist.split("\n")
-        except subprocess.CalledProcessError:
-            pass
-    return None
+    if fn.startswith("/"):
+        paths = ["/"]
+    else:
+        paths = [""]
+    for part in fn.split("/"):
+        if part == "":
+            continue
+        matches = []
+        for path in paths:
+            if _isPattern(part):
+                for name in _listDir(path, listings):
+                    if name.startswith(".") and not part.startswith("."):
+                        continue
+                    if fnmatch.fnmatchcase(name, part):
+                        matches.append(os.path.join(path, name))
+            elif os.path.lexists(os.path.join(path, part)):
+                matches.append(os.path.join(path, part))
+        paths = matches
+    
+    if fn.endswith("/"):
+        paths = ["%s/" % path for path in paths if os.path.isdir(path)]
+    if len(paths) == 0:
+        return None
+    return sorted(paths)
+
 
+def _listDir(dirname, listings):
+    '''Lists the names in dirname (once, see _expandFile)'''
+    if dirname not in listings:
+        try:
+            listings[dirname] = sorted(os.listdir(dirname or "."))
+        except OSError:
+            listings[dirname] = []
+    return listings[dirname]
@@ -0,0 +1,209 @@
+
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Consensus sequence engine for pyRAD loci
+
+Each locus is packed into a 2-D byte array (one row per aligned read) and the
+bases in every column are counted in a single vectorised pass.  Columns whose
+most abundant base is tied are resolved with the original per-column rule so
+the output is identical to the pure-Python implementation, which is used
+whenever numpy is not installed.
+
+The same column counts give the per-locus statistics (see makeConsensusStats).
+'''
+
+# numpy is optional and only imported when first needed (see _numpy)
+numpy = None
+_numpyChecked = False
+
+# characters that never contribute to a consensus base
+_IGNORE = ('-', 'N')
+
+# the nucleotides (bit mask of A, C, G, T) represented by each IUPAC code
+_NUCLEOTIDES = {
+    'A': 1, 'C': 2, 'G': 4, 'T': 8,
+    'R': 5, 'Y': 10, 'S': 6, 'W': 9, 'K': 12, 'M': 3,
+    'B': 14, 'D': 13, 'H': 11, 'V': 7,
+}
+
+
+def _numpy():
+    '''Imports numpy on first use, None if it is not installed'''
+    global numpy, _numpyChecked
+    if not _numpyChecked:
+        _numpyChecked = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+def makeConsensus(sequences):
+    '''Creates a consensus sequence from provided sequences'''
+
+    if len(sequences) > 0:
+        if _numpy() is not None:
+            return _makeConsensusNumpy(sequences)[0]
+        return _makeConsensusPython(sequences)[0]
+    return ""
+
+
+def makeConsensusStats(sequences):
+    '''
+    Creates a consensus sequence and statistics from provided sequences
+
+    The statistics are:
+     - READS: the number of reads
+     - LENGTH: the length of the alignment
+     - COVERAGE: mean number of called (not gap or N) bases per column
+     - MISSING: fraction of bases that are gaps or N
+     - SEGREGATING: number of columns with more than one nucleotide (after
+       expanding ambiguity codes)
+
+    @return: tuple, (consensus, statistics)
+    '''
+
+    if len(sequences) > 0:
+        if _numpy() is not None:
+            return _makeConsensusNumpy(sequences, True)
+        return _makeConsensusPython(sequences, True)
+    return ("", (0, 0, 0.0, 0.0, 0))
+
+
+def _columnCounts(sequences, i):
+    '''Counts the bases in column i'''
+
+    counts = {}
+    for seq in sequences:
+        b = seq[i]
+        if b in counts:
+            counts[b] += 1
+        else:
+            counts[b] = 1
+    return counts
+
+
+def _columnConsensus(sequences, i):
+    '''Computes the consensus base for column i (the reference rule)'''
+
+    # count bases at this position
+    counts = _columnCounts(sequences, i)
+
+    # find most abundant
+    largest = ('N', 0)
+    while len(counts) > 0:
+        c = counts.popitem()
+        if c[1] > largest[1] and c[0] not in _IGNORE:
+            largest = c
+
+    return largest[0]
+
+
+def _makeStats(reads, length, called, segregating):
+    '''Builds the statistics tuple (see makeConsensusStats)'''
+    cells = reads * length
+    coverage = float(called) / length if length > 0 else 0.0
+    missing = float(cells - called) / cells if cells > 0 else 0.0
+    return (reads, length, coverage, missing, segregating)
+
+
+def _makeConsensusPython(sequences, stats=False):
+    '''Pure-Python consensus, one column at a time'''
+
+    length = len(sequences[0])
+    consensus = "".join([_columnConsensus(sequences, i) for i in xrange(length)])
+    if not stats:
+        return (consensus, None)
+
+    called = 0
+    segregating = 0
+    for i in xrange(length):
+        mask = 0
+        for b, count in _columnCounts(sequences, i).items():
+            if b not in _IGNORE:
+                called += count
+                mask |= _NUCLEOTIDES.get(b, 0)
+        if mask not in (0, 1, 2, 4, 8):
+            segregating += 1
+    return (consensus, _makeStats(len(sequences), length, called, segregating))
+
+
+def _makeConsensusNumpy(sequences, stats=False):
+    '''Vectorised consensus over a 2-D (read x column) byte array'''
+    numpy = _numpy()
+
+    length = len(sequences[0])
+    for seq in sequences:
+        if len(seq) != length:
+            # ragged alignment; let the reference rule decide what to do
+            return _makeConsensusPython(sequences, stats)
+    if length == 0:
+        return ("", _makeStats(len(sequences), 0, 0, 0) if stats else None)
+
+    reads = numpy.frombuffer("".join(sequences), dtype=numpy.uint8).reshape(len(sequences), length)
+
+    # map each byte to a symbol index, gaps and N's go to the last (dropped) row
+    symbols = numpy.unique(reads)
+    symbols = symbols[(symbols != ord('-')) & (symbols != ord('N'))]
+    if len(symbols) == 0:
+        return ("N" * length, _makeStats(len(sequences), length, 0, 0) if stats else None)
+    lookup = numpy.empty(256, dtype=numpy.intp)
+    lookup.fill(len(symbols))
+    lookup[symbols] = numpy.arange(len(symbols))
+
+    # count every symbol in every column with one bincount
+    cells = lookup[reads] * length + numpy.arange(length)
+    counts = numpy.bincount(cells.ravel(), minlength=(len(symbols) + 1) * length)
+    counts = counts.reshape(len(symbols) + 1, length)[:-1]
+
+    best = counts.argmax(axis=0)
+    top = counts[best, numpy.arange(length)]
+    result = symbols[best]
+    result[top == 0] = ord('N')
+    consensus = bytearray(result.tobytes())
+
+    # ties depend on the reference rule's ordering so resolve them the same way
+    ties = numpy.flatnonzero((top > 0) & ((counts == top).sum(axis=0) > 1))
+    for i in ties:
+        consensus[i] = ord(_columnConsensus(sequences, i))
+
+    if not stats:
+        return (str(consensus), None)
+
+    # nucleotides present in each column
+    masks = numpy.array([_NUCLEOTIDES.get(chr(b), 0) for b in symbols], dtype=numpy.uint8)
+    present = numpy.bitwise_or.reduce(numpy.where(counts > 0, masks[:, None], 0), axis=0)
+    single = (present == 0) | (present == 1) | (present == 2) | (present == 4) | (present == 8)
+    return (str(consensus), _makeStats(len(sequences), length, int(counts.sum()), int((~single).sum())))
@@ -0,0 +1,195 @@
+
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+On-disk cache of the consensus sequences computed from a loci file
+
+Entries are keyed by a fingerprint of the loci file; either a hash of its
+whole content or a fast fingerprint made from its size, mtime and a sample of
+blocks spread through the file.  Each entry is a text file with one line per
+locus (contigid, consensus, comma separated members) in loci file order.
+
+The cache is limited in size; the least recently used entries are removed
+first.
+'''
+
+import os, sys, hashlib
+
+# increment when the consensus output changes so old entries are not used
+CACHE_VERSION = "1"
+
+# default cache size limit (MB)
+DEFAULT_SIZE = 2048
+
+# block sampling for fast fingerprints
+_BLOCK_SIZE = 65536
+_BLOCK_COUNT = 16
+
+
+def defaultCacheDir():
+    '''The cache directory; $RAD_PIPELINE_CACHE_DIR or ~/.cache/rad-pipeline/consensus'''
+    cachedir = os.environ.get('RAD_PIPELINE_CACHE_DIR')
+    if cachedir:
+        return cachedir
+    return os.path.join(os.path.expanduser("~"), ".cache", "rad-pipeline", "consensus")
+
+
+def fingerprint(filename, content=False):
+    '''
+    Computes the cache key for a file
+
+    @param filename: string, the file to fingerprint
+    @param content: bool, hash the whole file rather than size, mtime and sampled blocks
+    @return: string, the hex digest
+    '''
+    h = hashlib.md5()
+    h.update("consensus-cache %s\n" % CACHE_VERSION)
+    st = os.stat(filename)
+    with open(filename, 'rb') as f:
+        if content:
+            while True:
+                block = f.read(1024 * 1024)
+                if len(block) == 0:
+                    break
+                h.update(block)
+        else:
+            h.update("%s %r\n" % (st.st_size, st.st_mtime))
+            step = max(_BLOCK_SIZE, st.st_size // _BLOCK_COUNT)
+            for offset in xrange(0, st.st_size, step):
+                f.seek(offset)
+                h.update(f.read(_BLOCK_SIZE))
+    return h.hexdigest()
+
+
+class ConsensusCache(object):
+    '''A directory of cached consensus entries with LRU eviction'''
+
+    def __init__(self, cachedir=None, maxsize=DEFAULT_SIZE, content=False):
+        '''
+        @param cachedir: string, the cache directory (created when needed)
+        @param maxsize: int, the size limit of the cache (MB)
+        @param content: bool, key entries by a hash of the whole loci file (see fingerprint)
+        '''
+        self.cachedir = cachedir or defaultCacheDir()
+        self.maxsize = maxsize * 1024 * 1024
+        self.content = content
+
+    def key(self, locifilename):
+        '''The cache key for locifilename'''
+        return fingerprint(locifilename, self.content)
+
+    def path(self, key):
+        return os.path.join(self.cachedir, "%s.cons" % key)
+
+    def load(self, key):
+        '''
+        Reads a cache entry
+
+        @return: generator, (contigid, consensus, members) or None if not cached
+        '''
+        filename = self.path(key)
+        try:
+            f = open(filename)
+        except IOError:
+            return None
+        # mark as recently used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return self._read(f)
+
+    def _read(self, f):
+        with f:
+            for line in f:
+                contigid, cons, members = line.rstrip("\n").split("\t")
+                yield (contigid, cons, members.split(",") if len(members) > 0 else [])
+
+    def save(self, key, records):
+        '''
+        Saves records to the cache as they are consumed
+
+        The entry is only added once every record has been read.
+
+        @param records: iterable, (contigid, consensus, members)
+        @return: generator, the records
+        '''
+        filename = self.path(key)
+        tmpfilename = "%s.%s.tmp" % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            f = open(tmpfilename, 'w')
+        except (IOError, OSError) as e:
+            sys.stderr.write("Warning: unable to write consensus cache '%s': %s\n" % (self.cachedir, e))
+            for record in records:
+                yield record
+            return
+
+        complete = False
+        try:
+            with f:
+                for record in records:
+                    f.write("%s\t%s\t%s\n" % (record[0], record[1], ",".join(record[2])))
+                    yield record
+            os.rename(tmpfilename, filename)
+            complete = True
+        finally:
+            if not complete and os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
+        self.evict(keep=filename)
+
+    def evict(self, keep=None):
+        '''Removes the least recently used entries until the cache fits its size limit'''
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if name.endswith(".cons"):
+                filename = os.path.join(self.cachedir, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, filename, st.st_size))
+                total += st.st_size
+        entries.sort()
+        for _, filename, size in entries:
+            if total <= self.maxsize:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.remove(filename)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Searches for good denovo_map.pl -M, -n and -m values a few trials at a time
+
+Rather than running every combination of a grid (as the phase 1 and 2
+optimisation jobs do) the search starts from the centre of the ranges and
+its neighbours a coarse step away, then repeatedly moves to the best trial so
+far and tries its neighbours, halving the step each time none of them is
+better.  As soon as a trial finishes the next untried point is started so
+all of --jobs are kept busy (on this node, or with --launcher srun on any
+node of the job; see rad-pipeline_schedule_trials).
+
+The search stops when:
+
+  * the best trial's catalog size and coverage changed by less than
+    --tolerance between two refinements (a plateau),
+  * the best trial has no better neighbours one step away, or
+  * --max-trials trials have been run.
+
+Each trial is run as 'bash -c TRIAL' with TRIAL_ID (e.g. M5_n6_m3), TRIAL_M,
+TRIAL_n and TRIAL_m in its environment, and must print the output of
+rad-pipeline_collect_denovo_map_stats.  That output is kept in the stats
+directory, so rerunning the search (e.g. after the job ran out of time)
+carries on from the trials (and step) already finished.
+
+A trial's score estimates how many well covered loci the samples share:
+
+  score = mean sample stacks x (mean sample stacks / catalog size)
+          x min(1, coverage / --min-coverage)
+
+i.e. splitting loci (too small -M/-n) inflates the catalog with loci few
+samples have, and merging them (too large) leaves fewer stacks per sample.
+'''
+
+import os, sys, argparse, glob, json, re, subprocess, time
+
+import denovo_stats, trial_scheduler, trial_supervisor
+
+PARAMETERS = ("M", "n", "m")
+
+_TRIAL_FILE = re.compile(r"stats_M(\d+)_n(\d+)_m(\d+)\.tsv$")
+
+
+def trialId(point):
+    '''The run id of a trial, e.g. M5_n6_m3'''
+    return "M%s_n%s_m%s" % point
+
+
+def parseRange(value):
+    '''
+    Parses a range option
+
+    @param value: string, d-D
+    @return: tuple, (d, D)
+    '''
+    parts = value.split("-")
+    if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+        raise ValueError("invalid range '%s', expected d-D" % value)
+    low, high = int(parts[0]), int(parts[1])
+    if low > high:
+        raise ValueError("invalid range '%s', %s is more than %s" % (value, low, high))
+    return (low, high)
+
+
+class Search(object):
+    '''Coarse to fine search of the (M, n, m) grid'''
+
+    def __init__(self, ranges, tolerance=0.02, maxtrials=40, mincoverage=10.0):
+        '''
+        @param ranges: dict, parameter => (min, max)
+        @param tolerance: float, the relative change of catalog size and coverage that is a plateau
+        @param maxtrials: int, the most trials to run (including earlier runs)
+        @param mincoverage: float, the coverage below which the score is reduced
+        '''
+        self.ranges = [ranges[p] for p in PARAMETERS]
+        self.tolerance = tolerance
+        self.maxtrials = maxtrials
+        self.mincoverage = mincoverage
+        self.centre = tuple((low + high) // 2 for low, high in self.ranges)
+        self.step = [max(1, (high - low) // 2) for low, high in self.ranges]
+        self.trials = {}        # point => Trial (None while running)
+        self.levels = []        # the best trial at the end of each refinement
+        self.stopped = None
+        self.statefilename = None
+
+    def best(self):
+        '''The best finished trial (or None)'''
+        best = None
+        bestscore = None
+        for trial in self.trials.values():
+            if trial is None:
+                continue
+            score = trial.score(self.mincoverage)
+            if score is not None and (bestscore is None or score > bestscore):
+                best, bestscore = trial, score
+        return best
+
+    def running(self):
+        return [point for point, trial in self.trials.items() if trial is None]
+
+    def neighbours(self, point):
+        '''The point and its neighbours one step away (within the ranges)'''
+        points = [point]
+        for i, (low, high) in enumerate(self.ranges):
+            for delta in (-self.step[i], self.step[i]):
+                value = min(high, max(low, point[i] + delta))
+                points.append(point[:i] + (value,) + point[i + 1:])
+        return points
+
+    def propose(self):
+        '''
+        The next point to try
+
+        @return: tuple, (M, n, m) or None when none can be started until a running trial finishes (or the search has stopped)
+        '''
+        while self.stopped is None:
+            if len(self.trials) >= self.maxtrials:
+                if len(self.running()) == 0:
+                    self.stopped = "reached %s trials" % self.maxtrials
+                return None
+            best = self.best()
+            for point in self.neighbours(best.point if best else self.centre):
+                if point not in self.trials:
+                    return point
+            if len(self.running()) > 0:
+                return None
+            self.refine(best)
+        return None
+
+    def refine(self, best):
+        '''No neighbour of the best trial is better: stop or halve the step'''
+        if best is None:
+            self.stopped = "no trial succeeded"
+            return
+        self.levels.append(best)
+        if len(self.levels) >= 2 and self._plateau(self.levels[-2], best):
+            self.stopped = "catalog size and coverage changed by less than %s%%" % (self.tolerance * 100)
+        elif max(self.step) == 1:
+            self.stopped = "no better neighbours"
+        else:
+            self.step = [max(1, s // 2) for s in self.step]
+        self.save()
+
+    def save(self):
+        '''Keeps the step and the best trial of each refinement for the next run'''
+        if self.statefilename is None:
+            return
+        with open(self.statefilename, 'w') as f:
+            json.dump({"step": self.step, "levels": [trial.point for trial in self.levels]}, f)
+
+    def restore(self, statefilename):
+        '''Carries on from the step of an earlier run (if any)'''
+        self.statefilename = statefilename
+        try:
+            with open(statefilename) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return
+        self.step = [int(s) for s in state["step"]]
+        self.levels = [self.trials[tuple(point)] for point in state["levels"] if self.trials.get(tuple(point))]
+
+    def _plateau(self, previous, best):
+        for old, new in ((previous.catalog, best.catalog), (previous.coverage, best.coverage)):
+            if old is None or new is None:
+                continue
+            if abs(new - old) > self.tolerance * max(abs(old), 1e-9):
+                return False
+        return True
+
+    def started(self, point):
+        self.trials[point] = None
+
+    def finished(self, point, trial):
+        self.trials[point] = trial
+
+
+def loadTrials(search, statsdir):
+    '''
+    Adds the trials finished by earlier runs
+
+    @return: int, the number of trials loaded
+    '''
+    count = 0
+    for filename in sorted(glob.glob(os.path.join(statsdir, "stats_M*_n*_m*.tsv"))):
+        match = _TRIAL_FILE.search(filename)
+        if match is None:
+            continue
+        point = tuple(int(v) for v in match.groups())
+        samples = denovo_stats.readTable(filename)
+        if len(samples) > 0:
+            search.finished(point, denovo_stats.Trial(point, samples))
+            count += 1
+    return count
+
+
+def startTrial(command, point, statsdir, launcher="local", cores=1, timesfilename=None):
+    '''
+    Starts a trial writing its stats to the stats directory
+
+    @return: subprocess.Popen
+    '''
+    env = dict(os.environ)
+    env["TRIAL_ID"] = trialId(point)
+    for name, value in zip(PARAMETERS, point):
+        env["TRIAL_%s" % name] = str(value)
+    if timesfilename:
+        env["TRIAL_CACHED_FILE"] = trial_scheduler.cachedFilename(timesfilename, point)
+        trial_scheduler.wasCached(timesfilename, point)
+    with open(os.path.join(statsdir, "stats_%s.tsv.tmp" % trialId(point)), 'w') as out:
+        return subprocess.Popen(trial_scheduler.launchArgs(launcher, command, cores), stdout=out, env=env, preexec_fn=os.setpgrp)
+
+
+def run(search, command, statsdir, jobs, launcher="local", cores=1, timesfilename=None, supervisor=None):
+    '''
+    Runs trials (up to jobs at once) until the search stops
+
+    @param timesfilename: string, the file the wall time of each trial is added to (see trial_scheduler)
+    @param supervisor: trial_supervisor.Supervisor, stops dominated trials (or None)
+
+    @return: list, the points in the order their trials finished
+    '''
+    processes = {}
+    order = []
+    while True:
+        while len(processes) < jobs:
+            point = search.propose()
+            if point is None:
+                break
+            sys.stderr.write("[%s] starting %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), trialId(point)))
+            search.started(point)
+            process = startTrial(command, point, statsdir, launcher, cores, timesfilename)
+            processes[process.pid] = (point, process, time.time())
+        if len(processes) == 0:
+            break
+
+        pid, status = trial_supervisor.wait(processes, supervisor)
+        if pid not in processes:
+            continue
+        point, process, start = processes.pop(pid)
+        process.returncode = status
+        tmpfilename = os.path.join(statsdir, "stats_%s.tsv.tmp" % trialId(point))
+        filename = tmpfilename[:-len(".tmp")]
+        trial = denovo_stats.Trial(point, [], time.time() - start)
+        if supervisor is not None and supervisor.reaped(pid, point):
+            os.remove(tmpfilename)
+            trial = denovo_stats.Trial(point, denovo_stats.readTable(filename), time.time() - start)
+        elif status == 0:
+            os.rename(tmpfilename, filename)
+            samples = denovo_stats.readTable(filename)
+            trial = denovo_stats.Trial(point, samples, time.time() - start)
+            if supervisor is not None:
+                supervisor.finished(point, trial.seconds)
+        else:
+            os.remove(tmpfilename)
+        if timesfilename:
+            recorded = trial_scheduler.exitStatus(status)
+            if trial.pruned:
+                recorded = "pruned"
+            elif trial_scheduler.wasCached(timesfilename, point):
+                recorded = "cached"
+            trial_scheduler.recordTime(timesfilename, point, trial.seconds, recorded, launcher)
+        if trial.pruned:
+            sys.stderr.write("[%s] %s pruned after %.1f mins\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), trialId(point), trial.seconds / 60))
+        elif not trial.ok():
+            sys.stderr.write("[%s] %s failed (exit status %s)\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), trialId(point), trial_scheduler.exitStatus(status)))
+        else:
+            sys.stderr.write("[%s] %s finished in %.1f mins: catalog %d, coverage %.1f, score %.1f\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), trialId(point),
+                             trial.seconds / 60, trial.catalog, trial.coverage or 0.0, trial.score(search.mincoverage)))
+        search.finished(point, trial)
+        order.append(point)
+    return order
+
+
+def writeStats(statsdir, filename):
+    '''Combines the stats of every trial into one file (like stats-phase1.tsv)'''
+    rows = denovo_stats.aggregate(sorted(glob.glob(os.path.join(statsdir, "stats_M*_n*_m*.tsv"))))
+    with open(filename, 'w') as out:
+        denovo_stats.writeTable(rows, out)
+
+
+def report(search, out=sys.stdout):
+    '''Prints every finished trial, best first'''
+    denovo_stats.rankTrials(search.trials.values(), search.mincoverage, out)
+
+
+def main(argv):
+    '''Application main function'''
+
+    parser = argparse.ArgumentParser(prog="rad-pipeline_denovo_search", description='Searches for good denovo_map.pl -M, -n and -m values a few trials at a time')
+
+    parser.add_argument("trial", help="The bash command that runs a trial (see TRIAL_M, TRIAL_n, TRIAL_m and TRIAL_ID) and prints its stats.")
+    parser.add_argument("-j", "--jobs", nargs=1, metavar='N', type=int, default=[1], help="The number of trials to run at once. [Default: 1]")
+    parser.add_argument("-t", "--cores-task", nargs=1, metavar='T', type=int, default=[1], help="Number of cores each trial uses. [Default: 1]")
+    parser.add_argument("-l", "--launcher", nargs=1, metavar='launcher', default=["local"], choices=trial_scheduler.LAUNCHERS, help="How trials are started, local or srun (a job step on any node of the job). [Default: local]")
+    parser.add_argument("--times", nargs=1, metavar='file', default=["trial-times.tsv"], help="The file the wall time of each trial is added to. [Default: trial-times.tsv]")
+    parser.add_argument("-m", "--m-range", nargs=1, metavar='d-D', default=["3-10"], help="The range of values to search for -m option. [Default: 3-10]")
+    parser.add_argument("-n", "--n-range", nargs=1, metavar='d-D', default=["5-20"], help="The range of values to search for -n option. [Default: 5-20]")
+    parser.add_argument("-M", "--M-range", nargs=1, metavar='d-D', default=["5-20"], help="The range of values to search for -M option. [Default: 5-20]")
+    parser.add_argument("--max-trials", nargs=1, metavar='N', type=int, default=[40], help="The most trials to run. [Default: 40]")
+    parser.add_argument("--tolerance", nargs=1, metavar='F', type=float, default=[0.02], help="Stop when refining changes the best catalog size and coverage by less than this fraction. [Default: 0.02]")
+    parser.add_argument("--min-coverage", nargs=1, metavar='X', type=float, default=[10.0], help="Trials with less mean coverage than this score lower, 0=ignore coverage. [Default: 10]")
+    trial_supervisor.addSupervisorArguments(parser, stats=False)
+    parser.add_argument("-s", "--stats-dir", nargs=1, metavar='dir', default=["search-stats"], help="The directory the stats of each trial are kept in. [Default: search-stats]")
+    parser.add_argument("-o", "--output", nargs=1, metavar='file', default=["stats-search.tsv"], help="The file the stats of all trials are combined into. [Default: stats-search.tsv]")
+
+    args = parser.parse_args(argv[1:])
+
+    statsdir = args.stats_dir[0]
+    try:
+        ranges = {"M": parseRange(args.M_range[0]), "n": parseRange(args.n_range[0]), "m": parseRange(args.m_range[0])}
+        supervisor = trial_supervisor.supervisorFromArgs(args, os.path.join(statsdir, "stats_{id}.tsv"), args.min_coverage[0])
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+
+    if not os.path.isdir(statsdir):
+        os.makedirs(statsdir)
+
+    search = Search(ranges, args.tolerance[0], args.max_trials[0], args.min_coverage[0])
+    loaded = loadTrials(search, statsdir)
+    search.restore(os.path.join(statsdir, "search.json"))
+    if loaded > 0:
+        sys.stderr.write("Continuing from %s finished trials in '%s'\n" % (loaded, statsdir))
+
+    if supervisor is not None:
+        for trial in search.trials.values():
+            if trial is not None and trial.ok():
+                supervisor.finished(trial.point, trial.seconds)
+    run(search, args.trial, statsdir, max(1, args.jobs[0]), args.launcher[0], args.cores_task[0], args.times[0], supervisor)
+    writeStats(statsdir, args.output[0])
+
+    best = search.best()
+    sys.stderr.write("Stopped: %s (%s trials)\n" % (search.stopped, len(search.trials)))
+    report(search)
+    if best is None:
+        sys.stderr.write("Error: no trial succeeded\n")
+        return 1
+    sys.stderr.write("Best: -M %s -n %s -m %s\n" % best.point)
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
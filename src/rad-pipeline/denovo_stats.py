@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Collects the stats of stacks denovo_map.pl runs from their denovo_map.log
+
+  rad-pipeline_collect_denovo_map_stats RUN_ID DENOVO_LOG SAMPLE_FILES...
+
+prints the log name, a header and one row per sample:
+
+  RunID  Sample  Coverage Mean  Coverage Mean Stdev  Mean merged coverage depth
+  Mean merged coverage depth Stdev  Max merged coverage depth  #utilized reads
+  Matched remainder reads  Unmatched remainder reads  Stacks  Catalog size (loci)
+
+The log is read once.  Each value is given to the sample whose section of
+the log it is in (the "file N of M [sample]" lines) so a sample missing a
+line doesn't shift the values of the samples after it; logs without these
+lines are matched up in order (with a warning when the counts differ).
+
+With --aggregate the arguments are any number of denovo_map.log files and
+stats files (as printed above, e.g. kept by the optimisation jobs) which are
+combined into one table (-o) with a row per sample per trial (and a Status
+column when trials were pruned, see rad-pipeline_schedule_trials), and with
+--summary a ranking of the trials (scored as rad-pipeline_denovo_search
+scores them).  The run
+id of a log is taken from its name (e.g. denovo_map_M5_n6_m3.log) or
+directory (run_M5_n6_m3/denovo_map.log).
+'''
+
+import os, sys, argparse, re
+
+COLUMNS = ["RunID", "Sample", "Coverage Mean", "Coverage Mean Stdev", "Mean merged coverage depth", "Mean merged coverage depth Stdev",
+           "Max merged coverage depth", "#utilized reads", "Matched remainder reads", "Unmatched remainder reads", "Stacks", "Catalog size (loci)"]
+
+# line pattern => the (1 based) fields and the columns they fill
+PATTERNS = [
+    ("Coverage mean", (3, 5), ("Coverage Mean", "Coverage Mean Stdev")),
+    ("Mean merged coverage depth", (6, 9, 11), ("Mean merged coverage depth", "Mean merged coverage depth Stdev", "Max merged coverage depth")),
+    ("Number of utilized reads", (5,), ("#utilized reads",)),
+    ("unable to match", (2, 8), ("Matched remainder reads", "Unmatched remainder reads")),
+    ("stacks compared against the catalog containing", (1, 8), ("Stacks", "Catalog size (loci)")),
+]
+
+_SECTION = re.compile(r"file\s+\d+\s+of\s+\d+\s+\[([^\]]+)\]")
+_RUNID = re.compile(r"M\d+_n\d+_m\d+")
+
+
+def sampleName(filename):
+    '''The sample name of an input file (its name without the directory and .fq)'''
+    name = os.path.basename(filename)
+    if name.endswith(".fq"):
+        name = name[:-3]
+    return name
+
+
+def _sectionName(sample, sections):
+    '''The name of a sample's section of the log (stacks drops the extensions of its file)'''
+    name = sample
+    for ext in (".gz", ".fq", ".fastq", ".fa", ".fasta"):
+        if name in sections:
+            break
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def parseLog(filename):
+    '''
+    Reads a denovo_map.log once
+
+    @return: tuple, (the values of each pattern in order, the values of each pattern by sample (None if the log has no sample sections))
+    '''
+    inorder = dict((columns, []) for _, _, columns in PATTERNS)
+    bysample = {}
+    sample = None
+    with open(filename) as f:
+        for line in f:
+            match = _SECTION.search(line)
+            if match is not None:
+                sample = match.group(1)
+                continue
+            for pattern, fields, columns in PATTERNS:
+                if pattern not in line:
+                    continue
+                words = line.split()
+                values = tuple(words[i - 1].replace(";", "") if i <= len(words) else "" for i in fields)
+                inorder[columns].append(values)
+                if sample is not None:
+                    bysample.setdefault(sample, {}).setdefault(columns, values)
+    return (inorder, bysample if len(bysample) > 0 else None)
+
+
+def sampleRows(runid, bysample, samples):
+    '''
+    The stats of each sample from the sample sections of a log
+
+    @param bysample: dict, the values of each pattern by sample (see parseLog)
+    @param samples: list, the sample names (each with a section)
+    @return: list, a dict (column => value) per sample
+    '''
+    rows = []
+    for sample in samples:
+        row = {"RunID": runid, "Sample": sample}
+        section = bysample[_sectionName(sample, bysample)]
+        for _, fields, columns in PATTERNS:
+            row.update(zip(columns, section.get(columns, ("",) * len(fields))))
+        rows.append(row)
+    return rows
+
+
+def collect(runid, logfilename, samplefilenames):
+    '''
+    The stats of each sample of a run
+
+    @param samplefilenames: list, the input files (in the order given to denovo_map.pl)
+    @return: list, a dict (column => value) per sample
+    '''
+    inorder, bysample = parseLog(logfilename)
+    samples = [sampleName(fn) for fn in samplefilenames]
+    if bysample is not None and (len(samples) == 0 or all(_sectionName(s, bysample) in bysample for s in samples)):
+        return sampleRows(runid, bysample, samples or sorted(bysample))
+
+    # no (matching) sample sections; match the values up in order
+    counts = set(len(values) for values in inorder.values())
+    if len(samples) > 0:
+        counts.add(len(samples))
+    if len(counts) > 1:
+        sys.stderr.write("Warning: '%s' has %s for %s samples, the stats may be misaligned\n" % (logfilename,
+                         ", ".join("%s %s" % (len(inorder[columns]), pattern) for pattern, _, columns in PATTERNS), len(samples)))
+    rows = []
+    for i in xrange(max(counts) if len(counts) > 0 else 0):
+        row = {"RunID": runid if i < len(samples) or len(samples) == 0 else "", "Sample": samples[i] if i < len(samples) else ""}
+        for _, fields, columns in PATTERNS:
+            values = inorder[columns][i] if i < len(inorder[columns]) else ("",) * len(fields)
+            row.update(zip(columns, values))
+        rows.append(row)
+    return rows
+
+
+def writeRows(rows, out, columns=COLUMNS):
+    for row in rows:
+        out.write("\t".join(row.get(column, "") for column in columns) + "\n")
+
+
+def writeTable(rows, out, logfilename=None):
+    '''Writes the stats (and the log line when given), with a Status column when any trial was pruned'''
+    columns = COLUMNS
+    if any("Status" in row for row in rows):
+        columns = COLUMNS + ["Status"]
+    if logfilename is not None:
+        out.write("Denovo log:\t%s\n" % logfilename)
+    out.write("\t".join(columns) + "\n")
+    writeRows(rows, out, columns)
+
+
+def readTable(filename):
+    '''
+    Reads stats as printed by this command (with or without the log line)
+
+    @return: list, a dict (column => value) per sample
+    '''
+    header = None
+    rows = []
+    with open(filename) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if header is None:
+                if fields[0] == "RunID":
+                    header = fields
+                continue
+            if fields == header or len(fields) < 2 or fields[0] == "":
+                continue
+            rows.append(dict(zip(header, fields)))
+    return rows
+
+
+def isLog(filename):
+    '''True when the file is a denovo_map.log rather than a stats table'''
+    with open(filename) as f:
+        first = f.readline()
+    return not (first.startswith("Denovo log:") or first.startswith("RunID\t"))
+
+
+def logRunId(filename):
+    '''The run id of a log from its name or directory'''
+    for name in (os.path.basename(filename), os.path.basename(os.path.dirname(os.path.abspath(filename)))):
+        match = _RUNID.search(name)
+        if match is not None:
+            return match.group(0)
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def aggregate(filenames, samplefilenames=()):
+    '''
+    The stats of many runs
+
+    @param filenames: list, denovo_map.log files and stats tables
+    @return: list, a dict (column => value) per sample per run
+    '''
+    rows = []
+    for filename in filenames:
+        if isLog(filename):
+            rows.extend(collect(logRunId(filename), filename, samplefilenames))
+        else:
+            rows.extend(readTable(filename))
+    return rows
+
+
+def _number(sample, column):
+    try:
+        return float(sample.get(column, "").rstrip(";"))
+    except ValueError:
+        return None
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    if len(values) == 0:
+        return None
+    return sum(values) / len(values)
+
+
+class Trial(object):
+    '''The result of one denovo_map.pl run'''
+
+    def __init__(self, point, samples, seconds=None):
+        self.point = point
+        self.samples = samples
+        self.pruned = any(s.get("Status", "").startswith("pruned") for s in samples)
+        self.seconds = seconds
+        self.stacks = _mean([_number(s, "Stacks") for s in samples])
+        catalogs = [_number(s, "Catalog size (loci)") for s in samples]
+        catalogs = [c for c in catalogs if c is not None]
+        self.catalog = max(catalogs) if len(catalogs) > 0 else None
+        self.coverage = _mean([_number(s, "Mean merged coverage depth") for s in samples])
+        if self.coverage is None:
+            self.coverage = _mean([_number(s, "Coverage Mean") for s in samples])
+
+    def ok(self):
+        return not self.pruned and self.stacks is not None and self.catalog
+
+    def shared(self):
+        '''The fraction of the catalog found in a sample (on average)'''
+        return self.stacks / self.catalog
+
+    def score(self, mincoverage):
+        if not self.ok():
+            return None
+        coverage = 1.0
+        if mincoverage > 0:
+            coverage = min(1.0, (self.coverage or 0.0) / mincoverage)
+        return self.stacks * self.shared() * coverage
+
+
+def rankTrials(trials, mincoverage, out=sys.stdout):
+    '''Prints the (successful) trials, best first'''
+    out.write("M\tn\tm\tCatalog size (loci)\tMean sample stacks\tShared\tCoverage\tScore\n")
+    trials = [t for t in trials if t is not None and t.ok()]
+    trials.sort(key=lambda t: t.score(mincoverage), reverse=True)
+    for trial in trials:
+        out.write("%s\t%s\t%s\t%d\t%.1f\t%.3f\t%.1f\t%.1f\n" % (trial.point + (trial.catalog, trial.stacks, trial.shared(), trial.coverage or 0.0, trial.score(mincoverage))))
+
+
+def rank(rows, mincoverage, out):
+    '''Writes the trials (with M, n and m in their run id) best first'''
+    byrun = {}
+    for row in rows:
+        byrun.setdefault(row["RunID"], []).append(row)
+    trials = []
+    for runid, samples in byrun.items():
+        match = re.match(r"M(\d+)_n(\d+)_m(\d+)$", runid)
+        if match is not None:
+            trials.append(Trial(tuple(int(v) for v in match.groups()), samples))
+    rankTrials(trials, mincoverage, out)
+
+
+def main(argv):
+    '''Application main function'''
+
+    parser = argparse.ArgumentParser(prog="rad-pipeline_collect_denovo_map_stats", description='Collects the stats of stacks denovo_map.pl runs from their denovo_map.log')
+
+    parser.add_argument("args", nargs="+", metavar="arg", help="RUN_ID DENOVO_LOG SAMPLE_FILE...  or with --aggregate, the logs and stats files to combine.")
+    parser.add_argument("-a", "--aggregate", action='store_true', help="Combine the stats of many logs (and stats files) into one table.")
+    parser.add_argument("-s", "--samples", nargs="+", metavar='file', default=[], help="The sample files of the logs (with --aggregate), for logs that don't name their samples.")
+    parser.add_argument("-o", "--output", nargs=1, metavar='file', default=["-"], help="The combined table (with --aggregate). [Default: - (stdout)]")
+    parser.add_argument("--summary", nargs=1, metavar='file', help="Also write the trials best first to this file (with --aggregate).")
+    parser.add_argument("--min-coverage", nargs=1, metavar='X', type=float, default=[10.0], help="Trials with less mean coverage than this rank lower in the summary, 0=ignore coverage. [Default: 10]")
+
+    args = parser.parse_args(argv[1:])
+
+    try:
+        if not args.aggregate:
+            if len(args.args) < 2:
+                sys.stderr.write("Error: expected RUN_ID DENOVO_LOG SAMPLE_FILE...\n")
+                return 1
+            rows = collect(args.args[0], args.args[1], args.args[2:])
+            sys.stdout.write("Denovo log:\t%s\n" % args.args[1])
+            sys.stdout.write("\t".join(COLUMNS) + "\n")
+            writeRows(rows, sys.stdout)
+            return 0
+
+        rows = aggregate(args.args, args.samples)
+        out = sys.stdout if args.output[0] == "-" else open(args.output[0], 'w')
+        try:
+            writeTable(rows, out)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if args.summary:
+            with open(args.summary[0], 'w') as out:
+                rank(rows, args.min_coverage[0], out)
+    except IOError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
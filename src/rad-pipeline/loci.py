@@ -0,0 +1,341 @@
+
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Functions for reading pyRAD .loci files
+
+A .loci file is a series of records, each made up of one line per sample
+(">name    SEQUENCE") followed by a "//" line ending with "|contigid".
+
+Compressed (gzip or bgzip) .loci files can only be read from start to
+finish; splitting them into chunks and indexing them need byte offsets so
+raise ValueError.
+
+A sidecar index (locifile.idx) maps each contig id to the byte offset and
+length of its sequence lines so single loci can be read without parsing the
+whole file.  The index records the size and mtime of the .loci file it was
+built from and is rebuilt automatically when they change.
+
+Binary loci stores (see loci_store) are accepted anywhere a .loci file is.
+'''
+
+import os, sys, io, gzip, mmap
+
+import loci_store
+
+INDEX_VERSION = "1"
+
+# read buffer size for streaming loci files
+BUFFER_SIZE = 1024 * 1024
+
+
+def openLoci(locifilename):
+    '''
+    Opens a .loci file for streaming, gzip (and bgzip) files are detected by content
+
+    @param locifilename: string, the .loci file to open ('-' for stdin)
+    @return: file, a buffered binary file object
+    '''
+    if locifilename == "-":
+        return sys.stdin
+    with open(locifilename, 'rb') as f:
+        magic = f.read(2)
+    if magic == "\x1f\x8b":
+        return io.BufferedReader(gzip.open(locifilename, 'rb'), BUFFER_SIZE)
+    return io.open(locifilename, 'rb', buffering=BUFFER_SIZE)
+
+
+def isCompressed(locifilename):
+    '''True when locifilename is a gzip (or bgzip) file'''
+    if locifilename == "-":
+        return False
+    with open(locifilename, 'rb') as f:
+        return f.read(2) == "\x1f\x8b"
+
+
+def _checkSeekable(locifilename):
+    if isCompressed(locifilename):
+        raise ValueError("'%s' is compressed and can only be read in order, decompress it or convert it with pyrad-loci2store" % locifilename)
+
+
+def iterLoci(locifilename):
+    '''
+    Reads each locus from a .loci file (plain or compressed) or binary loci store
+
+    @return: generator, (contigid, samples, sequences) for each locus
+    '''
+    if locifilename != "-" and loci_store.isStore(locifilename):
+        store = loci_store.LociStore(locifilename)
+        try:
+            for record in store:
+                yield record
+        finally:
+            store.close()
+    else:
+        f = openLoci(locifilename)
+        try:
+            for record in readLoci(f):
+                yield record
+        finally:
+            f.close()
+
+
+def readLoci(f):
+    '''
+    Reads each locus from an open .loci file
+
+    @param f: file, the open .loci file
+    @return: generator, (contigid, samples, sequences) for each locus
+    '''
+    _sequences = []
+    _samples   = []
+    for line in f:
+        line = line.rstrip()
+        if line.startswith("//"):
+            _, _contigid = line.split("|", 1)
+            yield (_contigid, _samples, _sequences)
+            _sequences = []
+            _samples   = []
+        elif len(line) > 0:
+            seqid, seq = line.split()
+            _sequences.append(seq)
+            _samples.append(seqid[1:])
+
+
+def parseLocus(data):
+    '''
+    Parses the sequence lines of a single locus
+
+    @param data: string, the sequence lines (without the "//" line)
+    @return: tuple, (samples, sequences)
+    '''
+    samples   = []
+    sequences = []
+    for line in data.split("\n"):
+        line = line.rstrip()
+        if len(line) > 0:
+            seqid, seq = line.split()
+            sequences.append(seq)
+            samples.append(seqid[1:])
+    return (samples, sequences)
+
+
+def chunkRanges(locifilename, chunksize):
+    '''
+    Splits a .loci file into byte ranges that end on record ("//") boundaries
+
+    @param locifilename: string, the .loci file to split
+    @param chunksize: int, the approximate size (in bytes) of each range
+    @return: list, (start, end) byte offsets of each range
+    '''
+    if loci_store.isStore(locifilename):
+        return _storeChunkRanges(locifilename, chunksize)
+    _checkSeekable(locifilename)
+    size = os.path.getsize(locifilename)
+    ranges = []
+    with open(locifilename, 'rb') as f:
+        start = 0
+        while start < size:
+            end = start + max(1, chunksize)
+            if end < size:
+                # extend the range to the end of the next "//" line
+                f.seek(end)
+                f.readline()
+                while True:
+                    line = f.readline()
+                    if len(line) == 0 or line.startswith("//"):
+                        break
+                end = f.tell()
+            end = min(end, size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _storeChunkRanges(storefilename, chunksize):
+    '''Splits the records of a binary loci store into byte ranges'''
+    store = loci_store.LociStore(storefilename)
+    try:
+        starts = sorted(offset for offset, _ in store.offsets.values())
+    finally:
+        store.close()
+    ranges = []
+    for offset in starts:
+        if len(ranges) == 0 or offset - ranges[-1][0] >= chunksize:
+            ranges.append([offset, offset])
+    for i in xrange(len(ranges) - 1):
+        ranges[i][1] = ranges[i + 1][0]
+    if len(ranges) > 0:
+        ranges[-1][1] = starts[-1] + 1
+    return [tuple(r) for r in ranges]
+
+
+def readLociRange(locifilename, start, end):
+    '''
+    Reads the loci within a byte range (see chunkRanges)
+
+    @return: list, (contigid, samples, sequences) for each locus in the range
+    '''
+    if loci_store.isStore(locifilename):
+        store = loci_store.LociStore(locifilename)
+        try:
+            return store.readRange(start, end)
+        finally:
+            store.close()
+    _checkSeekable(locifilename)
+    with open(locifilename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return list(readLoci(data.split("\n")))
+
+
+def indexFilename(locifilename):
+    '''The filename of the sidecar index for locifilename'''
+    return "%s.idx" % locifilename
+
+
+def buildIndex(locifilename):
+    '''
+    Builds the byte-offset index of a .loci file in one streaming pass
+
+    @param locifilename: string, the .loci file to index
+    @return: dict, contigid => (offset, length) of its sequence lines
+    '''
+    _checkSeekable(locifilename)
+    offsets = {}
+    with open(locifilename, 'rb') as f:
+        start = 0
+        pos = 0
+        for line in f:
+            if line.startswith("//"):
+                _, _contigid = line.rstrip().split("|", 1)
+                offsets[_contigid] = (start, pos - start)
+                start = pos + len(line)
+            pos += len(line)
+    return offsets
+
+
+def writeIndex(locifilename, offsets):
+    '''Saves offsets to the sidecar index of locifilename'''
+    st = os.stat(locifilename)
+    idxfilename = indexFilename(locifilename)
+    tmpfilename = "%s.%s.tmp" % (idxfilename, os.getpid())
+    with open(tmpfilename, 'w') as f:
+        f.write("#loci-index\t%s\t%s\t%r\n" % (INDEX_VERSION, st.st_size, st.st_mtime))
+        for contigid, (offset, length) in sorted(offsets.items(), key=lambda item: item[1][0]):
+            f.write("%s\t%s\t%s\n" % (contigid, offset, length))
+    os.rename(tmpfilename, idxfilename)
+
+
+def readIndex(locifilename):
+    '''
+    Reads the sidecar index of locifilename
+
+    @return: dict, contigid => (offset, length) or None if missing or out-of-date
+    '''
+    idxfilename = indexFilename(locifilename)
+    if not os.path.isfile(idxfilename):
+        return None
+    st = os.stat(locifilename)
+    with open(idxfilename) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        if len(header) != 4 or header[0] != "#loci-index" or header[1] != INDEX_VERSION:
+            return None
+        if int(header[2]) != st.st_size or float(header[3]) != st.st_mtime:
+            return None
+        offsets = {}
+        for line in f:
+            contigid, offset, length = line.rstrip("\n").split("\t")
+            offsets[contigid] = (int(offset), int(length))
+    return offsets
+
+
+def loadIndex(locifilename, quiet=False):
+    '''
+    Loads the index for locifilename, (re)building and saving it when needed
+
+    @return: dict, contigid => (offset, length)
+    '''
+    if loci_store.isStore(locifilename):
+        store = loci_store.LociStore(locifilename)
+        store.close()
+        return store.offsets
+    offsets = readIndex(locifilename)
+    if offsets is None:
+        offsets = buildIndex(locifilename)
+        try:
+            writeIndex(locifilename, offsets)
+        except (IOError, OSError) as e:
+            if not quiet:
+                sys.stderr.write("Warning: unable to save index '%s': %s\n" % (indexFilename(locifilename), e))
+    return offsets
+
+
+class IndexedLoci(object):
+    '''Random access to the loci in a .loci file via its index'''
+
+    def __init__(self, locifilename, quiet=False):
+        self._store = None
+        if loci_store.isStore(locifilename):
+            self._store = loci_store.LociStore(locifilename)
+            self.offsets = self._store.offsets
+            return
+        self.offsets = loadIndex(locifilename, quiet)
+        self._file = open(locifilename, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = ""
+
+    def __contains__(self, contigid):
+        return contigid in self.offsets
+
+    def get(self, contigid):
+        '''
+        Reads a single locus
+
+        @param contigid: string, the id of the locus to read
+        @return: tuple, (samples, sequences)
+        '''
+        if self._store is not None:
+            return self._store.get(contigid)
+        offset, length = self.offsets[contigid]
+        return parseLocus(self._data[offset:offset + length])
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            return
+        if not isinstance(self._data, str):
+            self._data.close()
+        self._file.close()
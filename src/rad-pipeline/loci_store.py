@@ -0,0 +1,222 @@
+
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Compact binary store for pyRAD loci
+
+Layout (little-endian):
+
+  header   "RADLOCI1", nsamples (Q), nloci (Q), sample table offset (Q),
+           locus table offset (Q)
+  records  one per locus: nreads (I), read length (I), the sample number of
+           each read (I x nreads) then the reads packed two bases per byte
+  samples  for each sample: name length (H), name
+  loci     for each locus: id length (H), id, record offset (Q), record length (I)
+
+Bases are stored as 4-bit codes.  The IUPAC alphabet plus gap and N is
+exactly 16 symbols so packing is lossless for pyRAD output.
+'''
+
+import os, re, mmap, struct, bisect
+
+MAGIC = "RADLOCI1"
+
+_HEADER = struct.Struct("<8sQQQQ")
+_RECORD = struct.Struct("<II")
+_NAME   = struct.Struct("<H")
+_LOCUS  = struct.Struct("<QI")
+
+ALPHABET = "ACGTRYSWKMBDHVN-"
+
+# two bases <=> one byte
+_ENCODE = dict(((a + b, chr(i * 16 + j)) for i, a in enumerate(ALPHABET) for j, b in enumerate(ALPHABET)))
+_HIGH   = "".join(ALPHABET[i >> 4] for i in xrange(256))
+_LOW    = "".join(ALPHABET[i & 15] for i in xrange(256))
+_PAIRS  = re.compile("..", re.DOTALL)
+
+
+def isStore(filename):
+    '''Checks if filename is a binary loci store'''
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def packReads(sequences):
+    '''
+    Packs aligned reads into 4-bit codes
+
+    @param sequences: list, the reads (all the same length)
+    @return: string, the packed reads
+    '''
+    length = len(sequences[0]) if len(sequences) > 0 else 0
+    for seq in sequences:
+        if len(seq) != length:
+            raise ValueError("reads are not the same length (%s != %s)" % (len(seq), length))
+    pad = "-" if length % 2 else ""
+    try:
+        return "".join(map(_ENCODE.__getitem__, _PAIRS.findall(pad.join(sequences) + pad)))
+    except KeyError as e:
+        raise ValueError("base(s) %s cannot be stored" % (e,))
+
+
+def unpackReads(data, nreads, length):
+    '''Unpacks nreads reads of the given length (see packReads)'''
+    bases = bytearray(2 * len(data))
+    bases[0::2] = data.translate(_HIGH)
+    bases[1::2] = data.translate(_LOW)
+    bases = str(bases)
+    width = length + length % 2
+    return [bases[i * width:i * width + length] for i in xrange(nreads)]
+
+
+def writeStore(records, filename):
+    '''
+    Writes loci to a binary store
+
+    @param records: iterable, (contigid, samples, sequences) for each locus
+    @param filename: string, the store to create
+    @return: tuple, (number of samples, number of loci)
+    '''
+    samples = {}
+    samplenames = []
+    table = []
+    tmpfilename = "%s.%s.tmp" % (filename, os.getpid())
+    with open(tmpfilename, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, 0, 0, 0, 0))
+        offset = _HEADER.size
+        for contigid, _samples, _sequences in records:
+            ids = []
+            for name in _samples:
+                if name not in samples:
+                    samples[name] = len(samplenames)
+                    samplenames.append(name)
+                ids.append(samples[name])
+            length = len(_sequences[0]) if len(_sequences) > 0 else 0
+            data = _RECORD.pack(len(_sequences), length) + struct.pack("<%dI" % len(ids), *ids) + packReads(_sequences)
+            f.write(data)
+            table.append((contigid, offset, len(data)))
+            offset += len(data)
+
+        sampletable = offset
+        for name in samplenames:
+            f.write(_NAME.pack(len(name)))
+            f.write(name)
+            offset += _NAME.size + len(name)
+        locustable = offset
+        for contigid, recoffset, reclength in table:
+            f.write(_NAME.pack(len(contigid)))
+            f.write(contigid)
+            f.write(_LOCUS.pack(recoffset, reclength))
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(samplenames), len(table), sampletable, locustable))
+    os.rename(tmpfilename, filename)
+    return (len(samplenames), len(table))
+
+
+class LociStore(object):
+    '''Reads loci from a binary store'''
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nsamples, nloci, sampletable, locustable = _HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError("'%s' is not a binary loci store" % filename)
+
+        # sample names
+        self.samples = []
+        pos = sampletable
+        for _ in xrange(nsamples):
+            (n,) = _NAME.unpack_from(self._data, pos)
+            self.samples.append(self._data[pos + _NAME.size:pos + _NAME.size + n])
+            pos += _NAME.size + n
+
+        # locus table, contigid => (offset, length)
+        self.order = []
+        self.offsets = {}
+        pos = locustable
+        for _ in xrange(nloci):
+            (n,) = _NAME.unpack_from(self._data, pos)
+            contigid = self._data[pos + _NAME.size:pos + _NAME.size + n]
+            pos += _NAME.size + n
+            self.offsets[contigid] = _LOCUS.unpack_from(self._data, pos)
+            self.order.append(contigid)
+            pos += _LOCUS.size
+        self._starts = [self.offsets[contigid][0] for contigid in self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, contigid):
+        return contigid in self.offsets
+
+    def __iter__(self):
+        '''Yields (contigid, samples, sequences) for each locus in file order'''
+        for contigid, offset in zip(self.order, self._starts):
+            yield (contigid,) + self._readRecord(offset)
+
+    def get(self, contigid):
+        '''
+        Reads a single locus
+
+        @return: tuple, (samples, sequences)
+        '''
+        offset, _ = self.offsets[contigid]
+        return self._readRecord(offset)
+
+    def readRange(self, start, end):
+        '''
+        Reads the loci whose records start within a byte range
+
+        @return: list, (contigid, samples, sequences) for each locus in the range
+        '''
+        first = bisect.bisect_left(self._starts, start)
+        last = bisect.bisect_left(self._starts, end)
+        return [(contigid,) + self._readRecord(offset) for contigid, offset in zip(self.order[first:last], self._starts[first:last])]
+
+    def _readRecord(self, offset):
+        nreads, length = _RECORD.unpack_from(self._data, offset)
+        pos = offset + _RECORD.size
+        ids = struct.unpack_from("<%dI" % nreads, self._data, pos)
+        pos += 4 * nreads
+        packed = nreads * ((length + 1) // 2)
+        _sequences = unpackReads(self._data[pos:pos + packed], nreads, length)
+        return ([self.samples[i] for i in ids], _sequences)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
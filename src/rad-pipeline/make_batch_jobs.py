@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Generates the job scripts for many experiments and stages in one process
+
+The manifest lists one job script per row.  As a TSV file the columns are:
+
+  experiment  stage  generator  script  arguments...
+
+e.g.
+
+  2014-12-01_lobster  01-kraken  kraken  run_kraken  -j 8 ../00-raw
+  2014-12-01_lobster  03-paired  pear    run_pear    ../02-filtered
+
+Arguments may be in one column (split like a shell would) or one per column.
+Blank lines and lines starting with '#' are ignored.  As a YAML file (needs
+PyYAML) the manifest is a list of experiments:
+
+  - experiment: 2014-12-01_lobster
+    jobs:
+      - {stage: 01-kraken, generator: kraken, script: run_kraken, args: "-j 8 ../00-raw"}
+
+Experiment directories are relative to the manifest, stages to their
+experiment.  The generator is the name of a rad-pipeline_make_*_job command
+(e.g. kraken, seq-sets or make_kraken_job) and is run exactly as if it had
+been run from the stage directory with its output redirected to the script.
+Each generator, template and module version is only loaded once.
+'''
+
+import os, sys, argparse, imp, shlex, time
+
+import common
+
+SRCDIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class Job(object):
+    '''A single job script to generate'''
+    
+    def __init__(self, experiment, stage, generator, script, args):
+        self.experiment = experiment
+        self.stage = stage
+        self.generator = generator
+        self.script = script
+        self.args = args
+    
+    def name(self):
+        return os.path.join(self.experiment, self.stage, self.script)
+
+
+def readManifest(filename):
+    '''
+    Reads the jobs from a TSV or YAML manifest (see module docs)
+    
+    @return: list, the Jobs
+    '''
+    if filename.endswith(".yaml") or filename.endswith(".yml"):
+        return _readYaml(filename)
+    return _readTsv(filename)
+
+
+def _readTsv(filename):
+    jobs = []
+    with open(filename) as f:
+        for lineno, line in enumerate(f):
+            if line.strip() == "" or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4:
+                raise ValueError("%s:%s: expected experiment, stage, generator and script columns" % (filename, lineno + 1))
+            args = []
+            for field in fields[4:]:
+                args.extend(shlex.split(field))
+            jobs.append(Job(fields[0], fields[1], fields[2], fields[3], args))
+    return jobs
+
+
+def _readYaml(filename):
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("PyYAML is needed to read YAML manifests ('%s')" % filename)
+    with open(filename) as f:
+        experiments = yaml.safe_load(f) or []
+    jobs = []
+    for experiment in experiments:
+        for job in experiment.get("jobs", []):
+            for key in ("stage", "generator", "script"):
+                if key not in job:
+                    raise ValueError("%s: job in '%s' has no %s" % (filename, experiment.get("experiment"), key))
+            args = job.get("args", [])
+            if isinstance(args, basestring):
+                args = shlex.split(args)
+            jobs.append(Job(str(experiment["experiment"]), str(job["stage"]), str(job["generator"]), str(job["script"]), [str(a) for a in args]))
+    return jobs
+
+
+_generators = {}
+
+def loadGenerator(name):
+    '''
+    Loads a job generator module by name (once)
+    
+    @param name: string, e.g. kraken, make_kraken_job or rad-pipeline_make_kraken_job
+    @return: module, the generator (with a main(argv) function)
+    '''
+    if name.startswith("rad-pipeline_"):
+        name = name[len("rad-pipeline_"):]
+    if not name.startswith("make_"):
+        name = "make_%s_job" % name
+    if name not in _generators:
+        filename = os.path.join(SRCDIR, "%s.py" % name)
+        if not os.path.isfile(filename):
+            raise ValueError("unknown generator '%s'" % name)
+        _generators[name] = imp.load_source(name.replace("-", "_"), filename)
+    return _generators[name]
+
+
+def generate(job, basedir):
+    '''
+    Generates a single job script
+    
+    @param basedir: string, the directory experiments are relative to
+    @return: int, the generator's exit code
+    '''
+    generator = loadGenerator(job.generator)
+    stagedir = os.path.join(basedir, job.experiment, job.stage)
+    if not os.path.isdir(stagedir):
+        sys.stderr.write("Error: directory '%s' does not exist\n" % stagedir)
+        return 1
+    
+    argv = ["rad-pipeline_%s" % os.path.splitext(os.path.basename(generator.__file__))[0]] + job.args
+    scriptfilename = job.script
+    tmpfilename = "%s.%s.tmp" % (scriptfilename, os.getpid())
+    
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    sysargv = sys.argv
+    status = 1
+    try:
+        os.chdir(stagedir)
+        with open(tmpfilename, 'w') as f:
+            sys.stdout = f
+            sys.argv = argv
+            try:
+                status = generator.main(argv)
+            except SystemExit as e:
+                # argparse errors
+                status = e.code
+        if status == 0:
+            os.rename(tmpfilename, scriptfilename)
+    finally:
+        sys.stdout = stdout
+        sys.argv = sysargv
+        if os.path.exists(tmpfilename):
+            os.remove(tmpfilename)
+        os.chdir(cwd)
+    return status
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_make_batch_jobs", description='Generates the job scripts listed in a manifest (TSV or YAML) in one process')
+    
+    parser.add_argument("manifest", help="The manifest listing experiment, stage, generator, script and arguments for each job script.")
+    parser.add_argument("-k", "--keep-going", action='store_true', help="Continue generating scripts after a failure.")
+    
+    args = parser.parse_args(argv[1:])
+    
+    try:
+        jobs = readManifest(args.manifest)
+    except (IOError, ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    basedir = os.path.dirname(os.path.abspath(args.manifest))
+    
+    start = time.time()
+    failed = 0
+    for job in jobs:
+        jobstart = time.time()
+        try:
+            status = generate(job, basedir)
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            status = 1
+        sys.stderr.write("%-60s %8.3fs%s\n" % (job.name(), time.time() - jobstart, "" if status == 0 else "  FAILED"))
+        if status != 0:
+            failed += 1
+            if not args.keep_going:
+                break
+    sys.stderr.write("%-60s %8.3fs\n" % ("Total (%s scripts, %s failed)" % (len(jobs), failed), time.time() - start))
+    
+    if failed > 0:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
@@ -38,9 +38,9 @@ Generates a Slurm script for running demultiplex_radtags on a collection of file
 
 @author:     Andrew Robinson
 '''
-import sys, argparse, os, subprocess
+import sys, argparse, os
 
-import common, time
+import common, modules, resources, time
 
 def main(argv):
     ''''''
@@ -53,6 +53,9 @@ def main(argv):
     parser.add_argument("-t", "--time", nargs=1, metavar='time', default=["01:00:00"], help="Job max runtime.  [Default: 01:00:00]")
     parser.add_argument("-e", "--enzyme", nargs='+', metavar='enzyme', default=["ecoRI"], help="1 or 2 enzymes used for cut sites.  [Default: ecoRI]")
     parser.add_argument("-r", "--no-remainder", action='store_true', help="Don't include the remainder (singleton) reads in output  [Default: notset (i.e. include them)]")
+    common.addDeferredArgument(parser)
+    common.addManifestArguments(parser, "demux")
+    resources.addResourceArguments(parser)
     
     args = parser.parse_args(argv[1:])
 
@@ -71,26 +74,28 @@ def main(argv):
     #if args.cores[0] == 0:
     #    vars["slurmheader"] = common.makeExclusiveHeader(partition=args.partition[0], time=args.time[0])
     #else:
-    vars["slurmheader"] = common.makeHeader(partition=args.partition[0], ntasks=1, time=args.time[0])
     vars["datetime"] = time.strftime("%Y-%m-%d %H:%M:%S")
     if len(args.enzyme) > 1:
         vars["enzymes"] = "--renz_1 %s --renz_2 %s" % (args.enzyme[0], args.enzyme[1])
     else:
         vars["enzymes"] = "-e %s" % (args.enzyme[0],)
-    files = []
-    for f in args.file:
-        if '*' in f or '?' in f or os.path.exists(f):
-            if os.path.isdir(f):
-                files.append("%s/%s" % (f, args.dir_filter[0]))
-            else:
-                files.append(f)
-        else:
-            sys.stderr.write("Warning: file '%s' does not exist and will be ignored\n")
+    files = common.expandFiles(args.file, args.dir_filter[0], canonical=False, deferred=args.deferred)
+    if len(files) == 0:
+        sys.stderr.write("No files found: '%s'\n" % (" ".join(args.file)))
+        return 1
     
+    header = {"partition": args.partition[0], "ntasks": 1, "time": args.time[0]}
+    header.update(resources.jobInfo("demux", files))
+    usage = resources.autoResources(args, "demux", files, 1)
+    if usage is not None:
+        header.update(usage.header())
+    vars["slurmheader"] = common.makeHeader(**header)
     vars["files"] = " ".join(files)
-    vars["stacksversion"] = subprocess.check_output(["rad-pipeline_module_version", "stacks-gcc"]).rstrip()
-    vars["radpipelineversion"] = subprocess.check_output(["rad-pipeline_module_version", "rad-pipeline"]).rstrip()
+    versions = modules.moduleVersions(["stacks-gcc", "rad-pipeline"])
+    vars["stacksversion"] = versions["stacks-gcc"]
+    vars["radpipelineversion"] = versions["rad-pipeline"]
     vars["CMD"] = " ".join(argv)
+    vars.update(common.manifestVars(args))
     if args.no_remainder:
         vars["norem"] = "#"
     else:
@@ -37,9 +37,9 @@ Generates a Slurm script for optimising stacks denovo_map.pl
 
 @author:     Andrew Robinson
 '''
-import sys, argparse, os, subprocess
+import sys, argparse, os
 
-import common
+import common, modules
 
 def main(argv):
     ''''''
@@ -47,6 +47,8 @@ def main(argv):
     
     parser.add_argument("-j", "--cores", nargs=1, metavar='N', type=int, default=[0], help="Total number of cores to use, 0=exclusive. [Default: 0]")
     parser.add_argument("--cores-task", nargs=1, metavar='T', type=int, default=[2], help="Number of cores each task (trial) uses. [Default: 2]")
+    parser.add_argument("--nodes", nargs=1, metavar='N', type=int, default=[1], help="The number of (whole) nodes to spread the trials over when -j is 0. [Default: 1]")
+    parser.add_argument("--launcher", nargs=1, metavar='launcher', default=["auto"], choices=["auto", "local", "srun"], help="How each trial is started: local (on the first node) or srun (a job step on any node of the job); auto uses srun when the job has more than one node's cores. [Default: auto]")
     parser.add_argument("-p", "--partition", nargs=1, metavar="partition", default=["compute"], choices=['bigmem', '8hour', 'compute'], help="The partition (or queue) to submit job to")
     
     parser.add_argument("-m", "--m-range", nargs=1, metavar='d-D', default=["3-10"], help="The range of values to use for -m option. [Default: 3-10]")
@@ -59,6 +61,9 @@ def main(argv):
     parser.add_argument("--denovo-opts", nargs=1, metavar='OPTS', default=["-S -t"], help="Other command line options to pass to denovo_map.pl. [Default: -S -t]")
     parser.add_argument("--keep-denovo-log", nargs=1, metavar='N', type=bool, default=[False], help="Keep the denovo_log files for each trial [Default: 0 (False)]")
     parser.add_argument("--batch-id", nargs=1, metavar='N', type=int, default=[1], help="The batch id to use for denovo_map.pl [Default: 1]")
+    parser.add_argument("--force", action='store_true', help="Rerun trials that are already in the trial store (see rad-pipeline_trials).  Or export RAD_PIPELINE_FORCE=1 when running the script.")
+    parser.add_argument("--prune", nargs=1, metavar='rules', default=[""], help="Rules for stopping trials that won't beat the best finished trial, e.g. 'depth<0.5 reads<0.7' (see rad-pipeline_schedule_trials -h).  Off by default as a stat can be lower than the best trial's while the score is higher. [Default: '' (run every trial to the end)]")
+    parser.add_argument("--prune-after", nargs=1, metavar='N', type=int, default=[2], help="The number of samples a trial must have finished before it may be stopped. [Default: 2]")
     
     parser.add_argument("file", nargs="+", help="Files or directory to process.  If directory, -f filter is used to select files within.")
     parser.add_argument("-f", "--dir-filter", nargs=1, metavar='filter', default=["*.f*q"], help="A filter to match files when searching a directory.  [Default: *.f*q]")
@@ -70,25 +75,22 @@ def main(argv):
     
     ## make the variable parts of script
     subs = {}
+    nodes = max(1, args.nodes[0])
     if args.cores[0] == 0:
-        subs['slurmheader'] = common.makeExclusiveHeader(partition=args.partition[0], mem="64000")
-        args.cores[0] = 16
+        subs['slurmheader'] = common.makeExclusiveHeader(partition=args.partition[0], mem="64000", nodes=str(nodes))
+        args.cores[0] = 16 * nodes
     else:
         subs['slurmheader'] = common.makeHeader(partition=args.partition[0], ntasks=args.cores[0])
-    files = []
-    for f in args.file:
-        if '*' in f or '?' in f or os.path.exists(f):
-            if os.path.isdir(f):
-                files.append("%s/%s" % (f, args.dir_filter[0]))
-            else:
-                files.append(f)
-        else:
-            sys.stderr.write("Warning: file '%s' does not exist and will be ignored\n"%f)
+    files = common.expandFiles(args.file, args.dir_filter[0], canonical=False)
+    if len(files) == 0:
+        sys.stderr.write("No files found: '%s'\n" % (" ".join(args.file)))
+        return 1
             
     subs['files'] = " ".join(files)
-    subs['stacksversion'] = subprocess.check_output(["rad-pipeline_module_version", "stacks-gcc"]).rstrip()
-    vars["parallelversion"] = subprocess.check_output(["rad-pipeline_module_version", "parallel"]).rstrip()
-    vars["radpipelineversion"] = subprocess.check_output(["rad-pipeline_module_version", "rad-pipeline"]).rstrip()
+    versions = modules.moduleVersions(["stacks-gcc", "parallel", "rad-pipeline"])
+    subs['stacksversion'] = versions["stacks-gcc"]
+    subs['parallelversion'] = versions["parallel"]
+    subs['radpipelineversion'] = versions["rad-pipeline"]
     
     subs['mrange'] = " ".join(args.m_range[0].split('-'))
     subs['mcount'] = str(args.m_count[0])
@@ -103,19 +105,21 @@ def main(argv):
     else:
         subs['nocpdenovo'] = "#"
     
+    launcher = args.launcher[0]
+    if launcher == "auto":
+        launcher = "srun" if args.cores[0] > 16 else "local"
+    subs['launcher'] = launcher
+    subs['nodes'] = nodes
     subs['corestask'] = args.cores_task[0]
     subs['paralleljobs'] = str(int(args.cores[0] / args.cores_task[0]))
     subs['denovoopts'] = args.denovo_opts[0]
     subs['batchid'] = args.batch_id[0]
+    subs['force'] = "1" if args.force else ""
+    subs['prune'] = args.prune[0]
+    subs['pruneafter'] = args.prune_after[0]
 
     ## validate inputs ##
-    filecount = 0
-    if len(files) > 0:
-        cmd = ["bash", "-c", 'ls -1 %s'%(" ".join(files))]
-        #cmd.extend(files)
-        filelist = subprocess.check_output(cmd).rstrip()
-        #print "'%s'"%filelist
-        filecount = len(filelist.split("\n"))
+    filecount = len(files)
 
     if filecount < 2 or filecount > 6:
         sys.stderr.write("Warning: suboptimal number of samples (%s).  You should use 2 to 6 representitive samples.\n"%filecount)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Generates a Slurm script that searches for the best stacks denovo_map.pl
+parameters (see rad-pipeline_denovo_search) instead of running a full grid
+
+@author:     Andrew Robinson
+'''
+import sys, argparse, os
+
+import common, modules
+
+def main(argv):
+    ''''''
+    parser = argparse.ArgumentParser(description='Generates a Slurm script that searches for the best stacks denovo_map.pl parameters')
+
+    parser.add_argument("-j", "--cores", nargs=1, metavar='N', type=int, default=[0], help="Total number of cores to use, 0=exclusive. [Default: 0]")
+    parser.add_argument("--cores-task", nargs=1, metavar='T', type=int, default=[2], help="Number of cores each task (trial) uses. [Default: 2]")
+    parser.add_argument("--nodes", nargs=1, metavar='N', type=int, default=[1], help="The number of (whole) nodes to spread the trials over when -j is 0. [Default: 1]")
+    parser.add_argument("--launcher", nargs=1, metavar='launcher', default=["auto"], choices=["auto", "local", "srun"], help="How each trial is started: local (on the first node) or srun (a job step on any node of the job); auto uses srun when the job has more than one node's cores. [Default: auto]")
+    parser.add_argument("-p", "--partition", nargs=1, metavar="partition", default=["compute"], choices=['bigmem', '8hour', 'compute'], help="The partition (or queue) to submit job to")
+
+    parser.add_argument("-m", "--m-range", nargs=1, metavar='d-D', default=["3-10"], help="The range of values to search for -m option. [Default: 3-10]")
+    parser.add_argument("-n", "--n-range", nargs=1, metavar='d-D', default=["5-20"], help="The range of values to search for -n option. [Default: 5-20]")
+    parser.add_argument("-M", "--M-range", nargs=1, metavar='d-D', default=["5-20"], help="The range of values to search for -M option. [Default: 5-20]")
+    parser.add_argument("--max-trials", nargs=1, metavar='N', type=int, default=[40], help="The most trials (denovo_map.pl runs) to make. [Default: 40]")
+    parser.add_argument("--tolerance", nargs=1, metavar='F', type=float, default=[0.02], help="Stop when refining changes the best catalog size and coverage by less than this fraction. [Default: 0.02]")
+    parser.add_argument("--min-coverage", nargs=1, metavar='X', type=float, default=[10.0], help="Trials with less mean coverage than this score lower, 0=ignore coverage. [Default: 10]")
+
+    parser.add_argument("--denovo-opts", nargs=1, metavar='OPTS', default=["-S -t"], help="Other command line options to pass to denovo_map.pl. [Default: -S -t]")
+    parser.add_argument("--keep-denovo-log", nargs=1, metavar='N', type=bool, default=[False], help="Keep the denovo_log files for each trial [Default: 0 (False)]")
+    parser.add_argument("--batch-id", nargs=1, metavar='N', type=int, default=[1], help="The batch id to use for denovo_map.pl [Default: 1]")
+    parser.add_argument("--force", action='store_true', help="Rerun trials that are already in the trial store (see rad-pipeline_trials).  Or export RAD_PIPELINE_FORCE=1 when running the script.")
+    parser.add_argument("--prune", nargs=1, metavar='rules', default=[""], help="Rules for stopping trials that won't beat the best finished trial, e.g. 'depth<0.5 reads<0.7' (see rad-pipeline_schedule_trials -h).  Off by default as a stat can be lower than the best trial's while the score is higher. [Default: '' (run every trial to the end)]")
+    parser.add_argument("--prune-after", nargs=1, metavar='N', type=int, default=[2], help="The number of samples a trial must have finished before it may be stopped. [Default: 2]")
+
+    parser.add_argument("file", nargs="+", help="Files or directory to process.  If directory, -f filter is used to select files within.")
+    parser.add_argument("-f", "--dir-filter", nargs=1, metavar='filter', default=["*.f*q"], help="A filter to match files when searching a directory.  [Default: *.f*q]")
+
+    args = parser.parse_args(argv[1:])
+
+    common.writecmd(argv)
+
+    for option, value in (("-m", args.m_range[0]), ("-n", args.n_range[0]), ("-M", args.M_range[0])):
+        parts = value.split('-')
+        if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit() or int(parts[0]) > int(parts[1]):
+            sys.stderr.write("Error: invalid range for %s: '%s', expected d-D\n" % (option, value))
+            return 1
+
+    ## make the variable parts of script
+    subs = {}
+    nodes = max(1, args.nodes[0])
+    if args.cores[0] == 0:
+        subs['slurmheader'] = common.makeExclusiveHeader(partition=args.partition[0], mem="64000", nodes=str(nodes))
+        args.cores[0] = 16 * nodes
+    else:
+        subs['slurmheader'] = common.makeHeader(partition=args.partition[0], ntasks=args.cores[0])
+    files = common.expandFiles(args.file, args.dir_filter[0], canonical=False)
+    if len(files) == 0:
+        sys.stderr.write("No files found: '%s'\n" % (" ".join(args.file)))
+        return 1
+
+    subs['files'] = " ".join(files)
+    versions = modules.moduleVersions(["stacks-gcc", "rad-pipeline"])
+    subs['stacksversion'] = versions["stacks-gcc"]
+    subs['radpipelineversion'] = versions["rad-pipeline"]
+
+    subs['mrange'] = args.m_range[0]
+    subs['nrange'] = args.n_range[0]
+    subs['Mrange'] = args.M_range[0]
+    subs['maxtrials'] = args.max_trials[0]
+    subs['tolerance'] = args.tolerance[0]
+    subs['mincoverage'] = args.min_coverage[0]
+    subs['CMD'] = " ".join(argv)
+
+    if args.keep_denovo_log[0]:
+        subs['nocpdenovo'] = ""
+    else:
+        subs['nocpdenovo'] = "#"
+
+    launcher = args.launcher[0]
+    if launcher == "auto":
+        launcher = "srun" if args.cores[0] > 16 else "local"
+    subs['launcher'] = launcher
+    subs['nodes'] = nodes
+    subs['corestask'] = args.cores_task[0]
+    subs['paralleljobs'] = str(max(1, int(args.cores[0] / args.cores_task[0])))
+    subs['denovoopts'] = args.denovo_opts[0]
+    subs['batchid'] = args.batch_id[0]
+    subs['force'] = "1" if args.force else ""
+    subs['prune'] = args.prune[0]
+    subs['pruneafter'] = args.prune_after[0]
+
+    ## validate inputs ##
+    filecount = len(files)
+
+    if filecount < 2 or filecount > 6:
+        sys.stderr.write("Warning: suboptimal number of samples (%s).  You should use 2 to 6 representitive samples.\n"%filecount)
+
+
+    jobscript = common.loadTemplate("denovo_search.slurm")
+    if jobscript != "":
+        print jobscript.format(**subs)
+    else:
+        sys.stderr.write("Error: failed to find template 'denovo_search.slurm'\n")
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
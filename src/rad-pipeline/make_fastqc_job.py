@@ -37,9 +37,9 @@ Generates a Slurm script for running fastqc on various sequence data files
 
 @author:     Andrew Robinson
 '''
-import sys, argparse, os, subprocess
+import sys, argparse, os
 
-import common
+import common, modules, resources
 
 def main(argv):
     ''''''
@@ -49,6 +49,9 @@ def main(argv):
     parser.add_argument("-p", "--partition", nargs=1, metavar="partition", default=["8hour"], choices=['bigmem', '8hour', 'compute'], help="The partition (or queue) to submit job to")
     parser.add_argument("rawfile", nargs="+", help="Files or directory of raw fastq/a sequences to process.  If directory, -f filter is used to select files within.")
     parser.add_argument("-f", "--dir-filter", nargs=1, metavar='filter', default=["*.f*q"], help="A filter to match files when searching a directory.  [Default: \"*.f*q]\"")
+    common.addArrayArguments(parser, "fastqc")
+    common.addDeferredArgument(parser)
+    resources.addResourceArguments(parser)
     #parser.add_argument("-k", "--kraken-file", nargs="+", help="Files or directory of kraken_classified fastq/a sequences.  If directory, -K filter is used to select files within.")
     #parser.add_argument("-K", "--kraken-dir-filter", nargs=1, metavar='filter', default=["*_classified.f*q"], help="A filter to match files when searching a kraken result directory.  [Default: \"*_classified.f*q\"]")
     
@@ -59,7 +62,7 @@ def main(argv):
     #print args
 
     # expand files
-    rawfiles=common.expandFiles(args.rawfile, args.dir_filter[0])
+    rawfiles=common.expandFiles(args.rawfile, args.dir_filter[0], deferred=args.deferred)
     #krakenfiles=common.expandFiles(args.kraken_file, args.kraken_dir_filter[0])
 
     error=False
@@ -76,19 +79,41 @@ def main(argv):
     vars={}
     vars["rawfiles"] = " ".join(rawfiles)
     #vars["krakenfiles"] = " ".join(krakenfiles)
-    if args.cores[0] == 0:
-        vars["slurmheader"] = common.makeExclusiveHeader(partition=args.partition[0])
+    header = {"partition": args.partition[0]}
+    header.update(resources.jobInfo("fastqc", rawfiles, args.array))
+    # one core per array task
+    usage = resources.autoResources(args, "fastqc", rawfiles, 1 if args.array else args.cores[0], args.array)
+    if usage is not None:
+        header.update(usage.header())
+    if args.array:
+        try:
+            array, vars["filelist"] = common.makeArray(rawfiles, args.file_list[0], args.array_limit[0], args.deferred)
+        except ValueError as e:
+            sys.stderr.write("Error: %s\n" % e)
+            return 1
+        vars["slurmheader"] = common.makeHeader(array=array, output="fastqc-array-%a.log", **header)
+        vars["tasks"] = len(rawfiles)
+        vars["logprefix"] = "fastqc-array"
+    elif usage is not None:
+        vars["slurmheader"] = common.makeHeader(**header)
+        vars["cores"] = usage.ntasks
+    elif args.cores[0] == 0:
+        vars["slurmheader"] = common.makeExclusiveHeader(**header)
         vars["cores"] = "16"
     else:
-        vars["slurmheader"] = common.makeHeader(partition=args.partition[0], ntasks=args.cores[0])
+        vars["slurmheader"] = common.makeHeader(ntasks=args.cores[0], **header)
         vars["cores"] = args.cores[0]
     #vars["slurmheader"] = common.makeHeader(partition=args.partition[0], cores=1)
-    vars["fastqcversion"] = subprocess.check_output(["rad-pipeline_module_version", "fastqc"]).rstrip()
-    vars["parallelversion"] = subprocess.check_output(["rad-pipeline_module_version", "parallel"]).rstrip()
-    vars["radpipelineversion"] = subprocess.check_output(["rad-pipeline_module_version", "rad-pipeline"]).rstrip()
+    versions = modules.moduleVersions(["fastqc", "parallel", "rad-pipeline"])
+    vars["fastqcversion"] = versions["fastqc"]
+    vars["parallelversion"] = versions["parallel"]
+    vars["radpipelineversion"] = versions["rad-pipeline"]
     vars["CMD"] = " ".join(argv)
     
-    jobscript = common.loadTemplate("fastqc.slurm")
+    if args.array:
+        jobscript = common.loadTemplate("fastqc_array.slurm")
+    else:
+        jobscript = common.loadTemplate("fastqc.slurm")
     
     #print jobscript
 
@@ -37,9 +37,9 @@ Generates a Slurm script for running kraken on a collection of files
 
 @author:     Andrew Robinson
 '''
-import sys, argparse, os, subprocess
+import sys, argparse, os
 
-import common
+import common, modules, resources
 
 def main(argv):
     ''''''
@@ -50,6 +50,10 @@ def main(argv):
     parser.add_argument("file", nargs="+", help="Files or directory to process.  If directory, -f filter is used to select files within.")
     parser.add_argument("-f", "--dir-filter", nargs=1, metavar='filter', default=["*_R1_*.f*q*"], help="A filter to match files when searching a directory.  [Default: \"*_R1_*.f*q*\"]")
     parser.add_argument("-t", "--time", nargs=1, metavar='time', default=["01:00:00"], help="Job max runtime.  [Default: 01:00:00]")
+    common.addArrayArguments(parser, "pear")
+    common.addDeferredArgument(parser)
+    common.addManifestArguments(parser, "pear")
+    resources.addResourceArguments(parser)
     
     args = parser.parse_args(argv[1:])
     
@@ -65,26 +69,42 @@ def main(argv):
         vars["cores"] = args.cores[0]
     if vars["cores"] > 8 and args.partition[0] == "8hour":
         args.partition[0] = "compute"
-    if args.cores[0] == 0:
-        vars["slurmheader"] = common.makeExclusiveHeader(partition=args.partition[0], time=args.time[0])
+    files = common.expandFiles(args.file, args.dir_filter[0], canonical=False, deferred=args.deferred)
+    if len(files) == 0:
+        sys.stderr.write("No files found: '%s'\n" % (" ".join(args.file)))
+        return 1
+    header = {"partition": args.partition[0], "time": args.time[0]}
+    header.update(resources.jobInfo("pear", files, args.array))
+    usage = resources.autoResources(args, "pear", files, args.cores[0], args.array)
+    if args.array:
+        try:
+            header["array"], vars["filelist"] = common.makeArray(files, args.file_list[0], args.array_limit[0], args.deferred)
+        except ValueError as e:
+            sys.stderr.write("Error: %s\n" % e)
+            return 1
+        header["output"] = "pear-array-%a.log"
+        vars["tasks"] = len(files)
+        vars["logprefix"] = "pear-array"
+    if usage is not None:
+        header.update(usage.header())
+        vars["cores"] = usage.ntasks
+        vars["slurmheader"] = common.makeHeader(**header)
+    elif args.cores[0] == 0:
+        vars["slurmheader"] = common.makeExclusiveHeader(**header)
     else:
-        vars["slurmheader"] = common.makeHeader(partition=args.partition[0], ntasks=args.cores[0], time=args.time[0])
-    files = []
-    for f in args.file:
-        if '*' in f or '?' in f or os.path.exists(f):
-            if os.path.isdir(f):
-                files.append("%s/%s" % (f, args.dir_filter[0]))
-            else:
-                files.append(f)
-        else:
-            sys.stderr.write("Warning: file '%s' does not exist and will be ignored\n")
+        vars["slurmheader"] = common.makeHeader(ntasks=args.cores[0], **header)
     
     vars["files"] = " ".join(files)
-    vars["pearversion"] = subprocess.check_output(["rad-pipeline_module_version", "pear-gcc"]).rstrip()
-    vars["radpipelineversion"] = subprocess.check_output(["rad-pipeline_module_version", "rad-pipeline"]).rstrip()
+    versions = modules.moduleVersions(["pear-gcc", "rad-pipeline"])
+    vars["pearversion"] = versions["pear-gcc"]
+    vars["radpipelineversion"] = versions["rad-pipeline"]
     vars["CMD"] = " ".join(argv)
+    vars.update(common.manifestVars(args))
     
-    jobscript = common.loadTemplate("pear.slurm")
+    if args.array:
+        jobscript = common.loadTemplate("pear_array.slurm")
+    else:
+        jobscript = common.loadTemplate("pear.slurm")
     
     print jobscript.format(**vars)
     
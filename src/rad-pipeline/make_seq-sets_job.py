@@ -37,9 +37,9 @@ Generates a Slurm script for running seq-sets on a collection of raw and kraken
 
 @author:     Andrew Robinson
 '''
-import sys, argparse, os, subprocess
+import sys, argparse, os
 
-import common
+import common, modules, resources
 
 def main(argv):
     ''''''
@@ -51,6 +51,10 @@ def main(argv):
     parser.add_argument("-f", "--dir-filter", nargs=1, metavar='filter', default=["*.f*q"], help="A filter to match files when searching a directory.  [Default: \"*.f*q]\"")
     parser.add_argument("-k", "--kraken-file", nargs="+", help="Files or directory of kraken_classified fastq/a sequences.  If directory, -K filter is used to select files within.")
     parser.add_argument("-K", "--kraken-dir-filter", nargs=1, metavar='filter', default=["*_classified.f*q"], help="A filter to match files when searching a kraken result directory.  [Default: \"*_classified.f*q\"]")
+    common.addArrayArguments(parser, "seqsets")
+    common.addDeferredArgument(parser)
+    common.addManifestArguments(parser, "seqsets")
+    resources.addResourceArguments(parser)
     
     args = parser.parse_args(argv[1:])
     
@@ -59,8 +63,8 @@ def main(argv):
     #print args
 
     # expand files
-    rawfiles=common.expandFiles(args.rawfile, args.dir_filter[0])
-    krakenfiles=common.expandFiles(args.kraken_file, args.kraken_dir_filter[0])
+    rawfiles=common.expandFiles(args.rawfile, args.dir_filter[0], deferred=args.deferred)
+    krakenfiles=common.expandFiles(args.kraken_file, args.kraken_dir_filter[0], deferred=args.deferred)
 
     error=False
     if len(rawfiles) == 0:
@@ -80,13 +84,32 @@ def main(argv):
     #    vars["slurmheader"] = common.makeExclusiveHeader(partition=args.partition[0])
     #else:
     #    vars["slurmheader"] = common.makeHeader(partition=args.partition[0], ntasks=args.cores[0])
-    vars["slurmheader"] = common.makeHeader(partition=args.partition[0], cores=1)
-    vars["biostreamtoolsversion"] = subprocess.check_output(["rad-pipeline_module_version", "biostreamtools"]).rstrip()
-    vars["parallelversion"] = subprocess.check_output(["rad-pipeline_module_version", "parallel"]).rstrip()
-    vars["radpipelineversion"] = subprocess.check_output(["rad-pipeline_module_version", "rad-pipeline"]).rstrip()
+    header = {"partition": args.partition[0]}
+    header.update(resources.jobInfo("seq-sets", rawfiles, args.array))
+    usage = resources.autoResources(args, "seq-sets", rawfiles, 1, args.array)
+    if usage is not None:
+        header.update(usage.header())
+    if args.array:
+        try:
+            header["array"], vars["filelist"] = common.makeArray(rawfiles, args.file_list[0], args.array_limit[0], args.deferred)
+        except ValueError as e:
+            sys.stderr.write("Error: %s\n" % e)
+            return 1
+        header["output"] = "seqsets-array-%a.log"
+        vars["tasks"] = len(rawfiles)
+        vars["logprefix"] = "seqsets-array"
+    vars["slurmheader"] = common.makeHeader(**header)
+    versions = modules.moduleVersions(["biostreamtools", "parallel", "rad-pipeline"])
+    vars["biostreamtoolsversion"] = versions["biostreamtools"]
+    vars["parallelversion"] = versions["parallel"]
+    vars["radpipelineversion"] = versions["rad-pipeline"]
     vars["CMD"] = " ".join(argv)
+    vars.update(common.manifestVars(args))
     
-    jobscript = common.loadTemplate("seqsets.slurm")
+    if args.array:
+        jobscript = common.loadTemplate("seqsets_array.slurm")
+    else:
+        jobscript = common.loadTemplate("seqsets.slurm")
     
     print jobscript.format(**vars)
     
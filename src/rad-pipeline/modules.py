@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Resolves the versions of environment modules for job scripts
+
+All the modules a generator needs are looked up with a single 'module avail'
+call and the results are kept in a shared cache file for a while (the TTL) so
+generating several job scripts doesn't query the module system each time.
+
+Versions can be pinned with an override file; the first found of
+$RAD_PIPELINE_MODULE_PINS or a 'module-versions.conf' file in the current
+directory or any parent (e.g. the experiment directory).  Each line is a
+module name and version separated by whitespace, '#' starts a comment.
+'''
+
+import os, sys, argparse, subprocess, time
+
+# how long (seconds) a cached version is used
+DEFAULT_TTL = 24 * 60 * 60
+
+PINS_FILENAME = "module-versions.conf"
+
+
+def defaultCacheFile():
+    '''The cache file; $RAD_PIPELINE_MODULE_CACHE or ~/.cache/rad-pipeline/module-versions'''
+    cachefile = os.environ.get('RAD_PIPELINE_MODULE_CACHE')
+    if cachefile:
+        return cachefile
+    return os.path.join(os.path.expanduser("~"), ".cache", "rad-pipeline", "module-versions")
+
+
+def defaultTTL():
+    '''The cache TTL; $RAD_PIPELINE_MODULE_TTL (seconds) or DEFAULT_TTL'''
+    try:
+        return int(os.environ.get('RAD_PIPELINE_MODULE_TTL', DEFAULT_TTL))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def findPinsFile():
+    '''Searches for the module version override file (if it exists)'''
+    pinsfilename = os.environ.get('RAD_PIPELINE_MODULE_PINS')
+    if pinsfilename:
+        return pinsfilename
+    curdir = os.path.realpath(".")
+    while curdir not in ('/', '/home'):
+        if os.path.isfile("%s/%s" % (curdir, PINS_FILENAME)):
+            return "%s/%s" % (curdir, PINS_FILENAME)
+        curdir = os.path.dirname(curdir)
+    return None
+
+
+def readPins(pinsfilename):
+    '''
+    Reads a module version override file
+    
+    @return: dict, module name => version
+    '''
+    pins = {}
+    with open(pinsfilename) as f:
+        for line in f:
+            line = line.split("#", 1)[0].split()
+            if len(line) >= 2:
+                pins[line[0]] = line[1]
+    return pins
+
+
+def readCache(cachefilename, ttl):
+    '''
+    Reads the versions in the cache that are younger than ttl
+    
+    @return: dict, module name => (version, time resolved)
+    '''
+    cache = {}
+    now = time.time()
+    try:
+        with open(cachefilename) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 3 and now - float(fields[2]) < ttl:
+                    cache[fields[0]] = (fields[1], float(fields[2]))
+    except (IOError, ValueError):
+        pass
+    return cache
+
+
+def writeCache(cachefilename, cache):
+    '''Saves the cache (atomically, so concurrent generators don't see a partial file)'''
+    tmpfilename = "%s.%s.tmp" % (cachefilename, os.getpid())
+    try:
+        cachedir = os.path.dirname(cachefilename)
+        if cachedir and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        with open(tmpfilename, 'w') as f:
+            for name, (version, resolved) in sorted(cache.items()):
+                # don't remember modules that weren't found
+                if version == "":
+                    continue
+                f.write("%s\t%s\t%r\n" % (name, version, resolved))
+        os.rename(tmpfilename, cachefilename)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Warning: unable to save module version cache '%s': %s\n" % (cachefilename, e))
+        if os.path.exists(tmpfilename):
+            os.remove(tmpfilename)
+
+
+def queryVersions(names):
+    '''
+    Looks up the latest version of each module with one 'module avail' call
+    
+    A module matches any listed module starting with its name and the last
+    listed version is used (as rad-pipeline_module_version always has).
+    
+    @return: dict, module name => version ("" if not found)
+    '''
+    cmd = ["bash", "-c", 'module avail -t "$@" 2>&1', "module-avail"] + list(names)
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        output = p.communicate()[0]
+    except OSError as e:
+        sys.stderr.write("Warning: unable to run 'module avail': %s\n" % e)
+        output = ""
+    
+    versions = dict((name, "") for name in names)
+    for line in output.split("\n"):
+        line = line.strip()
+        for name in names:
+            if line.startswith(name):
+                versions[name] = line.rsplit("/", 1)[-1]
+    return versions
+
+
+# the cache files read by this process, (filename, ttl) => versions
+_caches = {}
+
+def moduleVersions(names, refresh=False, cachefilename=None, ttl=None):
+    '''
+    Resolves the version of each module
+    
+    Pinned versions are used first, then cached versions, the rest are
+    looked up together and added to the cache.
+    
+    @param names: list, the module names
+    @param refresh: bool, ignore (and replace) cached versions
+    @param cachefilename: string, the cache file (None = defaultCacheFile())
+    @param ttl: int, how long (seconds) cached versions are used (None = defaultTTL())
+    @return: dict, module name => version ("" if not found)
+    '''
+    if cachefilename is None:
+        cachefilename = defaultCacheFile()
+    if ttl is None:
+        ttl = defaultTTL()
+    
+    versions = {}
+    pinsfilename = findPinsFile()
+    if pinsfilename is not None:
+        try:
+            pins = readPins(pinsfilename)
+        except IOError as e:
+            sys.stderr.write("Warning: unable to read module versions '%s': %s\n" % (pinsfilename, e))
+            pins = {}
+        for name in names:
+            if name in pins:
+                versions[name] = pins[name]
+    
+    if refresh or (cachefilename, ttl) not in _caches:
+        _caches[(cachefilename, ttl)] = readCache(cachefilename, ttl)
+    cache = _caches[(cachefilename, ttl)]
+    missing = []
+    for name in names:
+        if name not in versions:
+            if name in cache and not refresh:
+                versions[name] = cache[name][0]
+            else:
+                missing.append(name)
+    
+    if len(missing) > 0:
+        now = time.time()
+        for name, version in queryVersions(missing).items():
+            versions[name] = version
+            cache[name] = (version, now)
+        writeCache(cachefilename, cache)
+    
+    return versions
+
+
+def moduleVersion(name):
+    '''Resolves the version of a single module (see moduleVersions)'''
+    return moduleVersions([name])[name]
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_module_version", description='Prints the (latest or pinned) version of environment modules')
+    
+    parser.add_argument("module", nargs="+", help="The module name(s).  One version is printed per line.")
+    parser.add_argument("-r", "--refresh", action='store_true', help="Ignore the cached versions and query the module system.")
+    parser.add_argument("--ttl", nargs=1, metavar='S', type=int, default=[None], help="How long (seconds) cached versions are used. [Default: $RAD_PIPELINE_MODULE_TTL or %s]" % DEFAULT_TTL)
+    
+    args = parser.parse_args(argv[1:])
+    
+    versions = moduleVersions(args.module, args.refresh, ttl=args.ttl[0])
+    for name in args.module:
+        print versions[name]
+    
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
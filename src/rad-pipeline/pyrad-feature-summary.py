@@ -39,127 +39,345 @@ Computes a summary and consensus sequence for each feature
 @author: arobinson
 '''
 
-import sys
-
-
-def _usage(argv):
-    progname = "pyrad-feature-summary"
-    if len(argv) > 0:
-        progname = argv[0]
-    print ("")
-    print ("usage: %s -h" % progname)
-    print ("usage: %s locifile.loci featurefile.vcf" % progname)
-    print ("")
-    if '-h' in argv or '--help' in argv:
-        print ("Computes a summary and consensus sequence for each feature")
-        print ("")
-    print (" locifile.loci    File containing the loci sequences for each sample found at the loci.")
-    print (" featurefile.vcf  File containing features of interest.  This is generally") 
-    print ("                  a filtered version of the vcf output from pyRAD.")
-    print ("")
+import os, sys, argparse, heapq, marshal, multiprocessing, shutil, tempfile
+
+import loci, consensus_cache
+from consensus import makeConsensus, makeConsensusStats
+
+# number of features held in memory per run when sorting out-of-order features
+SORT_RUN_SIZE = 100000
 
 
 def _main(argv):
     '''Application main function'''
     
-    if len(argv) != 3:
-        _usage(argv)
+    parser = argparse.ArgumentParser(prog="pyrad-feature-summary", description='Computes a summary and consensus sequence for each feature')
+    
+    parser.add_argument("locifile", help="File containing the loci sequences for each sample found at the loci (.loci file or binary loci store).")
+    parser.add_argument("featurefile", help="File containing features of interest.  This is generally a filtered version of the vcf output from pyRAD.")
+    parser.add_argument("-i", "--index", action='store_true', help="Use a byte-offset index of the loci file (locifile.idx, built if missing or out-of-date) to read only the loci named in featurefile.")
+    parser.add_argument("-s", "--stream", action='store_true', help="Join features against loci in a single pass over each file, holding one locus at a time.  Features not in loci order are sorted on disk first.")
+    parser.add_argument("-j", "--jobs", nargs=1, metavar='N', type=int, default=[1], help="The number of processes used to compute consensus sequences (ignored with --index). [Default: 1]")
+    parser.add_argument("--chunk-size", nargs=1, metavar='MB', type=int, default=[4], help="The size of the loci file chunks given to each process when --jobs > 1. [Default: 4]")
+    parser.add_argument("--stats", nargs=1, metavar='file', default=[None], help="Also write the statistics of every locus (samples, length, mean coverage, fraction missing and segregating sites) to this TSV file; computed in the same pass as the consensus (not with --index).")
+    parser.add_argument("--no-cache", action='store_true', help="Don't read or write the consensus cache.")
+    parser.add_argument("--cache-dir", nargs=1, metavar='dir', default=[None], help="The consensus cache directory. [Default: $RAD_PIPELINE_CACHE_DIR or ~/.cache/rad-pipeline/consensus]")
+    parser.add_argument("--cache-size", nargs=1, metavar='MB', type=int, default=[consensus_cache.DEFAULT_SIZE], help="The maximum size of the consensus cache, least recently used entries are removed first. [Default: %s]" % consensus_cache.DEFAULT_SIZE)
+    parser.add_argument("--cache-key", nargs=1, metavar='key', default=["fast"], choices=['fast', 'content'], help="How loci files are identified in the cache; 'fast' uses size, mtime and sampled blocks, 'content' hashes the whole file. [Default: fast]")
+    
+    args = parser.parse_args(argv[1:])
+    
+    jobs = args.jobs[0]
+    chunksize = args.chunk_size[0] * 1024 * 1024
+    try:
+        compressed = loci.isCompressed(args.locifile)
+    except IOError as e:
+        sys.stderr.write("Error: unable to read loci file '%s': %s\n" % (args.locifile, e))
         return 1
+    if compressed:
+        if args.index or args.stream:
+            sys.stderr.write("Error: '%s' is compressed, --index and --stream need an uncompressed .loci file or loci store (see pyrad-loci2store); use the default mode\n" % args.locifile)
+            return 1
+        if jobs > 1:
+            sys.stderr.write("Warning: '%s' is compressed so can't be split between processes, using 1 process\n" % args.locifile)
+            jobs = 1
+    cache = None
+    if not args.no_cache:
+        cache = consensus_cache.ConsensusCache(args.cache_dir[0], args.cache_size[0], args.cache_key[0] == "content")
+    
+    statsfile = None
+    if args.stats[0] is not None:
+        if args.index:
+            sys.stderr.write("Error: --stats can't be used with --index\n")
+            return 1
+        try:
+            statsfile = open(args.stats[0], 'w')
+        except IOError as e:
+            sys.stderr.write("Error: unable to write stats file '%s': %s\n" % (args.stats[0], e))
+            return 1
+    
+    try:
+        if args.stream:
+            for text in streamFeatures(args.locifile, args.featurefile, jobs, chunksize, cache, statsfile):
+                print text
+            return 0
         
-    locifilename = argv[1]
-    vcffilename = argv[2]
-    
-    ## stage 1: construct consensus
-    consensus = {}
-    with open(locifilename) as f:
-        _sequences = []
-        _samples   = []
-        for line in f:
-            line = line.rstrip()
-            if line.startswith("//"):
-                _, _contigid = line.split("|", 1)
-                cons = makeConsensus(_sequences)
-                consensus[_contigid] = (cons, _samples)
-                
-                ## check concensus
-#                 print "Contig: %s" % _contigid
-#                 for s in _sequences:
-#                     print "S: %s" % s
-#                  
-#                 print "C: %s" % cons
-#                 print ""
-                
-                _sequences = []
-                _samples   = []
-            elif len(line) > 0:
-                seqid, seq = line.split()
-                _sequences.append(seq)
-                _samples.append(seqid[1:])
-    
-#     for key, value in consensus.items():
-#         print ("%s: %s" %(key, value))
+        ## stage 1: construct consensus
+        if args.index:
+            lookup = IndexedConsensus(args.locifile)
+        else:
+            lookup = {}
+            records = consensusRecords(args.locifile, jobs, chunksize, cache=cache, stats=statsfile is not None)
+            if statsfile is not None:
+                records = writeStats(records, statsfile)
+            for record in records:
+                lookup[record[0]] = (record[1], record[2])
+    finally:
+        if statsfile is not None:
+            statsfile.close()
     
     ## stage 2: merge features with consensus
-    with open(vcffilename) as f:
+    with open(args.featurefile) as f:
         for line in f:
             if not line.startswith("##"):
                 fields = line.split("\t", 8)[:8]
                  
                 if line.startswith("#"):
-                    print "SNP_ID\tCONTIG#\t%s\tCONSENSUS\tMEMBERS" % ("\t".join(fields[1:]))
+                    print _formatHeader(fields)
                 else:
                     if len(fields) > 3:
-                        pos = int(fields[1])
-                        cons, members = consensus[fields[0]]
-    #                     consf = cons
-                        consf = "%s<%s>%s" % (cons[:pos-1], cons[pos-1], cons[pos:])
-                        print "%s\t%s\t%s\t%s" %(":".join(fields[0:2]), 
-                                                 "\t".join(fields),
-                                                 consf,
-                                                 ",".join(members)
-                                                )
-                        
-    
+                        cons, members = lookup[fields[0]]
+                        print _formatFeature(fields, cons, members)
     
     return 0
 # end _main()
 
 
-def makeConsensus(sequences):
-    '''Creates a consensus sequence from provided sequences'''
+def _formatHeader(fields):
+    '''Formats the column headings from the vcf header fields'''
+    return "SNP_ID\tCONTIG#\t%s\tCONSENSUS\tMEMBERS" % ("\t".join(fields[1:]))
+
+
+def _formatFeature(fields, cons, members):
+    '''Formats a single feature (vcf fields) with its locus consensus and members'''
+    pos = int(fields[1])
+    consf = "%s<%s>%s" % (cons[:pos-1], cons[pos-1], cons[pos:])
+    return "%s\t%s\t%s\t%s" %(":".join(fields[0:2]), 
+                             "\t".join(fields),
+                             consf,
+                             ",".join(members)
+                            )
+
+
+def consensusRecords(locifilename, jobs=1, chunksize=4194304, wanted=None, cache=None, stats=False):
+    '''
+    Computes the consensus of each locus in locifilename
     
-    if len(sequences) > 0:
-        result = ""
-        for i in xrange(len(sequences[0])):
-            
-            # count bases at this position
-            counts = {}
-            for seq in sequences:
-                b = seq[i]
-                if b in counts:
-                    counts[b] += 1
-                else:
-                    counts[b] = 1
-            
-            # find most abundant
-            largest = ('N', 0)
-            while len(counts) > 0:
-                c = counts.popitem()
-                if c[1] > largest[1] and c[0] not in ('-', 'N'):
-                    largest = c
-            
-            result += largest[0]
-            
-        # next i (sequence index)
-        return result
-    return ""
+    When jobs > 1 the file is split into chunks (on record boundaries) which
+    are processed by a pool of processes; results are still yielded in file
+    order.
+    
+    @param wanted: set, the contig ids to compute (None = all)
+    @param cache: ConsensusCache, a cache to read from or add to (None = no caching)
+    @param stats: bool, also compute the locus statistics (the cache is not read)
+    @return: generator, (contigid, consensus, samples) or (contigid, consensus, samples, statistics) when stats in file order
+    '''
+    if cache is not None:
+        key = cache.key(locifilename)
+        records = None
+        if not stats:
+            records = cache.load(key)
+        if records is not None:
+            return (record for record in records if wanted is None or record[0] in wanted)
+        if wanted is None:
+            return cache.save(key, _computeConsensus(locifilename, jobs, chunksize, wanted, stats))
+    return _computeConsensus(locifilename, jobs, chunksize, wanted, stats)
+
+
+def _computeConsensus(locifilename, jobs, chunksize, wanted, stats=False):
+    '''Computes consensus records (see consensusRecords)'''
+    if jobs <= 1:
+        for _contigid, _samples, _sequences in loci.iterLoci(locifilename):
+            if wanted is None or _contigid in wanted:
+                yield _consensusRecord(_contigid, _samples, _sequences, stats)
+        return
+    
+    tasks = [(locifilename, start, end, wanted, stats) for start, end in loci.chunkRanges(locifilename, chunksize)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for records in pool.imap(_chunkConsensus, tasks):
+            for record in records:
+                yield record
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _chunkConsensus(task):
+    '''Computes the consensus of each locus in a chunk of the loci file (pool worker)'''
+    locifilename, start, end, wanted, stats = task
+    return [_consensusRecord(_contigid, _samples, _sequences, stats)
+            for _contigid, _samples, _sequences in loci.readLociRange(locifilename, start, end)
+            if wanted is None or _contigid in wanted]
+
+
+def _consensusRecord(contigid, samples, sequences, stats):
+    '''Makes the consensus record of a single locus (see consensusRecords)'''
+    if stats:
+        cons, statistics = makeConsensusStats(sequences)
+        return (contigid, cons, samples, statistics)
+    return (contigid, makeConsensus(sequences), samples)
+
+
+def writeStats(records, f):
+    '''
+    Writes the statistics of each consensus record to f as they are consumed
+    
+    @param records: iterable, (contigid, consensus, samples, statistics) (see consensusRecords)
+    @param f: file, the open stats file
+    @return: generator, the records
+    '''
+    f.write("CONTIG\tSAMPLES\tLENGTH\tCOVERAGE\tMISSING\tSEGREGATING\n")
+    for record in records:
+        _, length, coverage, missing, segregating = record[3]
+        f.write("%s\t%s\t%s\t%.2f\t%.4f\t%s\n" % (record[0], len(set(record[2])), length, coverage, missing, segregating))
+        yield record
+
+
+def streamFeatures(locifilename, featurefilename, jobs=1, chunksize=4194304, cache=None, statsfile=None):
+    '''
+    Joins features against loci in a single pass over each file
+    
+    pyRAD writes the .loci and .vcf files in the same contig order so they are
+    merge-joined directly.  Otherwise the features are sorted into loci order
+    on disk, joined, then sorted back so the output order matches the vcf.
+    
+    @param statsfile: file, also write the statistics of every locus here (see writeStats)
+    @return: generator, the output lines (in featurefile order)
+    '''
+    offsets = loci.loadIndex(locifilename)
     
+    # check features are in loci order (and which loci are needed)
+    ordered = True
+    wanted = set()
+    last = -1
+    with open(featurefilename) as f:
+        for offset, _, line in _featureRows(f, offsets):
+            if offset < last:
+                ordered = False
+            last = max(last, offset)
+            if offset >= 0:
+                wanted.add(line.split("\t", 1)[0])
     
+    with open(featurefilename) as f:
+        if statsfile is not None:
+            # statistics are wanted for every locus, not just those with features
+            records = writeStats(consensusRecords(locifilename, jobs, chunksize, None, cache, True), statsfile)
+        else:
+            records = consensusRecords(locifilename, jobs, chunksize, wanted, cache)
+        if ordered:
+            for _, text in _joinFeatures(records, _featureRows(f, offsets)):
+                yield text
+        else:
+            tmpdir = tempfile.mkdtemp(prefix="pyrad-feature-summary.")
+            try:
+                rows = _externalSort(_featureRows(f, offsets), tmpdir)
+                for _, text in _externalSort(_joinFeatures(records, rows), tmpdir):
+                    yield text
+            finally:
+                shutil.rmtree(tmpdir)
+        
+        if statsfile is not None:
+            # finish the loci after the last feature
+            for _ in records:
+                pass
+
+
+def _featureRows(f, offsets):
+    '''Yields (locus offset, line number, line) for each header/feature line in f'''
+    for lineno, line in enumerate(f):
+        if not line.startswith("##"):
+            offset = -1
+            if not line.startswith("#"):
+                fields = line.split("\t", 8)[:8]
+                if len(fields) <= 3:
+                    continue
+                offset = offsets[fields[0]][0]
+            yield (offset, lineno, line)
+
+
+def _joinFeatures(records, rows):
+    '''
+    Merge-joins feature rows (in loci order) with consensus records (see consensusRecords)
+    
+    @return: generator, (line number, output line) for each row
+    '''
+    contigid = None
+    current = None
+    for _, lineno, line in rows:
+        fields = line.split("\t", 8)[:8]
+        if line.startswith("#"):
+            yield (lineno, _formatHeader(fields))
+            continue
+        if fields[0] != contigid:
+            for record in records:
+                if record[0] == fields[0]:
+                    break
+            else:
+                raise KeyError(fields[0])
+            contigid = record[0]
+            current = (record[1], record[2])
+        yield (lineno, _formatFeature(fields, current[0], current[1]))
+
+
+def _externalSort(records, tmpdir, runsize=SORT_RUN_SIZE):
+    '''
+    Sorts tuples using sorted runs saved in tmpdir, holding at most runsize in memory
+    
+    @return: generator, the records in sorted order
+    '''
+    runs = []
+    run = []
+    for record in records:
+        run.append(record)
+        if len(run) >= runsize:
+            runs.append(_writeRun(run, tmpdir))
+            run = []
+    if len(runs) == 0:
+        run.sort()
+        for record in run:
+            yield record
+        return
+    if len(run) > 0:
+        runs.append(_writeRun(run, tmpdir))
+    
+    files = [open(runfilename, 'rb') for runfilename in runs]
+    try:
+        for record in heapq.merge(*[_readRun(runfile) for runfile in files]):
+            yield record
+    finally:
+        for runfile in files:
+            runfile.close()
+
+
+def _writeRun(run, tmpdir):
+    '''Sorts and saves a run of records, returning its filename'''
+    run.sort()
+    fd, runfilename = tempfile.mkstemp(suffix=".run", dir=tmpdir)
+    with os.fdopen(fd, 'wb') as f:
+        for record in run:
+            marshal.dump(record, f)
+    return runfilename
+
+
+def _readRun(f):
+    '''Yields the records saved in a run file'''
+    while True:
+        try:
+            yield marshal.load(f)
+        except EOFError:
+            return
+
+
+class IndexedConsensus(object):
+    '''Computes the consensus of loci on demand using the loci file index'''
+    
+    def __init__(self, locifilename):
+        self.loci = loci.IndexedLoci(locifilename)
+        self._last = (None, None)
+    
+    def __getitem__(self, contigid):
+        # features are grouped by contig so only the last locus is kept
+        if self._last[0] != contigid:
+            _samples, _sequences = self.loci.get(contigid)
+            self._last = (contigid, (makeConsensus(_sequences), _samples))
+        return self._last[1]
+
+
 if __name__ == '__main__':
-    if len(sys.argv) == 1 and sys.stdin.isatty() or '-h' in sys.argv or '--help' in sys.argv:
-        _usage(sys.argv)
-        sys.exit(0)
-    else:
-        sys.exit(_main(sys.argv))
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(_main(sys.argv))
         
 
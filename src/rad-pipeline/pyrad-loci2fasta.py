@@ -36,27 +36,52 @@
 
 # converts the pyRAD loci file into fasta format
 
-import sys
+import os, sys, argparse
 
-if len(sys.argv) != 2:
-	print "Usage: pyrad-loci2fasta LOCIFILE [> OUTPUTFILE]"
-	sys.exit(1)
+import loci
+from consensus import makeConsensus
 
-FILENAME=sys.argv[1]
+# write buffer size for the fasta output
+BUFFER_SIZE = 1024 * 1024
 
-## read in your data file
-infile = open(FILENAME, "r")
 
-## parse the loci in your data file
-data = infile.read()
-locid = data.split("\n//")
-loci = locid[:-1]
+def _main(argv):
+	'''Application main function'''
 
-## write the first read from each locus to the output file in fasta format
-for loc in loci:
-	reads = loc.split("\n",2)
-	name, seq = reads[1].split()
-	print name+"\n"+seq
+	parser = argparse.ArgumentParser(prog="pyrad-loci2fasta", description='Converts the pyRAD loci file into fasta format')
 
-infile.close()
+	parser.add_argument("locifile", help="The pyRAD .loci file to convert (may be gzip/bgzip compressed or a binary loci store, '-' for stdin).")
+	parser.add_argument("-m", "--mode", nargs=1, metavar='mode', default=["first"], choices=['first', 'all', 'consensus'], help="What to write for each locus; 'first' read, 'all' reads (named >SAMPLE|LOCUS) or the 'consensus' sequence (named >locus_LOCUS). [Default: first]")
+	parser.add_argument("-o", "--output", nargs=1, metavar='file', default=["-"], help="The fasta file to write. [Default: - (stdout)]")
 
+	args = parser.parse_args(argv[1:])
+	mode = args.mode[0]
+
+	if args.output[0] == "-":
+		outfile = os.fdopen(os.dup(sys.stdout.fileno()), 'wb', BUFFER_SIZE)
+	else:
+		outfile = open(args.output[0], 'wb', BUFFER_SIZE)
+
+	## write each locus to the output file in fasta format
+	try:
+		for contigid, samples, sequences in loci.iterLoci(args.locifile):
+			if len(sequences) == 0:
+				continue
+			if mode == "first":
+				outfile.write(">%s\n%s\n" % (samples[0], sequences[0]))
+			elif mode == "all":
+				for sample, seq in zip(samples, sequences):
+					outfile.write(">%s|%s\n%s\n" % (sample, contigid, seq))
+			else:
+				outfile.write(">locus_%s\n%s\n" % (contigid, makeConsensus(sequences)))
+	finally:
+		outfile.close()
+
+	return 0
+# end _main()
+
+
+if __name__ == '__main__':
+	if len(sys.argv) == 1:
+		sys.argv.append("-h")
+	sys.exit(_main(sys.argv))
@@ -0,0 +1,78 @@
+#!/bin/env python
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Converts a pyRAD .loci file into a compact binary loci store
+
+The store can be given to pyrad-feature-summary and pyrad-loci2fasta in place
+of the .loci file.
+'''
+
+import sys, argparse
+
+import loci, loci_store
+
+
+def _main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="pyrad-loci2store", description='Converts a pyRAD .loci file into a compact binary loci store')
+    
+    parser.add_argument("locifile", help="The pyRAD .loci file to convert (may be gzip/bgzip compressed, '-' for stdin).")
+    parser.add_argument("storefile", nargs='?', help="The binary loci store to create. [Default: LOCIFILE.lstore]")
+    
+    args = parser.parse_args(argv[1:])
+    
+    storefilename = args.storefile
+    if storefilename is None:
+        if args.locifile == "-":
+            sys.stderr.write("Error: storefile is required when reading from stdin\n")
+            return 1
+        storefilename = "%s.lstore" % args.locifile
+    
+    try:
+        nsamples, nloci = loci_store.writeStore(loci.iterLoci(args.locifile), storefilename)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    
+    sys.stderr.write("Wrote %s loci from %s samples to '%s'\n" % (nloci, nsamples, storefilename))
+    
+    return 0
+# end _main()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(_main(sys.argv))
@@ -39,7 +39,7 @@
 
 import os, sys, time
 
-import common
+import common, resources
 
 state = "Message"
 script = os.getenv('SLURM_JOB_NAME', None)
@@ -48,6 +48,8 @@ if len(sys.argv) >= 2:
 #fi
 if script is None:
 	script = sys.argv[2]
+if os.environ.get('SLURM_ARRAY_TASK_ID') is not None:
+	script = "%s[%s]" % (script, os.environ.get('SLURM_ARRAY_TASK_ID'))
 
 # check if its a slurm or interactive job
 if os.environ.get('SLURM_JOBID') is not None:
@@ -71,3 +73,7 @@ print "[%s] %s at: %s" % (
 	time.strftime("%Y-%m-%d %H:%M:%S"),
 )
 
+# add finished jobs to the job history (used to estimate resources)
+if state == "Finished":
+	resources.recordFinishedJob()
+# fi
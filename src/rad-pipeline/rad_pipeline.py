@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+The rad-pipeline command; runs any of the rad-pipeline tools as a subcommand
+
+  rad-pipeline make_kraken_job -j 8 ../00-raw > run_kraken
+
+is the same as running rad-pipeline_make_kraken_job.  Only the module of the
+subcommand being run is imported so listing the commands and asking for help
+are fast.  --profile-startup reports how long importing (and each module it
+imports) and running the subcommand took.
+'''
+
+import os, sys, time
+
+SRCDIR = os.path.dirname(os.path.realpath(__file__))
+BINDIR = os.path.realpath(os.path.join(SRCDIR, "..", "..", "bin"))
+
+# name => (python source or None for bin scripts, entry function or None to run as a script, description)
+COMMANDS = {
+    "make_rad_experiment":       (None, None, "Creates the directories (and log) for a new experiment"),
+    "make_pyrad_opt_experiment": (None, None, "Sets up a pyRAD optimisation experiment"),
+    "make_batch_jobs":           ("make_batch_jobs.py", "main", "Generates the job scripts listed in a manifest"),
+    "workflow":                  ("workflow.py", "main", "Generates and submits the pipeline stages with job dependencies"),
+    "make_fastqc_job":           ("make_fastqc_job.py", "main", "Generates a fastqc job script"),
+    "make_kraken_job":           ("make_kraken_job.py", "main", "Generates a kraken job script"),
+    "make_seq-sets_job":         ("make_seq-sets_job.py", "main", "Generates a seq-sets (contaminant removal) job script"),
+    "make_pear_job":             ("make_pear_job.py", "main", "Generates a pear (merge pairs) job script"),
+    "make_demux_job":            ("make_demux_job.py", "main", "Generates a process_radtags (demultiplex) job script"),
+    "make_denovo_opt1_job":      ("make_denovo_opt1_job.py", "main", "Generates a denovo_map.pl optimisation (phase 1) job script"),
+    "make_denovo_opt2_job":      ("make_denovo_opt2_job.py", "main", "Generates a denovo_map.pl optimisation (phase 2) job script"),
+    "make_denovo_search_job":    ("make_denovo_search_job.py", "main", "Generates a denovo_map.pl parameter search job script"),
+    "denovo_search":             ("denovo_search.py", "main", "Searches for good denovo_map.pl parameters a few trials at a time"),
+    "trials":                    ("trial_store.py", "main", "Looks up or stores the results of denovo_map.pl optimisation trials"),
+    "schedule_trials":           ("trial_scheduler.py", "main", "Runs a grid of denovo_map.pl trials across the nodes of a job"),
+    "run_local":                 ("run_local.py", "main", "Runs job scripts on this machine instead of with sbatch"),
+    "collate_array":             ("collate_array.py", "main", "Collates the logs and MD5 hashes of a job array"),
+    "collect_denovo_map_stats":  ("denovo_stats.py", "main", "Collects (and combines) the stats of denovo_map.pl runs"),
+    "count_files":               (None, None, "Counts the files matching its arguments"),
+    "resources":                 ("resources.py", "main", "Estimates the cores, memory and time of a job from its input"),
+    "hash":                      ("stream_hash.py", "main", "Hashes files (and counts reads) as they are written"),
+    "manifest":                  ("stage_manifest.py", "main", "Checks or records the files a stage has processed"),
+    "module_version":            ("modules.py", "main", "Prints the version of environment modules"),
+    "log":                       ("rad_job_log.py", None, "Logs a job state to process.log"),
+    "pyrad-feature-summary":     ("pyrad-feature-summary.py", "_main", "Summarises features with their locus consensus"),
+    "pyrad-loci2fasta":          ("pyrad-loci2fasta.py", "_main", "Converts a .loci file to fasta"),
+    "pyrad-loci2store":          ("pyrad-loci2store.py", "_main", "Converts a .loci file to a binary loci store"),
+}
+
+
+def usage(out=sys.stdout):
+    '''Prints the banner and list of subcommands'''
+    out.write("[RADSeq pipeline]\n\n")
+    out.write("usage: rad-pipeline [--profile-startup] <command> [args...]\n\n")
+    out.write("commands:\n")
+    for name in sorted(COMMANDS):
+        out.write("  %-27s %s\n" % (name, COMMANDS[name][2]))
+    out.write("\nRun 'rad-pipeline <command> -h' for the options of each command.\n")
+    out.write("See https://github.com/molecularbiodiversity/rad-pipeline for details\n")
+
+
+class ImportProfiler(object):
+    '''Records the time taken by each (top-level) import while active'''
+    
+    def __init__(self):
+        self.times = []
+        self._depth = 0
+        self._import = None
+    
+    def __enter__(self):
+        import __builtin__
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timedImport
+        return self
+    
+    def __exit__(self, *exc):
+        import __builtin__
+        __builtin__.__import__ = self._import
+        return False
+    
+    def _timedImport(self, name, *args, **kwargs):
+        if self._depth > 0 or name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        self._depth += 1
+        start = time.time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            self.times.append((name, time.time() - start))
+
+
+def run(name, args, profile=False):
+    '''
+    Runs a subcommand
+    
+    @param name: string, the subcommand
+    @param args: list, its arguments
+    @param profile: bool, report import and run times to stderr
+    @return: int, the exit code
+    '''
+    source, entry, _ = COMMANDS[name]
+    progname = "rad-pipeline_%s" % name
+    
+    if source is None:
+        # shell scripts
+        sys.stdout.flush()
+        os.execv(os.path.join(BINDIR, progname), [progname] + args)
+    
+    import imp
+    filename = os.path.join(SRCDIR, source)
+    sys.argv = [progname] + args
+    if SRCDIR not in sys.path:
+        sys.path.insert(0, SRCDIR)
+    
+    profiler = ImportProfiler()
+    start = time.time()
+    status = 0
+    imported = start
+    try:
+        if entry is None:
+            # top-level scripts run when imported
+            with profiler:
+                imp.load_source("__rad_pipeline_%s" % name.replace("-", "_"), filename)
+            imported = time.time()
+        else:
+            with profiler:
+                module = imp.load_source(os.path.splitext(source)[0].replace("-", "_"), filename)
+            imported = time.time()
+            if len(args) == 0 and getattr(module, "HELP_WITHOUT_ARGS", True):
+                # as the module's own __main__ does
+                sys.argv.append("-h")
+            status = getattr(module, entry)(sys.argv)
+    except SystemExit as e:
+        status = e.code
+    finally:
+        if profile:
+            _report(name, profiler, imported - start, time.time() - imported)
+    return status
+
+
+def _report(name, profiler, importtime, runtime):
+    sys.stderr.write("Startup profile: %s\n" % name)
+    sys.stderr.write("  %-30s %8.3fs\n" % ("import", importtime))
+    for module, seconds in profiler.times:
+        sys.stderr.write("    %-28s %8.3fs\n" % (module, seconds))
+    sys.stderr.write("  %-30s %8.3fs\n" % ("run", runtime))
+
+
+def main(argv):
+    '''Application main function'''
+    
+    args = argv[1:]
+    profile = False
+    if len(args) > 0 and args[0] == "--profile-startup":
+        profile = True
+        args = args[1:]
+    
+    if len(args) == 0 or args[0] in ("-h", "--help"):
+        if profile:
+            # profile the help of every python subcommand, each in a fresh interpreter
+            import subprocess
+            with open(os.devnull, 'w') as devnull:
+                for name in sorted(COMMANDS):
+                    if COMMANDS[name][0] is not None and COMMANDS[name][1] is not None:
+                        subprocess.call([sys.executable, os.path.realpath(__file__), "--profile-startup", name, "-h"], stdout=devnull)
+            return 0
+        usage()
+        return 0
+    
+    name = args[0]
+    if name.startswith("rad-pipeline_"):
+        name = name[len("rad-pipeline_"):]
+    if name not in COMMANDS:
+        sys.stderr.write("Error: unknown command '%s'\n\n" % args[0])
+        usage(sys.stderr)
+        return 1
+    
+    return run(name, args[1:], profile)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Estimates the cores, memory and time a job needs from the size of its input
+
+Each stage has a simple model: memory is a fixed amount plus an amount per GB
+of the largest input file (files are processed one at a time) and time is a
+fixed amount per file plus an amount of core-seconds per GB of input.  Once
+the stage has been run a few times, the time per GB measured by earlier runs
+(the job history) is used instead of the model's.  Estimates get a safety
+margin and are rounded up.
+
+Job scripts record their stage and input size (see common.makeHeader) and
+rad-pipeline_log adds a line to the job history when they finish; the file
+$RAD_PIPELINE_JOB_HISTORY or ~/.cache/rad-pipeline/job-history.  Stages that
+skip files already processed list the files they did process in
+$RAD_PIPELINE_JOB_PROCESSED and only those are counted.  Only slurm jobs are
+recorded (not those run by rad-pipeline_run_local).  Each line is tab
+separated:
+
+  date  stage  files  input MB  cores  seconds  max RSS MB (or -)
+'''
+
+import os, sys, argparse, subprocess, time
+
+# margins added to estimates
+MEMORY_MARGIN = 1.25
+TIME_MARGIN = 1.5
+
+# estimates are rounded up to these (MB and seconds)
+MEMORY_STEP = 256
+TIME_STEP = 15 * 60
+
+# the number of recent runs used and needed from the history
+HISTORY_RUNS = 20
+HISTORY_MIN_RUNS = 3
+
+# partition time limits (seconds)
+PARTITION_LIMITS = {"8hour": 8 * 60 * 60}
+
+
+class Model(object):
+    '''The resource model of a stage'''
+    
+    def __init__(self, memory, memoryPerGB, seconds, secondsPerGB, cores):
+        '''
+        @param memory: int, fixed memory (MB)
+        @param memoryPerGB: int, memory per GB of the largest input file (MB)
+        @param seconds: int, fixed time per input file (seconds)
+        @param secondsPerGB: int, core-seconds per GB of input
+        @param cores: int, the cores to use when not given
+        '''
+        self.memory = memory
+        self.memoryPerGB = memoryPerGB
+        self.seconds = seconds
+        self.secondsPerGB = secondsPerGB
+        self.cores = cores
+
+
+# kraken loads its whole database into memory (--preload) for every file; the standard
+# database needs up to ~180GB, so it is sized to fit (with the margin) within the 250GB
+# that kraken jobs have always asked for
+MODELS = {
+    "kraken":   Model(memory=190000, memoryPerGB=0,    seconds=300, secondsPerGB=3600, cores=8),
+    "seq-sets": Model(memory=1024,   memoryPerGB=2048, seconds=30,  secondsPerGB=600,  cores=1),
+    "pear":     Model(memory=1024,   memoryPerGB=512,  seconds=30,  secondsPerGB=2400, cores=8),
+    "fastqc":   Model(memory=512,    memoryPerGB=0,    seconds=30,  secondsPerGB=300,  cores=1),
+    "demux":    Model(memory=1024,   memoryPerGB=0,    seconds=30,  secondsPerGB=900,  cores=1),
+}
+
+
+def defaultHistoryFile():
+    '''The job history file; $RAD_PIPELINE_JOB_HISTORY or ~/.cache/rad-pipeline/job-history'''
+    historyfile = os.environ.get('RAD_PIPELINE_JOB_HISTORY')
+    if historyfile:
+        return historyfile
+    return os.path.join(os.path.expanduser("~"), ".cache", "rad-pipeline", "job-history")
+
+
+class Run(object):
+    '''A finished job from the job history'''
+    
+    def __init__(self, stage, files, inputmb, cores, seconds, maxrss=None):
+        self.stage = stage
+        self.files = files
+        self.inputmb = inputmb
+        self.cores = cores
+        self.seconds = seconds
+        self.maxrss = maxrss
+
+
+def readHistory(stage, historyfilename=None):
+    '''
+    Reads the recent runs of a stage from the job history
+    
+    @return: list, the Runs (oldest first, at most HISTORY_RUNS)
+    '''
+    historyfilename = historyfilename or defaultHistoryFile()
+    runs = []
+    try:
+        with open(historyfilename) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 7 or fields[1] != stage:
+                    continue
+                try:
+                    maxrss = None if fields[6] == "-" else float(fields[6])
+                    runs.append(Run(stage, int(fields[2]), float(fields[3]), int(fields[4]), float(fields[5]), maxrss))
+                except ValueError:
+                    continue
+    except IOError:
+        return []
+    return runs[-HISTORY_RUNS:]
+
+
+def recordRun(run, historyfilename=None):
+    '''Adds a finished job to the job history'''
+    historyfilename = historyfilename or defaultHistoryFile()
+    line = "%s\t%s\t%s\t%.1f\t%s\t%.0f\t%s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), run.stage, run.files,
+        run.inputmb, run.cores, run.seconds, "-" if run.maxrss is None else "%.0f" % run.maxrss)
+    try:
+        directory = os.path.dirname(historyfilename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # a single append so concurrent jobs don't mix lines
+        with open(historyfilename, 'a') as f:
+            f.write(line)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Warning: unable to record job history '%s': %s\n" % (historyfilename, e))
+
+
+def recordFinishedJob(environ=os.environ):
+    '''
+    Adds the job running in environ to the history (see common.makeHeader)
+    
+    @return: Run, the run recorded (or None when the job has no stage, processed
+             no files or didn't run under slurm)
+    '''
+    stage = environ.get('RAD_PIPELINE_JOB_STAGE')
+    if not stage:
+        return None
+    # local runs (rad-pipeline_run_local sets partition 'local') don't time the cluster
+    if not environ.get('SLURM_JOBID') or environ.get('SLURM_JOB_PARTITION') == "local":
+        return None
+    try:
+        seconds = time.time() - float(environ['RAD_PIPELINE_JOB_START'])
+        files = int(environ['RAD_PIPELINE_JOB_FILES'])
+        inputmb = float(environ['RAD_PIPELINE_JOB_INPUT_MB'])
+        processed = environ.get('RAD_PIPELINE_JOB_PROCESSED')
+        if processed is not None:
+            # only the files not skipped as already processed
+            processed = processed.split()
+            if len(processed) == 0:
+                return None
+            files = len(processed)
+            inputmb = sum(s for s in fileSizes(processed) if s is not None)
+        run = Run(stage, files, inputmb, int(environ.get('SLURM_NTASKS') or environ.get('SLURM_CPUS_ON_NODE') or 1),
+            seconds, _maxRSS(environ))
+    except (KeyError, ValueError):
+        return None
+    recordRun(run)
+    return run
+
+
+def _maxRSS(environ):
+    '''The peak memory (MB) of the running slurm batch step, if sstat can tell'''
+    jobid = environ.get('SLURM_JOBID')
+    if not jobid:
+        return None
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(["sstat", "-n", "-P", "-j", "%s.batch" % jobid, "--format=MaxRSS"], stderr=devnull)
+        return parseSize(output.strip().split("\n")[0])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+        return None
+
+
+def parseSize(value):
+    '''Converts a slurm size (e.g. 1200K, 3.5G; default unit MB) to MB'''
+    units = {"K": 1.0 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+    value = value.strip().upper()
+    if len(value) > 0 and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def formatTime(seconds):
+    '''Formats seconds as a slurm time (H:MM:SS)'''
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _roundUp(value, step):
+    return int(-(-value // step) * step)
+
+
+def fileSizes(files):
+    '''
+    The sizes of files (MB)
+    
+    @return: list, the size of each file or None for deferred patterns and missing files
+    '''
+    sizes = []
+    for fn in files:
+        try:
+            sizes.append(os.path.getsize(fn) / (1024.0 * 1024.0))
+        except OSError:
+            sizes.append(None)
+    return sizes
+
+
+class Estimate(object):
+    '''The resources estimated for a job'''
+    
+    def __init__(self, stage, files, inputmb, ntasks, memory, seconds, notes):
+        self.stage = stage
+        self.files = files
+        self.inputmb = inputmb
+        self.ntasks = ntasks
+        self.memory = memory
+        self.seconds = seconds
+        self.notes = notes
+    
+    def time(self):
+        return formatTime(self.seconds)
+    
+    def memoryPerCpu(self):
+        return _roundUp(self.memory, self.ntasks) // self.ntasks
+    
+    def header(self):
+        '''The makeHeader arguments for the estimate'''
+        return {"ntasks": str(self.ntasks), "mem": str(self.memoryPerCpu()), "time": self.time()}
+    
+    def explain(self, out=sys.stderr):
+        '''Writes how the estimate was made'''
+        out.write("Resources for %s (%s file(s), %.0f MB):\n" % (self.stage, self.files, self.inputmb))
+        for note in self.notes:
+            out.write("  %s\n" % note)
+        out.write("  => --ntasks=%s --mem-per-cpu=%s --time=%s\n" % (self.ntasks, self.memoryPerCpu(), self.time()))
+
+
+def jobInfo(stage, files, array=False):
+    '''
+    The stage and input size recorded in job scripts for the job history
+    
+    @return: dict, the makeHeader arguments (per task for array jobs)
+    '''
+    sizes = [s for s in fileSizes(files) if s is not None]
+    if len(sizes) < len(files):
+        # deferred input; the size isn't known
+        return {}
+    if array:
+        return {"stage": stage, "files": 1, "inputmb": "%.1f" % (max(sizes) if sizes else 0)}
+    return {"stage": stage, "files": len(files), "inputmb": "%.1f" % sum(sizes)}
+
+
+def estimate(stage, files, cores=0, array=False, partition=None, historyfilename=None):
+    '''
+    Estimates the resources of a job
+    
+    @param stage: string, the stage (see MODELS)
+    @param files: list, the input files (deferred patterns are sized from the history)
+    @param cores: int, the cores asked for (0 = the model's)
+    @param array: bool, estimate a single array task (one file)
+    @param partition: string, the partition (its time limit is applied)
+    @return: Estimate
+    '''
+    model = MODELS[stage]
+    runs = readHistory(stage, historyfilename)
+    notes = []
+    
+    ntasks = cores
+    if ntasks <= 0:
+        ntasks = model.cores
+        notes.append("cores: %s (the %s default)" % (ntasks, stage))
+    else:
+        notes.append("cores: %s (as given)" % ntasks)
+    
+    # input size
+    sizes = fileSizes(files)
+    known = [s for s in sizes if s is not None]
+    nfiles = len(files)
+    if len(known) == len(sizes):
+        largest = max(known) if known else 0.0
+        notes.append("input: %s file(s), %.0f MB, largest %.0f MB" % (nfiles, sum(known), largest))
+    else:
+        # each pattern is taken to match as many files as the largest earlier run
+        sized = [run for run in runs if run.files > 0]
+        if sized:
+            perfile = max(run.inputmb / run.files for run in sized)
+            perpattern = max(run.files for run in sized)
+        else:
+            perfile = 1024.0
+            perpattern = 1
+        nfiles = len(known) + (len(sizes) - len(known)) * perpattern
+        largest = max(known + [perfile])
+        notes.append("input: not written yet; assuming %s file(s) of up to %.0f MB (%s)" % (nfiles, largest,
+            "the largest seen in %s earlier run(s)" % len(sized) if sized else "no history"))
+        known = known + [perfile] * (nfiles - len(known))
+    if array:
+        nfiles = 1
+        inputmb = largest
+        notes.append("array: sized for one task (the largest file)")
+    else:
+        inputmb = sum(known)
+    
+    # memory
+    memory = model.memory + model.memoryPerGB * largest / 1024.0
+    notes.append("memory: %s MB + %s MB/GB x %.2f GB = %.0f MB" % (model.memory, model.memoryPerGB, largest / 1024.0, memory))
+    measured = [run.maxrss for run in runs if run.maxrss is not None]
+    if measured and max(measured) > memory:
+        memory = max(measured)
+        notes.append("memory: %.0f MB measured in %s earlier run(s)" % (memory, len(measured)))
+    memory = max(MEMORY_STEP, _roundUp(memory * MEMORY_MARGIN, MEMORY_STEP))
+    notes.append("memory: x%s margin, rounded => %s MB" % (MEMORY_MARGIN, memory))
+    
+    # time
+    timed = [run for run in runs if run.inputmb > 0]
+    if len(timed) >= HISTORY_MIN_RUNS:
+        # measured rates include the time per file
+        rates = sorted(run.seconds * run.cores / (run.inputmb / 1024.0) for run in timed)
+        rate = rates[-(-9 * len(rates) // 10) - 1]
+        seconds = rate * inputmb / 1024.0 / ntasks
+        notes.append("time: %.0f core-s/GB (90th percentile of %s earlier run(s))" % (rate, len(timed)))
+        notes.append("time: %.0f core-s/GB x %.2f GB / %s core(s) = %.0fs" % (rate, inputmb / 1024.0, ntasks, seconds))
+    else:
+        rate = model.secondsPerGB
+        seconds = nfiles * model.seconds + rate * inputmb / 1024.0 / ntasks
+        notes.append("time: %.0f core-s/GB (model; %s of %s earlier run(s) needed)" % (rate, len(timed), HISTORY_MIN_RUNS))
+        notes.append("time: %s file(s) x %ss + %.0f core-s/GB x %.2f GB / %s core(s) = %.0fs" % (nfiles, model.seconds, rate, inputmb / 1024.0, ntasks, seconds))
+    seconds = max(TIME_STEP, _roundUp(seconds * TIME_MARGIN, TIME_STEP))
+    notes.append("time: x%s margin, rounded => %s" % (TIME_MARGIN, formatTime(seconds)))
+    limit = PARTITION_LIMITS.get(partition)
+    if limit is not None and seconds > limit:
+        seconds = limit
+        notes.append("time: capped at the %s partition limit (%s); consider another partition" % (partition, formatTime(limit)))
+    
+    return Estimate(stage, nfiles, inputmb, ntasks, memory, seconds, notes)
+
+
+def addResourceArguments(parser):
+    '''Adds the --auto-resources and --explain-resources options to parser'''
+    parser.add_argument("--auto-resources", action='store_true', help="Set the job's cores, memory and time from the size of its input (and earlier runs) rather than the defaults.")
+    parser.add_argument("--explain-resources", action='store_true', help="As --auto-resources and print how each value was worked out (to stderr).")
+
+
+def autoResources(args, stage, files, cores=0, array=False):
+    '''
+    Estimates the resources of a job when asked to by --auto-resources or --explain-resources
+    
+    @return: Estimate or None if not asked for
+    '''
+    if not (args.auto_resources or args.explain_resources):
+        return None
+    usage = estimate(stage, files, cores, array, args.partition[0])
+    if args.explain_resources:
+        usage.explain()
+    return usage
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_resources", description='Estimates the cores, memory and time a job needs from its input')
+    
+    parser.add_argument("stage", choices=sorted(MODELS.keys()), help="The stage.")
+    parser.add_argument("file", nargs="+", help="The input files.")
+    parser.add_argument("-j", "--cores", nargs=1, metavar='N', type=int, default=[0], help="The number of cores, 0=the stage default. [Default: 0]")
+    parser.add_argument("-a", "--array", action='store_true', help="Estimate one array task (the largest file).")
+    parser.add_argument("-p", "--partition", nargs=1, metavar="partition", default=[None], help="The partition (to apply its time limit).")
+    parser.add_argument("--history", nargs=1, metavar='file', default=[None], help="The job history file. [Default: %s]" % defaultHistoryFile())
+    
+    args = parser.parse_args(argv[1:])
+    
+    estimate(args.stage, args.file, args.cores[0], args.array, args.partition[0], args.history[0]).explain(sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
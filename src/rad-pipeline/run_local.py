@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Runs rad-pipeline job scripts on the local machine instead of with sbatch
+
+The #SBATCH directives of each script are read to size the job (--ntasks,
+--cpus-per-task, --mem, --mem-per-cpu or --exclusive for the whole machine)
+and jobs (and the tasks of --array jobs) are run in a pool bounded by the
+cores and memory of the machine (or --cores/--mem).  Each job runs with bash
+from the script's directory with the SLURM_* variables set that a slurm job
+would have (SLURM_JOBID, SLURM_JOB_NAME, SLURM_ARRAY_TASK_ID, ...) and its
+output written to the --output file (default slurm-%j.out).  The 'module'
+command is replaced by one that does nothing, so scripts run on machines
+without environment modules; the tools they load must already be on the
+PATH.  --time is not enforced.
+
+With --sequential each script only starts once the one before it succeeded,
+e.g. to run the stages of an experiment in order.
+'''
+
+import os, sys, argparse, re, shutil, socket, subprocess, tempfile, time
+
+SRCDIR = os.path.dirname(os.path.realpath(__file__))
+
+# stands in for the environment modules 'module' command
+MODULE_STUB = """#!/bin/sh
+# rad-pipeline_run_local: environment modules are not used
+exit 0
+"""
+
+# short #SBATCH options
+_SHORT = {"n": "ntasks", "c": "cpus-per-task", "J": "job-name", "o": "output", "e": "error", "a": "array", "N": "nodes", "t": "time", "p": "partition"}
+
+_SIZE_UNITS = {"K": 1.0 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+
+def parseDirectives(filename):
+    '''
+    Reads the #SBATCH directives of a job script
+    
+    @return: dict, option name (without leading dashes) => value (True for flags)
+    '''
+    directives = {}
+    with open(filename) as f:
+        for line in f:
+            if not line.startswith("#"):
+                # directives end at the first command
+                if len(line.strip()) > 0:
+                    break
+                continue
+            if not line.startswith("#SBATCH"):
+                continue
+            tokens = line[len("#SBATCH"):].split("#")[0].split()
+            while len(tokens) > 0:
+                option = tokens.pop(0)
+                if option.startswith("--"):
+                    name, _, value = option[2:].partition("=")
+                elif option.startswith("-") and len(option) > 1:
+                    name, value = _SHORT.get(option[1], option[1]), option[2:]
+                else:
+                    continue
+                if not value and len(tokens) > 0 and not tokens[0].startswith("-"):
+                    value = tokens.pop(0)
+                directives[name] = value if value else True
+    return directives
+
+
+def parseSize(value):
+    '''Converts a slurm memory size (default unit MB, suffix K, M, G or T) to MB'''
+    value = str(value).strip().upper()
+    unit = 1
+    if len(value) > 0 and value[-1] in _SIZE_UNITS:
+        unit = _SIZE_UNITS[value[-1]]
+        value = value[:-1]
+    return int(float(value) * unit)
+
+
+def parseArray(spec):
+    '''
+    Parses a slurm --array spec, e.g. 1-6%2, 1,3,5-9:2
+    
+    @return: tuple, (the task ids, the maximum number running at once or 0)
+    '''
+    spec, _, limit = spec.partition("%")
+    tasks = []
+    for part in spec.split(","):
+        part, _, step = part.partition(":")
+        first, _, last = part.partition("-")
+        tasks.extend(range(int(first), int(last or first) + 1, int(step or 1)))
+    return (tasks, int(limit or 0))
+
+
+def machineCores():
+    '''The number of cores of this machine'''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def machineMemory():
+    '''The memory of this machine (MB)'''
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+class Job(object):
+    '''A job script and the resources it asks for'''
+    
+    def __init__(self, filename, jobid, cores, memory):
+        '''
+        @param filename: string, the job script
+        @param jobid: int, the (local) job id
+        @param cores: int, the cores of the pool
+        @param memory: int, the memory of the pool (MB)
+        '''
+        self.filename = os.path.abspath(filename)
+        self.directory = os.path.dirname(self.filename)
+        self.jobid = jobid
+        self.directives = parseDirectives(filename)
+        self.name = self.directives.get("job-name", os.path.basename(filename))
+        self.after = None
+        self.failed = False
+        
+        if self.directives.get("exclusive"):
+            self.cores = cores
+            self.memory = memory
+        else:
+            self.cores = int(self.directives.get("ntasks", 1)) * int(self.directives.get("cpus-per-task", 1))
+            if "mem" in self.directives:
+                self.memory = parseSize(self.directives["mem"])
+            else:
+                self.memory = parseSize(self.directives.get("mem-per-cpu", 1024)) * self.cores
+        if self.cores > cores or self.memory > memory:
+            sys.stderr.write("Warning: %s asks for %s cores and %sMB; running it with %s cores and %sMB\n" % (
+                self.name, self.cores, self.memory, min(self.cores, cores), min(self.memory, memory)))
+            self.cores = min(self.cores, cores)
+            self.memory = min(self.memory, memory)
+        
+        self.limit = 0
+        if "array" in self.directives:
+            tasks, self.limit = parseArray(self.directives["array"])
+            self.tasks = [Task(self, task) for task in tasks]
+        else:
+            self.tasks = [Task(self, None)]
+    
+    def lastid(self):
+        '''The last job id used by the job (array tasks have ids of their own)'''
+        return self.tasks[-1].jobid()
+    
+    def running(self):
+        return sum(1 for task in self.tasks if task.process is not None and task.status is None)
+    
+    def done(self):
+        return all(task.status is not None for task in self.tasks)
+
+
+class Task(object):
+    '''A single run of a job script (one per array task)'''
+    
+    def __init__(self, job, taskid):
+        self.job = job
+        self.taskid = taskid
+        self.process = None
+        self.status = None
+        self.start = None
+    
+    def label(self):
+        if self.taskid is None:
+            return "%s (job %s)" % (self.job.name, self.job.jobid)
+        return "%s (job %s_%s)" % (self.job.name, self.job.jobid, self.taskid)
+    
+    def outputFilename(self, option="output"):
+        '''The output file with the slurm filename patterns (%j, %A, %a, %x) replaced'''
+        default = "slurm-%j.out" if self.taskid is None else "slurm-%A_%a.out"
+        pattern = self.job.directives.get(option, default)
+        values = {
+            "%": "%", "j": str(self.jobid()), "A": str(self.job.jobid), "x": self.job.name,
+            "a": str(self.taskid) if self.taskid is not None else "4294967294",
+            "u": os.environ.get("USER", ""), "N": socket.gethostname().split(".")[0],
+        }
+        return os.path.join(self.job.directory, re.sub("%(.)", lambda m: values.get(m.group(1), m.group(0)), pattern))
+    
+    def jobid(self):
+        '''slurm gives each array task a job id of its own'''
+        if self.taskid is None:
+            return self.job.jobid
+        return self.job.jobid + self.job.tasks.index(self) + 1
+    
+    def environment(self, base):
+        '''The environment of the task (base plus the SLURM_* variables)'''
+        env = dict(base)
+        job = self.job
+        env.update({
+            "SLURM_JOBID": str(self.jobid()),
+            "SLURM_JOB_ID": str(self.jobid()),
+            "SLURM_JOB_NAME": job.name,
+            "SLURM_JOB_NODELIST": socket.gethostname().split(".")[0],
+            "SLURM_NNODES": "1",
+            "SLURM_NTASKS": str(job.cores),
+            "SLURM_CPUS_ON_NODE": str(job.cores),
+            "SLURM_MEM_PER_NODE": str(job.memory),
+            "SLURM_SUBMIT_DIR": job.directory,
+            "SLURM_JOB_PARTITION": "local",
+        })
+        if self.taskid is not None:
+            env.update({
+                "SLURM_ARRAY_JOB_ID": str(job.jobid),
+                "SLURM_ARRAY_TASK_ID": str(self.taskid),
+                "SLURM_ARRAY_TASK_COUNT": str(len(job.tasks)),
+                "SLURM_ARRAY_TASK_MIN": str(min(task.taskid for task in job.tasks)),
+                "SLURM_ARRAY_TASK_MAX": str(max(task.taskid for task in job.tasks)),
+            })
+        return env
+
+
+def baseEnvironment(stubdir, realmodules=False):
+    '''
+    The environment jobs run with
+    
+    @param stubdir: string, a directory to put the module stub in
+    @param realmodules: bool, keep the real module command
+    '''
+    env = dict(os.environ)
+    path = [env.get("PATH", "")]
+    bindir = os.path.normpath(os.path.join(SRCDIR, "..", "..", "bin"))
+    if os.path.isdir(bindir):
+        path.insert(0, bindir)
+    if not realmodules:
+        with open(os.path.join(stubdir, "module"), 'w') as f:
+            f.write(MODULE_STUB)
+        os.chmod(os.path.join(stubdir, "module"), 0755)
+        path.insert(0, stubdir)
+        # an exported bash function would hide the stub
+        for name in env.keys():
+            if name.startswith("BASH_FUNC_module"):
+                del env[name]
+    env["PATH"] = os.pathsep.join(path)
+    return env
+
+
+class Pool(object):
+    '''Runs the tasks of jobs within a limited number of cores and memory'''
+    
+    def __init__(self, cores, memory, env, poll=0.2):
+        self.cores = cores
+        self.memory = memory
+        self.env = env
+        self.poll = poll
+        self.running = []
+    
+    def fits(self, task):
+        job = task.job
+        if job.after is not None and not job.after.done():
+            return False
+        if job.limit > 0 and job.running() >= job.limit:
+            return False
+        return job.cores <= self.cores and job.memory <= self.memory
+    
+    def startTask(self, task):
+        output = task.outputFilename()
+        error = task.outputFilename("error") if "error" in task.job.directives else None
+        with open(output, 'w') as out:
+            if error is not None:
+                err = open(error, 'w')
+            else:
+                err = subprocess.STDOUT
+            try:
+                task.process = subprocess.Popen(["bash", task.job.filename], cwd=task.job.directory,
+                    env=task.environment(self.env), stdin=open(os.devnull), stdout=out, stderr=err)
+            finally:
+                if error is not None:
+                    err.close()
+        task.start = time.time()
+        self.cores -= task.job.cores
+        self.memory -= task.job.memory
+        self.running.append(task)
+        sys.stderr.write("Started %s: %s cores, %sMB, output %s\n" % (task.label(), task.job.cores, task.job.memory, os.path.relpath(output)))
+    
+    def finishTask(self, task):
+        self.cores += task.job.cores
+        self.memory += task.job.memory
+        self.running.remove(task)
+        if task.status != 0:
+            task.job.failed = True
+        sys.stderr.write("Finished %s: exit %s after %.1fs\n" % (task.label(), task.status, time.time() - task.start))
+    
+    def run(self, jobs):
+        '''
+        Runs every task of jobs
+        
+        Tasks start in order as soon as they fit; a job with an 'after' job
+        only starts when it has finished successfully (otherwise it is
+        skipped and counts as failed).
+        
+        @return: int, the number of failed jobs
+        '''
+        pending = [task for job in jobs for task in job.tasks]
+        while len(pending) > 0 or len(self.running) > 0:
+            for task in list(pending):
+                after = task.job.after
+                if after is not None and after.done() and after.failed:
+                    sys.stderr.write("Skipped %s: %s failed\n" % (task.label(), after.name))
+                    task.status = -1
+                    task.job.failed = True
+                    pending.remove(task)
+                elif self.fits(task):
+                    self.startTask(task)
+                    pending.remove(task)
+            time.sleep(self.poll)
+            for task in list(self.running):
+                task.status = task.process.poll()
+                if task.status is not None:
+                    self.finishTask(task)
+        return sum(1 for job in jobs if job.failed)
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_run_local", description='Runs rad-pipeline job scripts on this machine within its cores and memory instead of submitting them with sbatch')
+    
+    parser.add_argument("script", nargs="+", help="The job scripts to run.")
+    parser.add_argument("-c", "--cores", nargs=1, metavar='N', type=int, default=[machineCores()], help="The number of cores jobs may use. [Default: %s (all)]" % machineCores())
+    parser.add_argument("-m", "--mem", nargs=1, metavar='MB', default=[str(machineMemory())], help="The memory jobs may use, e.g. 8000 or 8G. [Default: %s (all)]" % machineMemory())
+    parser.add_argument("-s", "--sequential", action='store_true', help="Start each script only after the one before it succeeded.")
+    parser.add_argument("--modules", action='store_true', help="Use the real module command rather than ignoring module loads.")
+    
+    args = parser.parse_args(argv[1:])
+    
+    cores = args.cores[0]
+    memory = parseSize(args.mem[0])
+    firstid = os.getpid() * 1000
+    jobs = []
+    for filename in args.script:
+        if not os.path.isfile(filename):
+            sys.stderr.write("Error: job script '%s' not found\n" % filename)
+            return 1
+        jobid = firstid if len(jobs) == 0 else jobs[-1].lastid() + 1
+        try:
+            job = Job(filename, jobid, cores, memory)
+        except ValueError as e:
+            sys.stderr.write("Error: %s: bad #SBATCH directive: %s\n" % (filename, e))
+            return 1
+        if args.sequential and len(jobs) > 0:
+            job.after = jobs[-1]
+        jobs.append(job)
+    
+    stubdir = tempfile.mkdtemp(prefix="rad-pipeline-local.")
+    start = time.time()
+    try:
+        failed = Pool(cores, memory, baseEnvironment(stubdir, args.modules)).run(jobs)
+    finally:
+        shutil.rmtree(stubdir)
+    
+    sys.stderr.write("%s of %s job(s) succeeded in %.1fs\n" % (len(jobs) - failed, len(jobs), time.time() - start))
+    if failed > 0:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Records what each stage produced so reruns can skip work that is still valid
+
+A stage manifest (e.g. kraken.manifest in the stage directory) has one JSON
+line per processed unit of work (usually an input file), identified by a
+key.  Each line lists the inputs, parameters and tool version used and the
+outputs made, with the size, mtime and MD5 hash of each file.  Inputs are
+not read to record them, their MD5 hash is only kept when it is already
+known (from another line or --provenance) and otherwise their size and mtime
+must match.  The last line for a key is the current one.
+
+'check' succeeds (exit 0) when the unit was recorded with the same inputs,
+parameters and version and its outputs are still intact; the outputs' MD5
+hashes are then printed like md5sum prints them.  Files whose size and mtime
+are unchanged are trusted without being read again (unless --verify);
+otherwise they are hashed, so files that were only touched or copied still
+match.  'record' hashes the outputs (several at once, and not at all when
+--provenance gives their hashes; see rad-pipeline_hash), adds the line and
+prints the outputs' hashes.
+
+  rad-pipeline_manifest check kraken.manifest KEY -i INPUT... -p PARAMS -v VERSION
+  rad-pipeline_manifest record kraken.manifest KEY -i INPUT... -p PARAMS -v VERSION -o OUTPUT...
+'''
+
+import os, sys, argparse, json, time
+
+import stream_hash
+
+MANIFEST_VERSION = 1
+
+
+def md5File(filename):
+    '''The MD5 hash (hex) of a file'''
+    return stream_hash.hashFile(filename).md5.hexdigest()
+
+
+def describeFiles(filenames, known={}, hashing=True):
+    '''
+    Describes files for the manifest, hashing those not already known in parallel
+    
+    @param known: dict, filename => an earlier description; its hash is reused if the size and mtime match
+    @param hashing: bool, hash files whose hash isn't known (otherwise their md5 is None)
+    @return: list, [filename, size, mtime, md5] for each file
+    '''
+    descriptions = []
+    unknown = []
+    for filename in filenames:
+        st = os.stat(filename)
+        description = [filename, st.st_size, st.st_mtime, None]
+        earlier = known.get(filename)
+        if earlier is not None and earlier[1] == st.st_size and earlier[2] == st.st_mtime:
+            description[3] = earlier[3]
+        if description[3] is None and hashing:
+            unknown.append(description)
+        descriptions.append(description)
+    for description, digest in zip(unknown, stream_hash.hashFiles([d[0] for d in unknown])):
+        description[3] = digest.md5.hexdigest()
+    return descriptions
+
+
+def fileMatches(known, verify=False):
+    '''
+    Checks a file is unchanged since it was described
+    
+    @param known: list, the description (see describeFiles)
+    @param verify: bool, always compare the hash (when it is known)
+    @return: bool
+    '''
+    filename, size, mtime, md5 = known
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    if st.st_size != size:
+        return False
+    if md5 is None:
+        return st.st_mtime == mtime
+    if st.st_mtime == mtime and not verify:
+        return True
+    return md5File(filename) == md5
+
+
+def readManifest(filename):
+    '''
+    Reads a stage manifest
+    
+    @return: dict, key => the current entry
+    '''
+    entries = {}
+    try:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # e.g. a line cut short when a job was killed
+                    continue
+                if entry.get("manifest") == MANIFEST_VERSION:
+                    entries[entry["key"]] = entry
+    except IOError:
+        pass
+    return entries
+
+
+def appendEntry(filename, entry):
+    '''Adds an entry to a manifest (locked, so array tasks can share one)'''
+    stream_hash.appendJSON(filename, [entry])
+
+
+def check(filename, key, inputs, params, version, verify=False):
+    '''
+    Checks if a unit of work is already done
+    
+    @return: tuple, (the recorded entry or None, the reason it must be redone)
+    '''
+    entry = readManifest(filename).get(key)
+    if entry is None:
+        return (None, "not processed before")
+    if entry["params"] != params:
+        return (None, "parameters changed")
+    if entry["version"] != version:
+        return (None, "version changed (%s => %s)" % (entry["version"], version))
+    if sorted(known[0] for known in entry["inputs"]) != sorted(os.path.abspath(fn) for fn in inputs):
+        return (None, "inputs changed")
+    for known in entry["inputs"]:
+        if not fileMatches(known, verify):
+            return (None, "input changed: %s" % known[0])
+    for known in entry["outputs"]:
+        if not fileMatches(known, verify):
+            return (None, "output missing or changed: %s" % known[0])
+    return (entry, None)
+
+
+def record(filename, key, inputs, params, version, outputs, provenance=None):
+    '''
+    Records a unit of work as done
+    
+    @param provenance: string, a provenance file (see stream_hash) with hashes of the files
+    @return: dict, the entry added
+    '''
+    # the hashes of every file in the manifest (e.g. an input recorded as
+    # another key's output) and the provenance file
+    known = {}
+    for entry in readManifest(filename).values():
+        for k in entry["inputs"] + entry["outputs"]:
+            if k[3] is not None:
+                known[k[0]] = k
+    if provenance is not None:
+        for r in stream_hash.readProvenance(provenance).values():
+            known[r["file"]] = [r["file"], r["size"], r["mtime"], r["md5"]]
+    inputs = [os.path.abspath(fn) for fn in inputs]
+    outputs = [os.path.abspath(fn) for fn in outputs]
+    entry = {
+        "manifest": MANIFEST_VERSION,
+        "key": key,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "params": params,
+        "version": version,
+        "inputs": describeFiles(inputs, known, hashing=False),
+        "outputs": describeFiles(outputs, known),
+    }
+    appendEntry(filename, entry)
+    return entry
+
+
+def printHashes(entry, out=sys.stdout):
+    '''Prints the outputs' hashes like md5sum (relative to the current directory)'''
+    for filename, _, _, md5 in entry["outputs"]:
+        out.write("%s  %s\n" % (md5, os.path.relpath(filename)))
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_manifest", description='Checks or records the work done by a stage so reruns can skip it')
+    
+    parser.add_argument("action", choices=["check", "record"], help="check: exit 0 if KEY is done and still valid; record: record KEY as done.")
+    parser.add_argument("manifest", help="The stage manifest file.")
+    parser.add_argument("key", help="The unit of work (e.g. the input filename).")
+    parser.add_argument("-i", "--inputs", nargs="+", metavar='file', default=[], help="The input files.")
+    parser.add_argument("-p", "--params", nargs=1, metavar='string', default=[""], help="The parameters used (e.g. the command line).")
+    parser.add_argument("-v", "--version", nargs=1, metavar='version', default=[""], help="The tool version.")
+    parser.add_argument("-o", "--outputs", nargs="+", metavar='file', default=[], help="The output files (record only).")
+    parser.add_argument("--provenance", nargs=1, metavar='file', default=[None], help="A provenance file with the hashes of files already hashed as they were written (record only).")
+    parser.add_argument("--verify", action='store_true', help="Hash every file with a recorded hash even if its size and mtime are unchanged (check only).")
+    parser.add_argument("-q", "--quiet", action='store_true', help="Don't print the output hashes.")
+    
+    args = parser.parse_args(argv[1:])
+    
+    if args.action == "check":
+        entry, reason = check(args.manifest, args.key, args.inputs, args.params[0], args.version[0], args.verify)
+        if entry is None:
+            sys.stderr.write("%s: %s\n" % (args.key, reason))
+            return 1
+    else:
+        try:
+            entry = record(args.manifest, args.key, args.inputs, args.params[0], args.version[0], args.outputs, args.provenance[0])
+        except (IOError, OSError) as e:
+            sys.stderr.write("Error: unable to record '%s': %s\n" % (args.key, e))
+            return 1
+    if not args.quiet:
+        printHashes(entry)
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
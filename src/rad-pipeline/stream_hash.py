@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Computes MD5 hashes (and read counts) of files as they are written
+
+Rather than writing a file and reading it all again with md5sum, data is
+hashed while it passes through:
+
+  tee   copies stdin to a file, hashing it on the way
+  cat   concatenates files into another (or appends, -a), hashing the
+        inputs and the output in the one pass
+  sum   hashes files that were written by other tools, several at once
+
+The hashes are printed like md5sum prints them.  With -c the reads (FASTQ
+records, 4 lines each) are counted too.  With -p each file's name, size,
+mtime, hash (and reads) are added to a provenance file, one JSON line per
+file, that rad-pipeline_manifest record reuses instead of reading the files
+again.
+
+  some-tool ... | rad-pipeline_hash tee -p stage.provenance out.fastq
+  rad-pipeline_hash cat -p pear.provenance -o merged.fastq assembled.fastq forward.fastq
+  rad-pipeline_hash sum -p pear.provenance discarded.fastq reverse.fastq
+'''
+
+import os, sys, argparse, fcntl, hashlib, json, time
+from multiprocessing.pool import ThreadPool
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class Digest(object):
+    '''The MD5 hash, size and read count of a stream'''
+    
+    def __init__(self, filename, reads=False):
+        self.filename = filename
+        self.md5 = hashlib.md5()
+        self.size = 0
+        self.lines = 0 if reads else None
+    
+    def update(self, block):
+        self.md5.update(block)
+        self.size += len(block)
+        if self.lines is not None:
+            self.lines += block.count("\n")
+    
+    def reads(self):
+        if self.lines is None:
+            return None
+        return self.lines // 4
+    
+    def record(self):
+        '''The provenance record of the (now complete) file'''
+        st = os.stat(self.filename)
+        record = {"file": os.path.abspath(self.filename), "size": st.st_size, "mtime": st.st_mtime,
+                  "md5": self.md5.hexdigest(), "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+        if self.lines is not None:
+            record["reads"] = self.reads()
+        return record
+
+
+def hashFile(filename, reads=False):
+    '''
+    Hashes a file
+    
+    @return: Digest
+    '''
+    digest = Digest(filename, reads)
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            digest.update(block)
+    return digest
+
+
+def hashFiles(filenames, jobs=0, reads=False):
+    '''
+    Hashes files in parallel (hashlib and file reads release the GIL)
+    
+    @param jobs: int, the number of files hashed at once (0 = one per file, up to the number of cores)
+    @return: list, the Digest of each file
+    '''
+    if jobs <= 0:
+        jobs = min(len(filenames), _cores())
+    if jobs <= 1:
+        return [hashFile(fn, reads) for fn in filenames]
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(lambda fn: hashFile(fn, reads), filenames, chunksize=1)
+    finally:
+        pool.close()
+
+
+def _cores():
+    '''The cores available to the job'''
+    try:
+        return int(os.environ.get("SLURM_CPUS_ON_NODE", ""))
+    except ValueError:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def copyAndHash(sources, outfilename, append=False, reads=False):
+    '''
+    Copies sources into a file hashing the sources and the file as it is written
+    
+    @param sources: list, the files to copy ('-' for stdin)
+    @param append: bool, add to the end of the file (its existing content is hashed first)
+    @return: tuple, (the Digest of each source, the Digest of the output)
+    '''
+    if append and os.path.exists(outfilename):
+        output = hashFile(outfilename, reads)
+    else:
+        output = Digest(outfilename, reads)
+    digests = []
+    with open(outfilename, 'ab' if append else 'wb') as out:
+        for source in sources:
+            digest = Digest(source, reads)
+            f = sys.stdin if source == "-" else open(source, 'rb')
+            try:
+                while True:
+                    block = f.read(BLOCK_SIZE)
+                    if len(block) == 0:
+                        break
+                    out.write(block)
+                    digest.update(block)
+                    output.update(block)
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+            digests.append(digest)
+    return (digests, output)
+
+
+def appendJSON(filename, entries):
+    '''Adds JSON lines to a file (locked, so array tasks can share one)'''
+    with open(filename, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            for entry in entries:
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def readProvenance(filename):
+    '''
+    Reads a provenance file
+    
+    @return: dict, absolute filename => the latest record
+    '''
+    records = {}
+    try:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["file"]] = record
+    except IOError:
+        pass
+    return records
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_hash", description='Computes the MD5 hashes (and read counts) of files as they are written')
+    
+    # options shared by the modes, so they may come before or after the files
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("-c", "--count-reads", action='store_true', help="Count the FASTQ reads too.")
+    options.add_argument("-p", "--provenance", nargs=1, metavar='file', help="Add the files' hashes to this provenance file.")
+    options.add_argument("-q", "--quiet", action='store_true', help="Don't print the hashes.")
+    
+    modes = parser.add_subparsers(dest="mode")
+    tee = modes.add_parser("tee", parents=[options], help="Copies stdin to a file.")
+    tee.add_argument("file", nargs=1, help="The output file.")
+    tee.add_argument("-a", "--append", action='store_true', help="Append to the file rather than overwrite it.")
+    cat = modes.add_parser("cat", parents=[options], help="Concatenates files into another.")
+    cat.add_argument("file", nargs="+", help="The input files ('-' for stdin).")
+    cat.add_argument("-o", "--output", nargs=1, metavar='file', required=True, help="The output file.")
+    cat.add_argument("-a", "--append", action='store_true', help="Append to the output file rather than overwrite it.")
+    hashsum = modes.add_parser("sum", parents=[options], help="Hashes files (written by other tools) in parallel.")
+    hashsum.add_argument("file", nargs="+", help="The files to hash.")
+    hashsum.add_argument("-j", "--jobs", nargs=1, metavar='N', type=int, default=[0], help="The number of files hashed at once, 0=all (up to the number of cores). [Default: 0]")
+    
+    args = parser.parse_args(argv[1:])
+    
+    try:
+        if args.mode == "tee":
+            sources, output = copyAndHash(["-"], args.file[0], args.append, args.count_reads)
+            digests = [output]
+        elif args.mode == "cat":
+            sources, output = copyAndHash(args.file, args.output[0], args.append, args.count_reads)
+            digests = [digest for digest in sources if digest.filename != "-"] + [output]
+        else:
+            digests = hashFiles(args.file, args.jobs[0], args.count_reads)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    
+    if args.provenance:
+        appendJSON(args.provenance[0], [digest.record() for digest in digests])
+    if not args.quiet:
+        for digest in digests:
+            sys.stdout.write("%s  %s\n" % (digest.md5.hexdigest(), digest.filename))
+            if digest.lines is not None:
+                sys.stderr.write("%s: %s reads\n" % (digest.filename, digest.reads()))
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Runs a grid of denovo_map.pl optimisation trials across the nodes of a job
+
+Every combination of the -M, -n and -m values is run as 'bash -c COMMAND'
+with {1}, {2} and {3} replaced by the values (as GNU parallel would) and
+TRIAL_M, TRIAL_n, TRIAL_m and TRIAL_ID in its environment.  Up to --jobs
+trials run at once, each started by the launcher:
+
+  local   on this node
+  srun    as a job step of --cores-task cpus on whichever node of the job
+          has them free, so a job of several nodes is kept busy
+
+Trials expected to take longest start first, so the last trials to finish
+are short ones.  A trial's wall time is added to --times when it finishes
+and the expected time of each trial is taken from there (the longest time
+recorded for the same values, otherwise the typical time per unit of work,
+where the work grows with -M and -n and shrinks with -m).  Trials answered
+from the trial store (see rad-pipeline_trials) are recorded as cached and
+don't count.
+
+With --logs, --stats and --prune rules trials that clearly won't beat the
+best finished trial are stopped early and recorded as pruned, see
+trial_supervisor (no rules are given by default):
+
+  depth<0.5   stop once a trial's samples have less than half the mean
+              merged coverage depth of the same samples in the best trial
+
+Rules name a stat (coverage, depth, reads, matched, unmatched, stacks or
+catalog), < or > and a fraction of the best trial's value.
+'''
+
+import os, sys, argparse, itertools, subprocess, time
+
+import trial_supervisor
+
+LAUNCHERS = ("local", "srun")
+
+
+def launchArgs(launcher, command, cores=1):
+    '''
+    The command line that starts a trial
+
+    @param launcher: string, local or srun
+    @param command: string, the bash command
+    @param cores: int, the cpus the trial uses
+    @return: list, the command line
+    '''
+    if launcher == "srun":
+        return ["srun", "--nodes=1", "--ntasks=1", "--cpus-per-task=%s" % cores, "--exclusive", "bash", "-c", command]
+    return ["bash", "-c", command]
+
+
+def work(point):
+    '''The relative work of a trial (M, n, m); small -m and large -M and -n take longest'''
+    M, n, m = point
+    return (M + 1.0) * (n + 1.0) / max(m, 1)
+
+
+def readTimes(filename):
+    '''
+    Reads the recorded wall times of trials
+
+    @return: dict, (M, n, m) => the longest time (seconds) recorded
+    '''
+    times = {}
+    try:
+        with open(filename) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 6 or fields[0] == "date":
+                    continue
+                try:
+                    point = (int(fields[1]), int(fields[2]), int(fields[3]))
+                    seconds = float(fields[4])
+                except ValueError:
+                    continue
+                if fields[5] == "0":
+                    times[point] = max(seconds, times.get(point, 0.0))
+    except IOError:
+        pass
+    return times
+
+
+def recordTime(filename, point, seconds, status, launcher):
+    '''Adds the wall time of a finished trial to the times file'''
+    header = not os.path.exists(filename)
+    with open(filename, 'a') as f:
+        if header:
+            f.write("date\tM\tn\tm\tseconds\tstatus\tlauncher\n")
+        f.write("%s\t%s\t%s\t%s\t%.1f\t%s\t%s\n" % ((time.strftime("%Y-%m-%d %H:%M:%S"),) + point + (seconds, status, launcher)))
+
+
+def expectedTimes(points, times):
+    '''
+    The expected wall time of each trial
+
+    @param times: dict, the recorded times (see readTimes)
+    @return: dict, point => seconds (or relative work when nothing is recorded)
+    '''
+    rates = sorted(seconds / work(point) for point, seconds in times.items())
+    rate = rates[len(rates) // 2] if len(rates) > 0 else 1.0
+    return dict((point, times.get(point, work(point) * rate)) for point in points)
+
+
+def schedule(points, expected):
+    '''The trials, longest expected first'''
+    return sorted(points, key=lambda point: (-expected[point], point))
+
+
+def makespan(order, expected, slots):
+    '''The expected time to run the trials in order on slots (greedy list scheduling)'''
+    finish = [0.0] * max(1, slots)
+    for point in order:
+        i = finish.index(min(finish))
+        finish[i] += expected[point]
+    return max(finish)
+
+
+def cachedFilename(timesfilename, point):
+    '''The file rad-pipeline_trials creates (as $TRIAL_CACHED_FILE) when it answers a trial from the store'''
+    return "%s.M%s_n%s_m%s.cached" % ((os.path.abspath(timesfilename),) + point)
+
+
+def wasCached(timesfilename, point):
+    '''True when a finished trial was answered from the trial store (see cachedFilename)'''
+    if not timesfilename:
+        return False
+    try:
+        os.remove(cachedFilename(timesfilename, point))
+        return True
+    except OSError:
+        return False
+
+
+def exitStatus(status):
+    '''The exit status (as the shell reports it; 128 + signal when killed) of an os.waitpid status'''
+    return status >> 8 if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+
+
+def startTrial(command, point, launcher, cores, timesfilename=None):
+    '''Starts a trial, returns its subprocess.Popen'''
+    env = dict(os.environ)
+    env["TRIAL_ID"] = "M%s_n%s_m%s" % point
+    if timesfilename:
+        env["TRIAL_CACHED_FILE"] = cachedFilename(timesfilename, point)
+        wasCached(timesfilename, point)
+    for i, (name, value) in enumerate(zip(("M", "n", "m"), point)):
+        env["TRIAL_%s" % name] = str(value)
+        command = command.replace("{%s}" % (i + 1), str(value))
+    # in its own process group so the whole trial can be stopped (see trial_supervisor)
+    return subprocess.Popen(launchArgs(launcher, command, cores), env=env, preexec_fn=os.setpgrp)
+
+
+def run(order, command, slots, launcher="local", cores=1, timesfilename=None, supervisor=None):
+    '''
+    Runs the trials, up to slots at once
+
+    @param supervisor: trial_supervisor.Supervisor, stops dominated trials (or None)
+
+    @return: int, the number of trials that failed
+    '''
+    pending = list(order)
+    processes = {}
+    failed = 0
+    while len(pending) > 0 or len(processes) > 0:
+        while len(pending) > 0 and len(processes) < slots:
+            point = pending.pop(0)
+            process = startTrial(command, point, launcher, cores, timesfilename)
+            processes[process.pid] = (point, process, time.time())
+
+        pid, status = trial_supervisor.wait(processes, supervisor)
+        if pid not in processes:
+            continue
+        point, process, start = processes.pop(pid)
+        process.returncode = status
+        status = exitStatus(status)
+        if supervisor is not None and supervisor.reaped(pid, point):
+            status = "pruned"
+        elif status != 0:
+            failed += 1
+            sys.stderr.write("Warning: trial M%s_n%s_m%s failed (exit status %s)\n" % (point + (status,)))
+        else:
+            if wasCached(timesfilename, point):
+                status = "cached"
+            if supervisor is not None:
+                supervisor.finished(point, time.time() - start)
+        if timesfilename:
+            recordTime(timesfilename, point, time.time() - start, status, launcher)
+    return failed
+
+
+def _values(value):
+    try:
+        return [int(v) for v in value.split()]
+    except ValueError:
+        raise ValueError("invalid values '%s', expected whole numbers" % value)
+
+
+def main(argv):
+    '''Application main function'''
+
+    parser = argparse.ArgumentParser(prog="rad-pipeline_schedule_trials", description='Runs a grid of denovo_map.pl optimisation trials across the nodes of a job, longest first')
+
+    parser.add_argument("trial", help="The bash command that runs a trial; {1}, {2} and {3} are replaced by its -M, -n and -m values.")
+    parser.add_argument("-M", nargs=1, metavar='"N ..."', required=True, help="The -M values to try.")
+    parser.add_argument("-n", nargs=1, metavar='"N ..."', required=True, help="The -n values to try.")
+    parser.add_argument("-m", nargs=1, metavar='"N ..."', required=True, help="The -m values to try.")
+    parser.add_argument("-j", "--jobs", nargs=1, metavar='N', type=int, default=[1], help="The number of trials to run at once (across all nodes). [Default: 1]")
+    parser.add_argument("-t", "--cores-task", nargs=1, metavar='T', type=int, default=[1], help="Number of cores each trial uses. [Default: 1]")
+    parser.add_argument("-l", "--launcher", nargs=1, metavar='launcher', default=["local"], choices=LAUNCHERS, help="How trials are started, local or srun (a job step on any node of the job). [Default: local]")
+    parser.add_argument("--times", nargs=1, metavar='file', default=["trial-times.tsv"], help="The file the wall time of each trial is added to (and expected times are read from). [Default: trial-times.tsv]")
+    trial_supervisor.addSupervisorArguments(parser)
+    parser.add_argument("--dry-run", action='store_true', help="Print the order (and expected times) of the trials without running them.")
+
+    args = parser.parse_args(argv[1:])
+
+    try:
+        points = list(itertools.product(_values(args.M[0]), _values(args.n[0]), _values(args.m[0])))
+        supervisor = trial_supervisor.supervisorFromArgs(args)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    slots = max(1, args.jobs[0])
+
+    times = readTimes(args.times[0])
+    expected = expectedTimes(points, times)
+    order = schedule(points, expected)
+    unit = "mins" if len(times) > 0 else "units of work"
+    scale = 60.0 if len(times) > 0 else 1.0
+    sys.stderr.write("Scheduling %s trials on %s slots (%s launcher), expected to take %.1f %s\n" % (len(order), slots, args.launcher[0], makespan(order, expected, slots) / scale, unit))
+
+    if args.dry_run:
+        for point in order:
+            sys.stdout.write("M%s_n%s_m%s\t%.1f\n" % (point + (expected[point] / scale,)))
+        return 0
+
+    failed = run(order, args.trial, slots, args.launcher[0], args.cores_task[0], args.times[0], supervisor)
+    if failed > 0:
+        sys.stderr.write("Error: %s of %s trials failed\n" % (failed, len(order)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
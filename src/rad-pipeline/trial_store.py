@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Keeps the results of denovo_map.pl optimisation trials so no trial is run twice
+
+The phase 1, phase 2 and search jobs all look up each trial in the trial
+store before running it.  A trial is identified by its -M, -n and -m values,
+the other denovo_map.pl options, the stacks version and a fingerprint of the
+input samples (their names and MD5 hashes), so a trial run by phase 1 is
+reused by phase 2 as long as nothing that affects its result has changed.
+
+The store is the directory $RAD_PIPELINE_TRIAL_STORE or
+~/.cache/rad-pipeline/trials.  trials.jsonl has one JSON line per trial
+(with the stats rad-pipeline_collect_denovo_map_stats printed) and
+inputs.provenance the hashes of the input files, which are only hashed
+again when their size or mtime change.
+
+  FINGERPRINT=$(rad-pipeline_trials fingerprint sample1.fq sample2.fq)
+  rad-pipeline_trials run -M 5 -n 6 -m 3 -o "-S -t" -v 1.44 -i $FINGERPRINT "run_trial 5 6 3"
+  rad-pipeline_trials export -o "-S -t" -v 1.44 -i $FINGERPRINT > stats-trials.tsv
+
+'run' prints the stored stats of the trial, or runs 'bash -c COMMAND' and
+stores what it prints (when it succeeds).  When a stored trial is printed
+the file $TRIAL_CACHED_FILE (if set) is created, so rad-pipeline_schedule_trials
+doesn't take its time as the time the trial takes to run.  'export' combines
+the stats of every stored trial of the inputs into one table.
+'''
+
+import os, sys, argparse, hashlib, json, subprocess, time
+
+import stream_hash
+
+TRIALS_FILENAME = "trials.jsonl"
+INPUTS_FILENAME = "inputs.provenance"
+
+
+def storeDir():
+    '''The trial store; $RAD_PIPELINE_TRIAL_STORE or ~/.cache/rad-pipeline/trials'''
+    storedir = os.environ.get('RAD_PIPELINE_TRIAL_STORE')
+    if storedir:
+        return storedir
+    return os.path.join(os.path.expanduser("~"), ".cache", "rad-pipeline", "trials")
+
+
+def _sha1(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True)).hexdigest()
+
+
+def fingerprint(filenames, storedir, jobs=0):
+    '''
+    The fingerprint of a set of input samples (reusing the hashes of unchanged files)
+
+    @param filenames: list, the input files
+    @param jobs: int, the number of files hashed at once (see stream_hash.hashFiles)
+    @return: string, the fingerprint
+    '''
+    provenancefilename = os.path.join(storedir, INPUTS_FILENAME)
+    known = stream_hash.readProvenance(provenancefilename)
+    hashes = {}
+    unknown = []
+    for filename in filenames:
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        record = known.get(path)
+        if record is not None and record["size"] == st.st_size and record["mtime"] == st.st_mtime:
+            hashes[filename] = record["md5"]
+        else:
+            unknown.append(filename)
+
+    if len(unknown) > 0:
+        digests = stream_hash.hashFiles([os.path.realpath(fn) for fn in unknown], jobs)
+        for filename, digest in zip(unknown, digests):
+            hashes[filename] = digest.md5.hexdigest()
+        stream_hash.appendJSON(provenancefilename, [digest.record() for digest in digests])
+
+    # samples are named after their files in the stats
+    return _sha1(sorted([os.path.basename(fn), hashes[fn]] for fn in filenames))
+
+
+def trialKey(M, n, m, opts, version, inputs):
+    '''The key of a trial in the store'''
+    return _sha1([int(M), int(n), int(m), " ".join(opts.split()), version, inputs])
+
+
+def readTrials(storedir):
+    '''
+    Reads the trial store
+
+    @return: dict, key => the latest record
+    '''
+    trials = {}
+    try:
+        with open(os.path.join(storedir, TRIALS_FILENAME)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                trials[record["key"]] = record
+    except IOError:
+        pass
+    return trials
+
+
+def addTrial(storedir, record):
+    '''Adds a trial to the store (array tasks and parallel trials may share one)'''
+    stream_hash.appendJSON(os.path.join(storedir, TRIALS_FILENAME), [record])
+
+
+def runTrial(storedir, command, point, opts, version, inputs, force=False):
+    '''
+    Prints the stats of a trial, running it if it is not in the store
+
+    @param point: tuple, (M, n, m)
+    @param force: bool, run it even if it is in the store
+    @return: int, the exit code (of the trial when it was run)
+    '''
+    key = trialKey(point[0], point[1], point[2], opts, version, inputs)
+    runid = "M%s_n%s_m%s" % point
+    if not force:
+        record = readTrials(storedir).get(key)
+        if record is not None:
+            sys.stderr.write("%s: using the result from the trial store (%s)\n" % (runid, record["date"]))
+            sys.stdout.write(record["stats"])
+            cachedfilename = os.environ.get("TRIAL_CACHED_FILE")
+            if cachedfilename:
+                open(cachedfilename, 'w').close()
+            return 0
+
+    start = time.time()
+    p = subprocess.Popen(["bash", "-c", command], stdout=subprocess.PIPE)
+    stats, _ = p.communicate()
+    sys.stdout.write(stats)
+    if p.returncode != 0:
+        return p.returncode
+
+    addTrial(storedir, {"key": key, "id": runid, "M": point[0], "n": point[1], "m": point[2], "opts": " ".join(opts.split()),
+                        "version": version, "inputs": inputs, "stats": stats, "seconds": round(time.time() - start, 1),
+                        "date": time.strftime("%Y-%m-%d %H:%M:%S")})
+    return 0
+
+
+def exportTrials(storedir, opts, version, inputs, out=sys.stdout):
+    '''
+    Writes the stats of every stored trial of the inputs as one table
+
+    @return: int, the number of trials
+    '''
+    opts = " ".join(opts.split())
+    records = [r for r in readTrials(storedir).values() if r["opts"] == opts and r["version"] == version and r["inputs"] == inputs]
+    records.sort(key=lambda r: (r["M"], r["n"], r["m"]))
+    header = False
+    for record in records:
+        lines = record["stats"].splitlines(True)[1:]
+        if len(lines) == 0:
+            continue
+        if not header:
+            out.write(lines[0])
+            header = True
+        out.writelines(lines[1:])
+    return len(records)
+
+
+def main(argv):
+    '''Application main function'''
+
+    parser = argparse.ArgumentParser(prog="rad-pipeline_trials", description='Keeps the results of denovo_map.pl optimisation trials so no trial is run twice')
+
+    # options shared by the commands, so they may come before or after the arguments
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("-s", "--store", nargs=1, metavar='dir', default=[storeDir()], help="The trial store. [Default: $RAD_PIPELINE_TRIAL_STORE or ~/.cache/rad-pipeline/trials]")
+    trialoptions = argparse.ArgumentParser(add_help=False)
+    trialoptions.add_argument("-o", "--opts", nargs=1, metavar='OPTS', default=[""], help="The other denovo_map.pl options.")
+    trialoptions.add_argument("-v", "--version", nargs=1, metavar='version', default=[""], help="The stacks version.")
+    trialoptions.add_argument("-i", "--inputs", nargs=1, metavar='fingerprint', required=True, help="The fingerprint of the input samples (see fingerprint).")
+
+    commands = parser.add_subparsers(dest="command")
+    fp = commands.add_parser("fingerprint", parents=[options], help="Prints the fingerprint of the input samples.")
+    fp.add_argument("file", nargs="+", help="The input samples.")
+    fp.add_argument("-j", "--jobs", nargs=1, metavar='N', type=int, default=[0], help="The number of files hashed at once, 0=all (up to the number of cores). [Default: 0]")
+    run = commands.add_parser("run", parents=[options, trialoptions], help="Prints the stats of a trial, running it if it is not in the store.")
+    run.add_argument("trial", help="The bash command that runs the trial and prints its stats.")
+    run.add_argument("-M", nargs=1, metavar='N', type=int, required=True, help="The -M value of the trial.")
+    run.add_argument("-n", nargs=1, metavar='N', type=int, required=True, help="The -n value of the trial.")
+    run.add_argument("-m", nargs=1, metavar='N', type=int, required=True, help="The -m value of the trial.")
+    run.add_argument("--force", action='store_true', help="Run the trial even if it is in the store.")
+    commands.add_parser("export", parents=[options, trialoptions], help="Prints the stats of every stored trial of the inputs.")
+
+    args = parser.parse_args(argv[1:])
+
+    storedir = args.store[0]
+    try:
+        if not os.path.isdir(storedir):
+            os.makedirs(storedir)
+        if args.command == "fingerprint":
+            sys.stdout.write("%s\n" % fingerprint(args.file, storedir, args.jobs[0]))
+        elif args.command == "run":
+            return runTrial(storedir, args.trial, (args.M[0], args.n[0], args.m[0]), args.opts[0], args.version[0], args.inputs[0], args.force)
+        elif exportTrials(storedir, args.opts[0], args.version[0], args.inputs[0]) == 0:
+            sys.stderr.write("Warning: no trials of these inputs in '%s'\n" % storedir)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        sys.argv.append("-h")
+    sys.exit(main(sys.argv))
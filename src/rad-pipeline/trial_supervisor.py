@@ -0,0 +1,271 @@
+
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Stops denovo_map.pl optimisation trials that clearly won't beat the best one
+
+While trials run their denovo_map.log is read every --check-interval
+seconds and the per sample stats so far (see
+rad-pipeline_collect_denovo_map_stats) are compared with those of the best
+finished trial (the highest score, see rad-pipeline_denovo_search).  A rule
+such as
+
+  depth<0.5
+
+stops a trial once --prune-after of its samples have a mean merged coverage
+depth less than half that of the same samples in the best trial.  Rules
+name a stat (coverage, depth, reads, matched, unmatched, stacks or catalog),
+< or > and a fraction of the best trial's value; several are separated by
+spaces and any one of them stops a trial.  With --max-time-ratio a trial is
+also stopped once it has run that many times as long as the best trial did.
+There are no rules by default: a rule compares a single stat while trials
+are ranked by score, e.g. depth mostly follows -m and a low -m trial at half
+the best depth can still score higher, so rules are chosen for the samples.
+
+A stopped trial's stats so far are written (with a Status column of
+'pruned: reason') where its stats would have gone, so it shows in the
+combined stats (and isn't run again by a search that is carried on), and
+its cores go to the next trial.
+'''
+
+import os, re, signal, sys, time
+
+import denovo_stats
+
+# rule names => stats columns
+STATS = {
+    "coverage": "Coverage Mean",
+    "depth": "Mean merged coverage depth",
+    "reads": "#utilized reads",
+    "matched": "Matched remainder reads",
+    "unmatched": "Unmatched remainder reads",
+    "stacks": "Stacks",
+    "catalog": "Catalog size (loci)",
+}
+
+_RULE = re.compile(r"^(\w+)([<>])([0-9.]+)$")
+
+# seconds between checks that a trial has finished
+POLL_INTERVAL = 1.0
+
+
+class Rule(object):
+    '''Stops a trial whose stat is less (or more) than a fraction of the best trial's'''
+
+    def __init__(self, text):
+        match = _RULE.match(text)
+        if match is None or match.group(1) not in STATS:
+            raise ValueError("invalid prune rule '%s', expected e.g. depth<0.5 (stats: %s)" % (text, ", ".join(sorted(STATS))))
+        self.text = text
+        self.column = STATS[match.group(1)]
+        self.op = match.group(2)
+        self.fraction = float(match.group(3))
+
+    def check(self, rows, best, minsamples):
+        '''
+        @param rows: list, the trial's per sample stats so far
+        @param best: list, the best trial's per sample stats
+        @return: string, why the trial is dominated (or None)
+        '''
+        bysample = dict((row.get("Sample"), row) for row in best)
+        values = []
+        reference = []
+        for row in rows:
+            value = denovo_stats._number(row, self.column)
+            other = bysample.get(row.get("Sample"))
+            otherval = denovo_stats._number(other, self.column) if other is not None else None
+            if value is not None and otherval is not None:
+                values.append(value)
+                reference.append(otherval)
+        if len(values) < max(1, minsamples) or sum(reference) <= 0:
+            return None
+        ratio = sum(values) / sum(reference)
+        if (self.op == "<" and ratio < self.fraction) or (self.op == ">" and ratio > self.fraction):
+            return "%s is %.2f of the best trial's (%s)" % (self.column, ratio, self.text)
+        return None
+
+
+class Supervisor(object):
+    '''Watches running trials and stops the dominated ones'''
+
+    def __init__(self, rules, logpattern, statspattern, samples=(), minsamples=2, maxtimeratio=0.0, mincoverage=10.0, interval=60):
+        '''
+        @param rules: list, the Rules
+        @param logpattern: string, the denovo_map.log of a running trial ({id} is replaced by e.g. M5_n6_m3)
+        @param statspattern: string, the stats file of a trial ({id} as above)
+        @param samples: list, the sample files (to name the samples of logs)
+        @param minsamples: int, the samples that must have a stat before it is compared
+        @param maxtimeratio: float, stop trials running this many times as long as the best one (0=never)
+        @param mincoverage: float, see denovo_stats.Trial.score
+        @param interval: float, seconds between checks
+        '''
+        self.rules = rules
+        self.logpattern = logpattern
+        self.statspattern = statspattern
+        self.samples = list(samples)
+        self.minsamples = minsamples
+        self.maxtimeratio = maxtimeratio
+        self.mincoverage = mincoverage
+        self.interval = interval
+        self.best = None
+        self.pruned = {}        # pid => why
+        self.nextcheck = time.time() + interval
+
+    def finished(self, point, seconds):
+        '''Reads the stats of a finished trial, it may be the new best'''
+        filename = self.statspattern.replace("{id}", _trialId(point))
+        try:
+            trial = denovo_stats.Trial(point, denovo_stats.readTable(filename), seconds)
+        except IOError:
+            return
+        score = trial.score(self.mincoverage)
+        if score is not None and (self.best is None or score > self.best.score(self.mincoverage)):
+            self.best = trial
+
+    def partial(self, point):
+        '''The per sample stats so far of a running trial'''
+        logfilename = self.logpattern.replace("{id}", _trialId(point))
+        if not os.path.exists(logfilename):
+            return []
+        # only the samples denovo_map.pl has got to; a log without sample
+        # sections can't be matched up until it is finished
+        _, bysample = denovo_stats.parseLog(logfilename)
+        if bysample is None:
+            return []
+        samples = [name for name in map(denovo_stats.sampleName, self.samples) if denovo_stats._sectionName(name, bysample) in bysample]
+        return denovo_stats.sampleRows(_trialId(point), bysample, samples or sorted(bysample))
+
+    def dominated(self, point, elapsed):
+        '''
+        @return: string, why the running trial should be stopped (or None)
+        '''
+        if self.best is None:
+            return None
+        if self.maxtimeratio > 0 and self.best.seconds and elapsed > self.maxtimeratio * self.best.seconds:
+            return "ran %.1f times as long as the best trial" % (elapsed / self.best.seconds)
+        if len(self.rules) == 0:
+            return None
+        rows = self.partial(point)
+        for rule in self.rules:
+            why = rule.check(rows, self.best.samples, self.minsamples)
+            if why is not None:
+                return why
+        return None
+
+    def check(self, processes):
+        '''
+        Stops the dominated trials
+
+        @param processes: dict, pid => (point, subprocess.Popen, start time)
+        '''
+        now = time.time()
+        for pid, (point, process, start) in processes.items():
+            if pid in self.pruned:
+                continue
+            why = self.dominated(point, now - start)
+            if why is not None:
+                sys.stderr.write("[%s] pruning %s: %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), _trialId(point), why))
+                self.pruned[pid] = (why, self.partial(point))
+                try:
+                    os.killpg(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+        self.nextcheck = now + self.interval
+
+    def reaped(self, pid, point):
+        '''
+        Records a stopped trial (once it has exited) as pruned
+
+        @return: bool, the trial was pruned
+        '''
+        if pid not in self.pruned:
+            return False
+        why, rows = self.pruned.pop(pid)
+        for row in rows:
+            row["Status"] = "pruned: %s" % why
+        if len(rows) == 0:
+            rows = [{"RunID": _trialId(point), "Status": "pruned: %s" % why}]
+        filename = self.statspattern.replace("{id}", _trialId(point))
+        with open(filename, 'w') as out:
+            denovo_stats.writeTable(rows, out, self.logpattern.replace("{id}", _trialId(point)))
+        return True
+
+
+def _trialId(point):
+    return "M%s_n%s_m%s" % point
+
+
+def wait(processes, supervisor=None):
+    '''
+    Waits for a trial to finish, stopping dominated trials while waiting
+
+    @param processes: dict, pid => (point, subprocess.Popen, start time)
+    @return: tuple, (pid, status) as os.wait returns them
+    '''
+    if supervisor is None:
+        return os.wait()
+    while True:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid != 0:
+            return (pid, status)
+        if time.time() >= supervisor.nextcheck:
+            supervisor.check(processes)
+        time.sleep(POLL_INTERVAL)
+
+
+def addSupervisorArguments(parser, stats=True):
+    '''Adds the trial supervisor options to parser'''
+    parser.add_argument("--logs", nargs=1, metavar='pattern', help="The denovo_map.log of a running trial, {id} is replaced by e.g. M5_n6_m3.  Trials are only pruned when given.")
+    if stats:
+        parser.add_argument("--stats", nargs=1, metavar='pattern', help="The stats file of a finished trial ({id} as for --logs), pruned trials' stats are written here too.")
+    parser.add_argument("--prune", nargs=1, metavar='rules', default=[""], help="Rules for stopping trials that won't beat the best trial, e.g. 'depth<0.5 reads<0.7' (see rad-pipeline_schedule_trials -h). [Default: '' (never prune)]")
+    parser.add_argument("--prune-after", nargs=1, metavar='N', type=int, default=[2], help="The number of samples that must have a stat before it is compared. [Default: 2]")
+    parser.add_argument("--max-time-ratio", nargs=1, metavar='F', type=float, default=[0.0], help="Also stop trials running F times as long as the best trial, 0=never. [Default: 0]")
+    parser.add_argument("--check-interval", nargs=1, metavar='S', type=float, default=[60.0], help="Seconds between checks of the running trials. [Default: 60]")
+    parser.add_argument("--samples", nargs=1, metavar='"file ..."', default=[""], help="The sample files given to denovo_map.pl (to name the samples in the logs).")
+
+
+def supervisorFromArgs(args, statspattern=None, mincoverage=10.0):
+    '''
+    The Supervisor for the options (see addSupervisorArguments)
+
+    @return: Supervisor, or None when trials aren't to be pruned
+    @raise ValueError: when a rule is invalid
+    '''
+    rules = [Rule(text) for text in args.prune[0].split()]
+    if statspattern is None and getattr(args, "stats", None):
+        statspattern = args.stats[0]
+    if not args.logs or statspattern is None or (len(rules) == 0 and args.max_time_ratio[0] <= 0):
+        return None
+    return Supervisor(rules, args.logs[0], statspattern, args.samples[0].split(), args.prune_after[0],
+                      args.max_time_ratio[0], mincoverage, args.check_interval[0])
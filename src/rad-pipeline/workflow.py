@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+#########################################################################################
+# BSD 3-Clause License                                                                  #
+#                                                                                       #
+# Copyright (c) 2016, Andrew Robinson and La Trobe University                           #
+# All rights reserved.                                                                  #
+#                                                                                       #
+# Redistribution and use in source and binary forms, with or without                    #
+# modification, are permitted provided that the following conditions are met:           #
+#                                                                                       #
+# * Redistributions of source code must retain the above copyright notice, this         #
+#   list of conditions and the following disclaimer.                                    #
+#                                                                                       #
+# * Redistributions in binary form must reproduce the above copyright notice,           #
+#   this list of conditions and the following disclaimer in the documentation           #
+#   and/or other materials provided with the distribution.                              #
+#                                                                                       #
+# * Neither the name of the copyright holder nor the names of its                       #
+#   contributors may be used to endorse or promote products derived from                #
+#   this software without specific prior written permission.                            #
+#                                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"           #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE             #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE        #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE          #
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL            #
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR            #
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER            #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,         #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE         #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                  #
+#########################################################################################
+
+Plans, generates and submits the stages of an experiment as one workflow
+
+The stages follow the experiment directories made by
+rad-pipeline_make_rad_experiment:
+
+  00-raw -> 01-kraken -> 02-filtered -> 03-paired -> 04-demux
+
+Each stage's job script is generated in its directory (as if its generator
+had been run there by hand) and all of them are submitted at once, each job
+depending (afterok) on the jobs that write its inputs.  Inputs that are still
+to be written by an earlier job are matched when the job runs (see
+--deferred of the generators).  With --array, stages whose inputs already
+exist fan out as job arrays (one task per file) followed by a job that
+collates the task logs.
+
+--dry-run prints the plan without writing or submitting anything.
+'''
+
+import os, sys, argparse, shlex, subprocess
+
+import common, make_batch_jobs
+
+# with no arguments the workflow of the current directory is generated (rather than the help shown)
+HELP_WITHOUT_ARGS = False
+
+class Stage(object):
+    '''A stage of the workflow'''
+    
+    def __init__(self, name, directory, generator, script, inputs, dirfilter, options=(), array=True):
+        '''
+        @param name: string, the stage name
+        @param directory: string, the stage directory (relative to the experiment)
+        @param generator: string, the job generator (see make_batch_jobs.loadGenerator)
+        @param script: string, the job script filename
+        @param inputs: list, the files/directories processed (relative to the stage directory)
+        @param dirfilter: string, the generator's default --dir-filter
+        @param options: list, other generator options (which may also name inputs)
+        @param array: bool, the generator supports --array
+        '''
+        self.name = name
+        self.directory = directory
+        self.generator = generator
+        self.script = script
+        self.inputs = list(inputs)
+        self.dirfilter = dirfilter
+        self.options = list(options)
+        self.array = array
+    
+    def filter(self):
+        '''The --dir-filter used by the stage'''
+        for i, option in enumerate(self.options[:-1]):
+            if option in ("-f", "--dir-filter"):
+                return self.options[i + 1]
+        return self.dirfilter
+
+
+# the standard RADseq pipeline
+STAGES = [
+    Stage("fastqc",   "00-raw-fastqc", "fastqc",   "run_fastqc",   ["../00-raw"],      "*.f*q"),
+    Stage("kraken",   "01-kraken",     "kraken",   "run_kraken",   ["../00-raw"],      "*.fastq"),
+    Stage("seq-sets", "02-filtered",   "seq-sets", "run_seq-sets", ["../00-raw"],      "*.f*q", ["-k", "../01-kraken"]),
+    Stage("pear",     "03-paired",     "pear",     "run_pear",     ["../02-filtered"], "*_R1_*.f*q*"),
+    Stage("demux",    "04-demux",      "demux",    "run_demux",    ["../03-paired"],   "*_R1_*.f*q*", ["-f", "*mergeforward.f*q*"], array=False),
+]
+
+DEFAULT_STAGES = "kraken,seq-sets,pear,demux"
+
+
+class Node(object):
+    '''A job of the workflow'''
+    
+    def __init__(self, name, stage, after, array=False, deferred=(), collate=None):
+        self.name = name
+        self.stage = stage
+        self.after = after          # list of (node, dependency type)
+        self.array = array
+        self.deferred = list(deferred)
+        self.collate = collate      # the array node this node collates (or None)
+        self.tasks = None
+        self.jobid = None
+
+
+def plan(experiment, stages, array=False):
+    '''
+    Builds the job graph of the stages
+    
+    @param experiment: string, the experiment directory
+    @param stages: list, the Stages to run (in order)
+    @param array: bool, fan out stages as job arrays when their inputs exist
+    @return: list, the Nodes in submission order
+    '''
+    nodes = []
+    writers = {}
+    for stage in stages:
+        stagedir = os.path.join(experiment, stage.directory)
+        after = []
+        deferred = []
+        for path in stage.inputs + stage.options:
+            inputdir = os.path.normpath(os.path.join(stagedir, path))
+            if inputdir in writers and inputdir not in deferred:
+                after.append((writers[inputdir], "afterok"))
+                deferred.append(inputdir)
+        
+        # array tasks are made from the files that exist now
+        fanout = array and stage.array and len(deferred) == 0
+        node = Node(stage.name, stage, after, fanout, deferred)
+        nodes.append(node)
+        if fanout:
+            collate = Node("%s.collate" % stage.name, stage, [(node, "afterany")], collate=node)
+            nodes.append(collate)
+        writers[stagedir] = node
+    return nodes
+
+
+def generatorArgs(node, experiment):
+    '''The generator arguments for a stage node'''
+    stagedir = os.path.join(experiment, node.stage.directory)
+    args = list(node.stage.options)
+    if node.array:
+        args.append("--array")
+    for inputdir in node.deferred:
+        args.extend(["--deferred", os.path.relpath(inputdir, stagedir)])
+    return args + ["--"] + node.stage.inputs
+
+
+def describe(nodes, experiment, out=sys.stdout):
+    '''Prints the job graph'''
+    out.write("Workflow: %s\n" % os.path.abspath(experiment))
+    for node in nodes:
+        if node.collate is not None:
+            job = "bash %s collate" % node.stage.script
+            kind = "collate"
+        else:
+            job = os.path.join(node.stage.directory, node.stage.script)
+            if node.array:
+                kind = "array"
+                if node.tasks is not None:
+                    kind = "array[%s]" % node.tasks
+            else:
+                kind = "job"
+        after = ", ".join(["%s(%s)" % (dep.name, how) for dep, how in node.after]) or "-"
+        out.write("  %-16s %-28s %-10s after: %s\n" % (node.name, job, kind, after))
+        for inputdir in node.deferred:
+            out.write("  %-16s %-28s %-10s deferred input: %s\n" % ("", "", "", os.path.relpath(inputdir, experiment)))
+
+
+def countTasks(node, experiment):
+    '''Counts the array tasks (input files) of a node'''
+    stagedir = os.path.join(experiment, node.stage.directory)
+    inputs = [os.path.normpath(os.path.join(stagedir, path)) for path in node.stage.inputs]
+    return len(common.expandFiles(inputs, node.stage.filter(), quiet=True))
+
+
+def submit(node, experiment, sbatch="sbatch"):
+    '''
+    Submits a node with sbatch
+    
+    @return: string, the job id
+    '''
+    stagedir = os.path.join(experiment, node.stage.directory)
+    cmd = shlex.split(sbatch) + ["--parsable"]
+    dependencies = {}
+    for dep, how in node.after:
+        dependencies.setdefault(how, []).append(dep.jobid)
+    if len(dependencies) > 0:
+        cmd.append("--dependency=%s" % ",".join(["%s:%s" % (how, ":".join(ids)) for how, ids in sorted(dependencies.items())]))
+    if node.collate is not None:
+        logname = "%s-collated.log" % node.stage.name
+        cmd.extend(["--job-name=%s" % node.name, "--output=%s" % logname, "--wrap", "bash %s collate" % node.stage.script])
+    else:
+        cmd.append(node.stage.script)
+    output = subprocess.check_output(cmd, cwd=stagedir)
+    # --parsable prints "jobid[;cluster]"
+    return output.strip().split(";")[0]
+
+
+def main(argv):
+    '''Application main function'''
+    
+    parser = argparse.ArgumentParser(prog="rad-pipeline_workflow", description='Generates the job scripts of an experiment and submits them with dependencies so the whole pipeline is queued at once')
+    
+    parser.add_argument("experiment", nargs="?", default=".", help="The experiment directory. [Default: .]")
+    parser.add_argument("-s", "--stages", nargs=1, metavar='list', default=[DEFAULT_STAGES], help="Comma separated stages to run, from %s. [Default: %s]" % (",".join([s.name for s in STAGES]), DEFAULT_STAGES))
+    parser.add_argument("--args", action='append', metavar='STAGE=ARGS', default=[], help="Replace the inputs of a stage, e.g. --args 'pear=../00-raw'.  May be repeated.")
+    parser.add_argument("--options", action='append', metavar='STAGE=OPTS', default=[], help="Replace the other generator options of a stage, e.g. --options 'kraken=-j 8 -f *.fq'.  May be repeated.")
+    parser.add_argument("-a", "--array", action='store_true', help="Run stages whose inputs already exist as job arrays (one task per file).")
+    parser.add_argument("-n", "--dry-run", action='store_true', help="Print the job graph without generating or submitting anything.")
+    parser.add_argument("--no-submit", action='store_true', help="Generate the job scripts but don't submit them.")
+    parser.add_argument("--sbatch", nargs=1, metavar='cmd', default=["sbatch"], help="The command used to submit jobs. [Default: sbatch]")
+    
+    args = parser.parse_args(argv[1:])
+    
+    experiment = os.path.abspath(args.experiment)
+    byname = dict((s.name, s) for s in STAGES)
+    stages = []
+    for name in args.stages[0].split(","):
+        if name not in byname:
+            sys.stderr.write("Error: unknown stage '%s'\n" % name)
+            return 1
+        stages.append(byname[name])
+    stages.sort(key=STAGES.index)
+    for values, attribute in ((args.args, "inputs"), (args.options, "options")):
+        for value in values:
+            name, _, stageargs = value.partition("=")
+            if name not in byname:
+                sys.stderr.write("Error: unknown stage '%s'\n" % name)
+                return 1
+            setattr(byname[name], attribute, shlex.split(stageargs))
+    
+    nodes = plan(experiment, stages, args.array)
+    for node in nodes:
+        if node.array:
+            node.tasks = countTasks(node, experiment)
+    
+    if args.dry_run:
+        describe(nodes, experiment)
+        return 0
+    
+    # generate every script before submitting anything
+    for node in nodes:
+        if node.collate is not None:
+            continue
+        stagedir = os.path.join(experiment, node.stage.directory)
+        if not os.path.isdir(stagedir):
+            os.makedirs(stagedir)
+        job = make_batch_jobs.Job(os.path.basename(experiment), node.stage.directory, node.stage.generator, node.stage.script, generatorArgs(node, experiment))
+        if make_batch_jobs.generate(job, os.path.dirname(experiment)) != 0:
+            sys.stderr.write("Error: failed to generate '%s'\n" % job.name())
+            return 1
+    
+    describe(nodes, experiment)
+    if args.no_submit:
+        return 0
+    
+    for node in nodes:
+        try:
+            node.jobid = submit(node, experiment, args.sbatch[0])
+        except (OSError, subprocess.CalledProcessError) as e:
+            sys.stderr.write("Error: failed to submit %s: %s\n" % (node.name, e))
+            return 1
+        common.writelog("Submitted workflow job %s: %s" % (node.name, node.jobid))
+        print "%s\t%s" % (node.name, node.jobid)
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))